@@ -1,9 +1,14 @@
 from src.test_executor import TestExecutor
 import json
+import os
 from rich.console import Console
 from rich.panel import Panel
-from src.models import LoadTestConfig, SingleTestConfig
+from src.models import CapacitySearchConfig, LoadTestConfig, SingleTestConfig
 from src.load_test_generator import LoadTestGenerator
+from src.churn import run_churn_benchmark
+from src.capacity_search import run_capacity_search
+from src.utils.exporter import MetricsExporter
+from src.utils.logger import LogListener
 
 
 console = Console(width=140)
@@ -22,21 +27,115 @@ def main():
                        help='Path to load test parameters configuration file (default: load_test_params.json)')
     parser.add_argument('--single-config', type=str,
                        help='JSON file of a single test configuration to run')
-    parser.add_argument('--pipeline-config', type=str,
-                       help='JSON file of a pipeline configuration to run', default="config/glassflow/deduplication_pipeline.json")
-    parser.add_argument('--glassflow-host', type=str, default='http://localhost:8080',
-                       help='GlassFlow host URL (default: http://localhost:8080)')
+    parser.add_argument('--pipeline-config', type=str, nargs='+', default=["config/glassflow/deduplication_pipeline.json"],
+                       help='JSON file of a pipeline configuration to run, or one per GlassFlow host')
+    parser.add_argument('--event-schema', default='config/glassgen/user_event.json',
+                       help='glassgen schema of the published events, with a left and a right schema for join pipelines (default: config/glassgen/user_event.json)')
+    parser.add_argument('--glassflow-host', type=str, nargs='+', default=['http://localhost:8080'],
+                       help='GlassFlow host URL, several hosts of isolated stacks run variants concurrently (default: http://localhost:8080)')
+    parser.add_argument('--sample-interval', type=float, default=0.5,
+                       help='Interval in seconds for sampling published and sunk records during a test (default: 0.5)')
+    parser.add_argument('--count-mode', choices=['system', 'exact'], default='system',
+                       help='How to count rows in ClickHouse while polling: from system tables metadata or with an exact count() (default: system)')
+    parser.add_argument('--dataset-cache-dir', default='cache/datasets',
+                       help='Directory of the pre-generated event datasets used by the replay producer engine (default: cache/datasets)')
+    parser.add_argument('--dataset-seed', type=int, default=42,
+                       help='Seed for generating the event datasets of the replay producer engine (default: 42)')
+    parser.add_argument('--churn-cycles', type=int,
+                       help='Benchmark the control plane instead of running load tests: create, wait until ready and delete a pipeline this many times')
+    parser.add_argument('--churn-records', type=int, default=1000,
+                       help='Records sent through the pipeline in every churn cycle (default: 1000)')
+    parser.add_argument('--soak-window', type=float, default=60,
+                       help='Window in seconds over which the metrics of soak tests are aggregated (default: 60)')
+    parser.add_argument('--capacity-search', type=str,
+                       help='JSON file of a capacity search: find the highest rate the pipeline sustains within the SLO instead of running the configured variants')
+    parser.add_argument('--compose-file', default='docker-compose.yaml',
+                       help='Compose file of the local stack whose containers are sampled for resource usage, empty to only sample the publishers (default: docker-compose.yaml)')
+    parser.add_argument('--resource-interval', type=float, default=1.0,
+                       help='Interval in seconds for sampling CPU, memory, network and disk I/O during a test (default: 1)')
+    parser.add_argument('--no-dashboard', action='store_true',
+                       help='Log progress instead of showing a live dashboard while a variant runs')
+    parser.add_argument('--metrics-port', type=int,
+                       help='Expose live and finished variant metrics in the Prometheus text format on this port at /metrics')
+    parser.add_argument('--repetitions', type=int,
+                       help='Trials of every variant, overrides the repetitions of the config file (default: 1)')
+    parser.add_argument('--cleanup-workers', type=int, default=4,
+                       help='Tables dropped at the same time when cleaning up after a variant (default: 4)')
     
-    args = parser.parse_args()    
-    executor = TestExecutor(    
-        results_dir=args.results_dir,
-        test_id=args.test_id,
-        pipeline_config_path=args.pipeline_config,
-        glassflow_host=args.glassflow_host
-    )
+    args = parser.parse_args()
+    # the records logged by all processes are rendered by one listener and kept next to the results
+    with LogListener(os.path.join(args.results_dir, f"{args.test_id}_log.jsonl")):
+        run(args)
+
+
+def run(args):
+    """Run the load tests, churn benchmark or capacity search selected by the arguments"""
+    if args.churn_cycles:
+        run_churn_benchmark(
+            test_id=args.test_id,
+            results_dir=args.results_dir,
+            pipeline_config_path=args.pipeline_config[0],
+            glassflow_host=args.glassflow_host[0],
+            cycles=args.churn_cycles,
+            records_per_cycle=args.churn_records
+        )
+        return
+
+    exporter = None
+    if args.metrics_port:
+        try:
+            exporter = MetricsExporter(args.metrics_port, args.results_dir, args.test_id).start()
+        except OSError as e:
+            console.print(Panel(
+                f"[red]Cannot expose metrics on port {args.metrics_port}: {str(e)}[/red]",
+                title="❌ Error",
+                border_style="red"
+            ))
+            return
+
+    try:
+        executor = TestExecutor(    
+            results_dir=args.results_dir,
+            test_id=args.test_id,
+            pipeline_config_path=args.pipeline_config,
+            glassflow_host=args.glassflow_host,
+            event_schema=args.event_schema,
+            sample_interval=args.sample_interval,
+            count_mode=args.count_mode,
+            dataset_cache_dir=args.dataset_cache_dir,
+            dataset_seed=args.dataset_seed,
+            soak_window_sec=args.soak_window,
+            cleanup_workers=args.cleanup_workers,
+            compose_file=args.compose_file or None,
+            resource_interval=args.resource_interval,
+            dashboard=not args.no_dashboard,
+            exporter=exporter
+        )
+    except ValueError as e:
+        console.print(Panel(
+            f"[red]Invalid stacks: {str(e)}[/red]",
+            title="❌ Error",
+            border_style="red"
+        ))
+        return
+
+    if args.capacity_search:
+        try:
+            with open(args.capacity_search) as f:
+                search_config = CapacitySearchConfig.model_validate_json(f.read())
+        except Exception as e:
+            console.print(Panel(
+                f"[red]Invalid capacity search configuration: {str(e)}[/red]",
+                title="❌ Error",
+                border_style="red"
+            ))
+            return
+        run_capacity_search(executor, search_config, resume=not args.no_resume)
+        return
 
     single_config = None  
     combinations = []  
+    repetitions = 1
     if args.single_config:
         try:
             with open(args.single_config) as f:
@@ -61,6 +160,7 @@ def main():
         try:            
             generator = LoadTestGenerator(args.config)
             combinations = generator.generate_combinations()
+            repetitions = generator.config.repetitions
         except Exception as e:
             console.print(Panel(
                 f"[red]Invalid configuration format: {str(e)}[/red]",
@@ -70,7 +170,12 @@ def main():
             return
 
     # run the tests
-    executor.run_tests(resume=not args.no_resume, variant_configs=combinations)
+    if args.repetitions is not None:
+        if args.repetitions < 1:
+            console.print(Panel("[red]--repetitions must be at least 1[/red]", title="❌ Error", border_style="red"))
+            return
+        repetitions = args.repetitions
+    executor.run_tests(resume=not args.no_resume, variant_configs=combinations, repetitions=repetitions)
 
 if __name__ == "__main__":
     main()
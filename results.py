@@ -1,11 +1,15 @@
 import pandas as pd
 import json
 import argparse
+import sys
 from typing import List
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
-from src.utils.metrics import TestResultsHandler
+from pathlib import Path
+from src.utils.metrics import TestResultModel, TestResultsHandler
+from src.utils.results_store import RESULTS_DB, ResultsStore
+from src.compare import run_comparison
 import traceback
 console = Console(width=80)
 
@@ -39,23 +43,21 @@ def display_variant_results(row):
     # Prepare parameters section
     params = {
         'Variant ID': row['variant_id'],
+        'Trial': row.get('trial', 1),
         'Max Batch Size': row['param_max_batch_size'],
         'Duplication Rate': row['param_duplication_rate'],
         'Deduplication Window': row['param_deduplication_window'],
-        'Max Delay Time': row['param_max_delay_time']
+        'Max Delay Time': row['param_max_delay_time'],
+        'Target RPS': row['param_target_rps'] or 'unlimited',
+        'Producer Engine': row['param_producer_engine'],
+        'Load Profile': row.get('param_load_profile') or 'none'
     }
     
-    # Prepare results section
-    results = {
-        'Success': f"{row['result_success']}",
-        'Number of Records': f"{round(row['result_num_records'] / 1_000_000, 2)}M",
-        'Time to Publish': f"{round(row['result_time_taken_publish_ms']/ 1000, 2)} s",
-        'Source RPS in Kafka': f"{round(row['result_kafka_ingestion_rps'])} records/s",
-        'GlassFlow RPS': f"{round(row['result_glassflow_rps'])} records/s",
-        'Time to Process': f"{round(row['result_time_taken_ms']/ 1000, 4)} s",
-        'Average Latency': f"{round(row['result_avg_latency_ms']/ 1000, 4)} s",
-        'Lag': f"{round(row['result_lag_ms']/ 1000, 4)} s"
-    }
+    # Prepare results section, a variant that failed before publishing has no measurements
+    if row['result_num_records'] is None:
+        results = {'Success': f"{row['result_success']}"}
+    else:
+        results = _measured_results(row)
     
     # Create the output structure
     output = {
@@ -76,6 +78,30 @@ def display_variant_results(row):
     console.print(panel)
     console.print()  # Add a blank line between variants
 
+def _measured_results(row) -> dict:
+    """Results section of a variant that published its records"""
+    results = {
+        'Success': f"{row['result_success']}",
+        'Number of Records': f"{round(row['result_num_records'] / 1_000_000, 2)}M",
+        'Time to Publish': f"{round(row['result_time_taken_publish_ms']/ 1000, 2)} s",
+        'Source RPS in Kafka': f"{round(row['result_kafka_ingestion_rps'])} records/s",
+        'Target RPS Sustained': f"{row['result_rps_sustained']}",
+        'GlassFlow RPS': f"{round(row['result_glassflow_rps'])} records/s",
+        'Time to Process': f"{round(row['result_time_taken_ms']/ 1000, 4)} s",
+        'Average Latency': f"{round(row['result_avg_latency_ms']/ 1000, 4)} s",
+        'Lag': f"{round(row['result_lag_ms']/ 1000, 4)} s"
+    }
+    if row.get('result_profile_max_backlog') is not None:
+        results['Load Profile Max Backlog'] = f"{row['result_profile_max_backlog']} records"
+        results['Load Profile Max Drain Lag'] = f"{row['result_profile_max_drain_lag_sec']} s"
+    if row.get('result_latency_p99_ms') is not None:
+        results['Latency p50'] = f"{round(row['result_latency_p50_ms'], 2)} ms"
+        results['Latency p90'] = f"{round(row['result_latency_p90_ms'], 2)} ms"
+        results['Latency p99'] = f"{round(row['result_latency_p99_ms'], 2)} ms"
+        results['Latency p99.9'] = f"{round(row['result_latency_p999_ms'], 2)} ms"
+        results['Latency max'] = f"{round(row['result_latency_max_ms'], 2)} ms"
+    return results
+
 def display_results(results: List):
     # Display results for each variant
     console.print("[bold blue]Test Results:[/bold blue]")
@@ -83,11 +109,48 @@ def display_results(results: List):
     for row in results:
         display_variant_results(row)
 
+def display_columns(results_dir: str, columns: List[str]):
+    """Display the given columns of the results of all tests in the results database"""
+    store = ResultsStore(Path(results_dir) / RESULTS_DB, TestResultModel)
+    unknown = [column for column in columns if column not in store.fields]
+    if unknown:
+        console.print(f"[red]Error: Unknown result columns: {', '.join(unknown)}[/red]")
+        return
+    results = pd.DataFrame(store.query(["test_id", "variant_id", *columns]))
+    console.print(results.to_string(index=False) if not results.empty else "No results")
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze load test results from a CSV file')
-    parser.add_argument('--results-file', required=True,
+    parser.add_argument('--results-file',
                        help='Path to the results CSV file (e.g., results/test_id_results.csv)')
+    parser.add_argument('--columns', nargs='+',
+                       help='Instead of the results of one test, show these columns of all tests in the results database')
+    parser.add_argument('--results-dir', default='results',
+                       help='Directory of the results database used with --columns and --compare (default: results)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                       help='Compare the variants of two test IDs that ran with identical parameters, '
+                            'exits with 1 if the candidate regressed')
+    parser.add_argument('--threshold', type=float, default=5.0,
+                       help='Change in percent beyond which a worse metric is a regression (default: 5)')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                       help='Significance level of a regression (default: 0.05)')
     args = parser.parse_args()
+    if args.compare:
+        store = ResultsStore(Path(args.results_dir) / RESULTS_DB, TestResultModel)
+        try:
+            regressed = run_comparison(store, *args.compare, args.results_dir, args.threshold, args.alpha)
+        except ValueError as e:
+            console.print(f"[red]Error: {e}[/red]")
+            sys.exit(2)
+        if regressed:
+            console.print(f"[red]{args.compare[1]} regressed against {args.compare[0]}[/red]")
+            sys.exit(1)
+        return
+    if args.columns:
+        display_columns(args.results_dir, args.columns)
+        return
+    if not args.results_file:
+        parser.error("--results-file, --columns or --compare is required")
 
     try:
         handler = TestResultsHandler(args.results_file)
@@ -0,0 +1,195 @@
+import csv
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+from rich.console import Console
+from rich.panel import Panel
+from src.models import CapacitySearchConfig
+from src.utils.logger import log
+from src.utils.metrics import TestResultModel
+from src.utils.stats import wilson_lower_bound
+
+console = Console(width=140)
+
+PROBE_FIELDS = [
+    "probe", "rate", "confirmation", "passed", "reasons", "variant_id",
+    "latency_p99_ms", "drain_lag_sec", "sink_rps_mean", "kafka_ingestion_rps",
+]
+# factor by which the rate grows after a pass, and shrinks after a fail, until both were seen
+STEP_FACTOR = 2
+
+
+def probe_verdict(result: TestResultModel, config: CapacitySearchConfig) -> Tuple[bool, List[str]]:
+    """Whether the pipeline kept up with the rate of a probe, and why not"""
+    reasons = []
+    if not result.result_success:
+        reasons.append("records missing")
+    if result.result_rps_sustained is False:
+        # the publishers are the bottleneck, the pipeline was not offered the rate
+        reasons.append("publishers below target rate")
+    if result.result_latency_p99_ms is None or result.result_latency_p99_ms > config.slo_latency_p99_ms:
+        reasons.append(f"latency p99 {result.result_latency_p99_ms} ms above {config.slo_latency_p99_ms} ms")
+    if result.result_lag_ms is None or result.result_lag_ms > config.max_drain_lag_sec * 1000:
+        drain_lag = result.result_lag_ms / 1000 if result.result_lag_ms is not None else None
+        reasons.append(f"drain lag {drain_lag} s above {config.max_drain_lag_sec} s")
+    return not reasons, reasons
+
+
+class CapacitySearch:
+    """Search for the highest rate at which the pipeline drains in time and meets the latency SLO
+
+    Starting at `start_rps`, the rate doubles after every passing probe and halves after every
+    failing one until a passing rate and a failing rate above it are known. The bracket is then
+    bisected until the failing rate is within `resolution` of the passing one. The passing rate
+    is confirmed with `confirm_trials` more probes; if one of them fails, that rate counts as
+    failing and the search continues below it.
+
+    `run_probe(variant_config)` runs one probe and returns its result.
+    """
+
+    def __init__(self, config: CapacitySearchConfig, run_probe: Callable[[Dict], TestResultModel]):
+        self.config = config
+        self.run_probe = run_probe
+        self.probes: List[Dict] = []
+        # highest passing and lowest failing rate
+        self.low: Optional[int] = None
+        self.high: Optional[int] = None
+
+    def _probe(self, rate: int, confirmation: bool = False) -> bool:
+        variant_config = {
+            **self.config.variant.model_dump(),
+            "target_rps": rate,
+            "total_records": max(1, round(rate * self.config.probe_duration_sec)),
+            # every probe is its own variant, repeated rates included
+            "probe": len(self.probes),
+        }
+        result = self.run_probe(variant_config)
+        passed, reasons = probe_verdict(result, self.config)
+        self.probes.append({
+            "probe": len(self.probes),
+            "rate": rate,
+            "confirmation": confirmation,
+            "passed": passed,
+            "reasons": "; ".join(reasons),
+            "variant_id": result.variant_id,
+            "latency_p99_ms": result.result_latency_p99_ms,
+            "drain_lag_sec": result.result_lag_ms / 1000 if result.result_lag_ms is not None else None,
+            "sink_rps_mean": result.result_sink_rps_mean,
+            "kafka_ingestion_rps": result.result_kafka_ingestion_rps,
+        })
+        log(
+            message=f"Probe {len(self.probes)} at {rate} records/s" + (f": {'; '.join(reasons)}" if reasons else ""),
+            status="Passed" if passed else "Failed",
+            is_success=passed,
+            is_warning=not passed,
+            component="Capacity",
+        )
+        return passed
+
+    def _next_rate(self) -> Optional[int]:
+        """Rate of the next search probe, None once the bracket is narrow enough"""
+        config = self.config
+        if self.low is None and self.high is None:
+            return config.start_rps or config.min_rps
+        if self.low is None:
+            return max(config.min_rps, self.high // STEP_FACTOR) if self.high > config.min_rps else None
+        if self.high is None:
+            return min(config.max_rps, self.low * STEP_FACTOR) if self.low < config.max_rps else None
+        if (self.high - self.low) / self.low > config.resolution and self.high - self.low > 1:
+            return (self.low + self.high) // 2
+        return None
+
+    def _confirm(self) -> bool:
+        """Probe the passing rate again, it stays the passing rate only if every probe passes"""
+        for _ in range(self.config.confirm_trials):
+            if len(self.probes) >= self.config.max_probes:
+                return False
+            if not self._probe(self.low, confirmation=True):
+                self.high = self.low
+                passing_below = [p["rate"] for p in self.probes if p["passed"] and p["rate"] < self.high]
+                self.low = max(passing_below) if passing_below else None
+                return False
+        return True
+
+    def run(self) -> Dict:
+        confirmed = False
+        while len(self.probes) < self.config.max_probes:
+            rate = self._next_rate()
+            if rate is None:
+                if self.low is None:
+                    break
+                confirmed = self._confirm()
+                if confirmed or len(self.probes) >= self.config.max_probes:
+                    break
+                continue
+            if self._probe(rate):
+                self.low = rate
+            else:
+                self.high = rate
+        return self.summary(confirmed)
+
+    def summary(self, confirmed: bool) -> Dict:
+        """The capacity found and how certain it is
+
+        The capacity is the highest passing rate, the pipeline failed at `failing_rps`, so its
+        capacity lies in between. `pass_rate_lower_bound` is the 95% lower bound on the
+        probability that a probe at the capacity passes, from all probes at that rate.
+        """
+        at_capacity = [p for p in self.probes if p["rate"] == self.low]
+        passes = sum(p["passed"] for p in at_capacity)
+        lower_bound = wilson_lower_bound(passes, len(at_capacity))
+        return {
+            "sustainable_rps": self.low,
+            "failing_rps": self.high,
+            "bracket_pct": round((self.high - self.low) / self.low * 100, 2) if self.low and self.high else None,
+            "confirmed": confirmed,
+            "probes_at_capacity": len(at_capacity),
+            "passes_at_capacity": passes,
+            "pass_rate_lower_bound": round(lower_bound, 3) if lower_bound is not None else None,
+            "probes": len(self.probes),
+        }
+
+
+def display_capacity_summary(summary: Dict, config: CapacitySearchConfig):
+    if summary["sustainable_rps"] is None:
+        body = f"[red]No rate down to {config.min_rps} records/s met the SLO[/red]"
+    else:
+        upper = (f"below {summary['failing_rps']} records/s (+{summary['bracket_pct']}%)"
+                 if summary["failing_rps"] else f"above the max of {config.max_rps} records/s")
+        body = (
+            f"[bold green]Sustainable rate:[/bold green] {summary['sustainable_rps']} records/s\n"
+            f"[bold green]Capacity:[/bold green] {upper}\n"
+            f"[bold green]Passed:[/bold green] {summary['passes_at_capacity']}/{summary['probes_at_capacity']} probes at this rate, "
+            f"pass rate >= {summary['pass_rate_lower_bound']} (95%)"
+            + ("" if summary["confirmed"] else "\n[yellow]Not confirmed, the search ran out of probes[/yellow]")
+        )
+    console.print(Panel(
+        body + f"\n[bold blue]SLO:[/bold blue] latency p99 <= {config.slo_latency_p99_ms} ms, "
+               f"drain lag <= {config.max_drain_lag_sec} s\n[bold blue]Probes:[/bold blue] {summary['probes']}",
+        title="📈 Maximum Sustainable Throughput",
+        border_style="green" if summary["sustainable_rps"] else "red"
+    ))
+
+
+def run_capacity_search(executor, config: CapacitySearchConfig, resume: bool = True) -> Dict:
+    """Run the capacity search with the probes run by a `TestExecutor`
+
+    Every probe is stored as a variant of the test. The search only depends on the probe
+    results, so with `resume` an interrupted search replays the stored probes and continues
+    where it stopped. The probes go to `<test_id>_capacity.csv`, the summary to
+    `<test_id>_capacity_summary.csv`.
+    """
+    search = CapacitySearch(config, lambda variant_config: executor.run_config(variant_config, resume=resume))
+    with executor.resources:
+        summary = search.run()
+
+    os.makedirs(executor.results_dir, exist_ok=True)
+    with open(os.path.join(executor.results_dir, f"{executor.test_id}_capacity.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PROBE_FIELDS)
+        writer.writeheader()
+        writer.writerows(search.probes)
+    with open(os.path.join(executor.results_dir, f"{executor.test_id}_capacity_summary.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(summary))
+        writer.writeheader()
+        writer.writerow(summary)
+    display_capacity_summary(summary, config)
+    return summary
@@ -0,0 +1,156 @@
+import csv
+import json
+import os
+import time
+from typing import Dict, List
+from rich.console import Console
+from rich.table import Table
+from src.models import SingleTestConfig
+from src.native_events import generate_events_native
+from src.pipeline_test import wait_for_records
+from src.pre_process import setup_pipeline
+from src.utils.cleanup import CleanupManifest, cleanup_artifacts
+from src.utils.clickhouse import clickhouse_connection, read_clickhouse_table_size
+from src.utils.logger import log
+from src.utils.pipeline import GlassFlowPipeline
+from src.utils.resources import ResourceManager
+from src.utils.stats import distribution, mann_kendall_z, theil_sen_slope
+
+console = Console(width=140)
+
+# control-plane operations timed in every cycle, in milliseconds
+CHURN_OPERATIONS = {
+    "create_request_ms": "Create request",
+    "time_to_running_ms": "Create until running",
+    "time_to_ready_ms": "Create until ready",
+    "delete_request_ms": "Delete request",
+    "time_to_deleted_ms": "Delete until gone",
+}
+CHURN_FIELDS = ["cycle", "pipeline_id", *CHURN_OPERATIONS, "data_ms", "error"]
+# Mann-Kendall statistic above which a latency counts as growing with the cycles (5% level)
+GROWTH_Z_THRESHOLD = 1.96
+
+
+def run_churn_cycle(pipeline: GlassFlowPipeline, cycle: int, pipeline_config_path: str, event_schema: str,
+                    records_per_cycle: int) -> Dict:
+    """Create a pipeline, wait until it is ready, send it a few records and delete it again"""
+    variant_id = f"load_churn_{cycle:04d}"
+    variant_config = SingleTestConfig(total_records=records_per_cycle).model_dump()
+    row = {"cycle": cycle, "pipeline_id": variant_id, "error": ""}
+    manifest = CleanupManifest()
+    try:
+        config = setup_pipeline(variant_id, pipeline_config_path, variant_config, pipeline, event_schema, manifest).config
+        row["create_request_ms"] = pipeline.create_request_ms
+        row["time_to_running_ms"] = pipeline.time_to_running_ms
+        row["time_to_ready_ms"] = pipeline.time_to_ready_ms
+
+        with clickhouse_connection(config.sink) as client:
+            n_records_before = read_clickhouse_table_size(config.sink, client)
+            start_time = time.time()
+            stats = generate_events_native(
+                config.source, event_schema,
+                duplication_rate=variant_config["duplication_rate"], num_records=records_per_cycle
+            )
+            records_available, end_time = wait_for_records(
+                client, config, n_records_before, stats["total_generated"], timeout_sec=300, count_mode="exact"
+            )
+        if not records_available:
+            raise TimeoutError(f"Records of cycle {cycle} did not arrive in ClickHouse")
+        row["data_ms"] = round((end_time - start_time) * 1000)
+
+        start_time = time.time()
+        pipeline.delete_pipeline()
+        row["delete_request_ms"] = round((time.time() - start_time) * 1000)
+        pipeline.wait_until_deleted()
+        row["time_to_deleted_ms"] = round((time.time() - start_time) * 1000)
+    except Exception as e:
+        row["error"] = str(e)
+        log(
+            message=f"Churn cycle {cycle}",
+            status=str(e),
+            is_failure=True,
+            component="Churn",
+        )
+        pipeline.stop_pipeline_if_running()
+    finally:
+        connections = GlassFlowPipeline.load_conf(json.load(open(pipeline_config_path)))
+        cleanup_artifacts(manifest, connections.source, connections.sink)
+    return row
+
+
+def churn_summary(rows: List[Dict]) -> Dict[str, Dict]:
+    """Latency distribution and trend over the cycles of every control-plane operation
+
+    The trend is the Theil-Sen slope (ms per cycle), an operation counts as growing when
+    its latencies have a significant upward Mann-Kendall trend.
+    """
+    summary = {}
+    for operation in CHURN_OPERATIONS:
+        values = [row[operation] for row in rows if row.get(operation) is not None]
+        z = mann_kendall_z(values)
+        slope = theil_sen_slope(values)
+        summary[operation] = {
+            **distribution(values),
+            "slope_ms_per_cycle": round(slope, 3) if slope is not None else None,
+            "trend_z": round(z, 2) if z is not None else None,
+            "growing": z is not None and z > GROWTH_Z_THRESHOLD,
+        }
+    return summary
+
+
+def display_churn_summary(summary: Dict[str, Dict]):
+    table = Table(title="Pipeline Churn", show_header=True, header_style="bold magenta")
+    for column in ["Operation", "Cycles", "Mean", "p50", "p90", "p99", "Max", "Slope / cycle", "Growing"]:
+        table.add_column(column, style="cyan" if column == "Operation" else "green")
+    for operation, stats in summary.items():
+        table.add_row(
+            CHURN_OPERATIONS[operation],
+            str(stats["count"]),
+            *(f"{stats[key]} ms" if stats[key] is not None else "-" for key in ["mean", "p50", "p90", "p99", "max"]),
+            f"{stats['slope_ms_per_cycle']} ms" if stats["slope_ms_per_cycle"] is not None else "-",
+            f"{'yes' if stats['growing'] else 'no'} (z={stats['trend_z']})",
+        )
+    console.print(table)
+
+
+def run_churn_benchmark(test_id: str, results_dir: str, pipeline_config_path: str, glassflow_host: str,
+                        cycles: int, records_per_cycle: int = 1000,
+                        event_schema: str = "config/glassgen/user_event.json") -> Dict[str, Dict]:
+    """Benchmark the control plane by cycling create -> ready -> delete `cycles` times
+
+    Every cycle runs on its own pipeline, topic and table and sends `records_per_cycle`
+    records through the pipeline before deleting it. The timings of every cycle are appended
+    to `<test_id>_churn.csv` as they are measured, the summary per operation goes to
+    `<test_id>_churn_summary.csv`.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    cycles_file = os.path.join(results_dir, f"{test_id}_churn.csv")
+    pipeline = GlassFlowPipeline(host=glassflow_host)
+    pipeline.stop_pipeline_if_running()
+
+    rows = []
+    with ResourceManager(), open(cycles_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CHURN_FIELDS)
+        writer.writeheader()
+        for cycle in range(cycles):
+            row = run_churn_cycle(pipeline, cycle, pipeline_config_path, event_schema, records_per_cycle)
+            writer.writerow(row)
+            f.flush()
+            rows.append(row)
+            if not row["error"]:
+                log(
+                    message=f"Churn cycle {cycle + 1}/{cycles}: ready after {row['time_to_ready_ms']} ms, "
+                            f"gone {row['time_to_deleted_ms']} ms after delete",
+                    status="Done",
+                    is_success=True,
+                    component="Churn",
+                )
+
+    summary = churn_summary(rows)
+    with open(os.path.join(results_dir, f"{test_id}_churn_summary.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["operation", *next(iter(summary.values())).keys()])
+        writer.writeheader()
+        for operation, stats in summary.items():
+            writer.writerow({"operation": operation, **stats})
+    display_churn_summary(summary)
+    return summary
@@ -0,0 +1,182 @@
+import csv
+import math
+import os
+from statistics import mean
+from typing import Dict, List, Optional, Tuple
+from rich.console import Console
+from rich.table import Table
+from src.utils.metrics import TestResultModel
+from src.utils.stats import permutation_p_value, sign_flip_p_value
+
+console = Console(width=140)
+
+# compared metrics, with their display name and whether higher values are better
+COMPARED_METRICS = {
+    "result_glassflow_rps": ("GlassFlow RPS", True),
+    "result_sink_rps_mean": ("Sink RPS mean", True),
+    "result_latency_p50_ms": ("Latency p50", False),
+    "result_latency_p99_ms": ("Latency p99", False),
+    "result_lag_ms": ("Drain lag", False),
+}
+COMPARISON_FIELDS = [
+    "scope", "variant_id", "metric", "baseline_runs", "candidate_runs",
+    "baseline", "candidate", "delta_pct", "p_value", "verdict",
+]
+
+
+def parameters_key(result: TestResultModel) -> Tuple:
+    """The parameters of a variant, variants of two tests match when these are identical"""
+    return tuple(
+        (name, getattr(result, name)) for name in TestResultModel.model_fields if name.startswith("param_")
+    )
+
+
+def match_variants(baseline: List[TestResultModel], candidate: List[TestResultModel]) -> List[Tuple[str, List, List]]:
+    """Successful runs of the variants that both tests ran, as (variant_id, baseline runs, candidate runs)"""
+    grouped: Dict[Tuple, Tuple[str, List, List]] = {}
+    for side, results in ((1, baseline), (2, candidate)):
+        for result in results:
+            if not result.result_success:
+                continue
+            entry = grouped.setdefault(parameters_key(result), (result.variant_id, [], []))
+            entry[side].append(result)
+    return [entry for entry in grouped.values() if entry[1] and entry[2]]
+
+
+def _verdict(worse_pct: float, p_value: Optional[float], threshold_pct: float, alpha: float) -> str:
+    """`worse_pct` is the change in the direction of a regression, in percent"""
+    if worse_pct > threshold_pct:
+        if p_value is None:
+            return "regression (untested)"
+        return "regression" if p_value < alpha else "not significant"
+    if worse_pct < -threshold_pct:
+        return "improvement"
+    return "unchanged"
+
+
+def compare_variant(baseline: List[float], candidate: List[float], higher_is_better: bool,
+                    threshold_pct: float, alpha: float) -> Dict:
+    """Change of a metric between the runs of one variant
+
+    The p-value is the one-sided permutation test of the candidate being worse, it needs
+    at least two runs on each side.
+    """
+    delta_pct = (mean(candidate) - mean(baseline)) / mean(baseline) * 100 if mean(baseline) else None
+    orientation = -1 if higher_is_better else 1
+    p_value = permutation_p_value([orientation * v for v in baseline], [orientation * v for v in candidate])
+    worse_pct = orientation * delta_pct if delta_pct is not None else 0.0
+    return {
+        "baseline": round(mean(baseline), 3),
+        "candidate": round(mean(candidate), 3),
+        "delta_pct": round(delta_pct, 2) if delta_pct is not None else None,
+        "p_value": round(p_value, 4) if p_value is not None else None,
+        "verdict": _verdict(worse_pct, p_value, threshold_pct, alpha),
+    }
+
+
+def compare_overall(ratios: List[float], higher_is_better: bool, threshold_pct: float, alpha: float) -> Dict:
+    """Change of a metric over all matched variants, from the candidate / baseline ratio of each
+
+    The change is the geometric mean of the ratios. The p-value is the one-sided sign-flip test
+    of the log ratios pointing at a regression; with too few variants for it to reach `alpha`,
+    the threshold alone decides.
+    """
+    orientation = -1 if higher_is_better else 1
+    log_ratios = [orientation * math.log(ratio) for ratio in ratios]
+    delta_pct = (math.exp(mean(log_ratios) * orientation) - 1) * 100
+    p_value = sign_flip_p_value(log_ratios)
+    if 0.5 ** len(ratios) >= alpha:
+        p_value = None
+    return {
+        "baseline": None,
+        "candidate": None,
+        "delta_pct": round(delta_pct, 2),
+        "p_value": round(p_value, 4) if p_value is not None else None,
+        "verdict": _verdict(orientation * delta_pct, p_value, threshold_pct, alpha),
+    }
+
+
+def compare_tests(baseline: List[TestResultModel], candidate: List[TestResultModel],
+                  threshold_pct: float = 5.0, alpha: float = 0.05) -> List[Dict]:
+    """Compare every metric per matched variant and over all of them"""
+    rows = []
+    matched = match_variants(baseline, candidate)
+    for metric, (_, higher_is_better) in COMPARED_METRICS.items():
+        ratios = []
+        for variant_id, baseline_runs, candidate_runs in matched:
+            baseline_values = [getattr(r, metric) for r in baseline_runs if getattr(r, metric) is not None]
+            candidate_values = [getattr(r, metric) for r in candidate_runs if getattr(r, metric) is not None]
+            if not baseline_values or not candidate_values:
+                continue
+            row = compare_variant(baseline_values, candidate_values, higher_is_better, threshold_pct, alpha)
+            rows.append({
+                "scope": "variant", "variant_id": variant_id, "metric": metric,
+                "baseline_runs": len(baseline_values), "candidate_runs": len(candidate_values), **row,
+            })
+            if mean(baseline_values) > 0 and mean(candidate_values) > 0:
+                ratios.append(mean(candidate_values) / mean(baseline_values))
+        if ratios:
+            rows.append({
+                "scope": "overall", "variant_id": "", "metric": metric,
+                "baseline_runs": len(ratios), "candidate_runs": len(ratios),
+                **compare_overall(ratios, higher_is_better, threshold_pct, alpha),
+            })
+    return rows
+
+
+def has_regression(rows: List[Dict]) -> bool:
+    """Whether a metric regressed over all variants, or significantly on one variant"""
+    return any(
+        row["verdict"].startswith("regression") if row["scope"] == "overall" else row["verdict"] == "regression"
+        for row in rows
+    )
+
+
+def display_comparison(rows: List[Dict], baseline_id: str, candidate_id: str, n_matched: int):
+    colors = {"regression": "red", "regression (untested)": "red", "improvement": "green"}
+    table = Table(
+        title=f"{candidate_id} vs {baseline_id} ({n_matched} matched variants)",
+        show_header=True, header_style="bold magenta"
+    )
+    for column in ["Scope", "Variant", "Metric", "Runs", "Baseline", "Candidate", "Delta", "p-value", "Verdict"]:
+        table.add_column(column, style="cyan" if column in ("Scope", "Variant", "Metric") else "green")
+    # every overall row, and the variants that changed
+    for row in sorted(rows, key=lambda r: r["scope"] != "overall"):
+        if row["scope"] == "variant" and row["verdict"] == "unchanged":
+            continue
+        color = colors.get(row["verdict"], "white")
+        table.add_row(
+            row["scope"],
+            row["variant_id"] or "-",
+            COMPARED_METRICS[row["metric"]][0],
+            f"{row['baseline_runs']} / {row['candidate_runs']}" if row["scope"] == "variant" else str(row["baseline_runs"]),
+            str(row["baseline"]) if row["baseline"] is not None else "-",
+            str(row["candidate"]) if row["candidate"] is not None else "-",
+            f"{row['delta_pct']:+}%" if row["delta_pct"] is not None else "-",
+            str(row["p_value"]) if row["p_value"] is not None else "-",
+            f"[{color}]{row['verdict']}[/{color}]",
+        )
+    console.print(table)
+
+
+def run_comparison(store, baseline_id: str, candidate_id: str, results_dir: str,
+                   threshold_pct: float = 5.0, alpha: float = 0.05) -> bool:
+    """Compare two tests from the results store, returns whether the candidate regressed
+
+    The comparison is written to `<candidate_id>_vs_<baseline_id>_comparison.csv`.
+    """
+    baseline, candidate = store.read(baseline_id), store.read(candidate_id)
+    for test_id, results in ((baseline_id, baseline), (candidate_id, candidate)):
+        if not results:
+            raise ValueError(f"No results for test ID {test_id}")
+    rows = compare_tests(baseline, candidate, threshold_pct, alpha)
+    n_matched = len(match_variants(baseline, candidate))
+    if n_matched == 0:
+        raise ValueError(f"{baseline_id} and {candidate_id} have no successful variants with identical parameters")
+
+    with open(os.path.join(results_dir, f"{candidate_id}_vs_{baseline_id}_comparison.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COMPARISON_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    display_comparison(rows, baseline_id, candidate_id, n_matched)
+    return has_regression(rows)
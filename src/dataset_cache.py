@@ -0,0 +1,209 @@
+from glassflow_clickhouse_etl.models import SourceConfig
+from src.native_events import NativeEventGenerator, NativeEventProducer
+from src.generate_events import PUBLISH_TIME_FIELD, kafka_producer_config
+from src.utils.logger import log
+from pathlib import Path
+import hashlib
+import json
+import mmap
+import os
+import time
+
+# Number of events generated and written at once
+WRITE_BATCH_SIZE = 50000
+
+
+class EventDataset:
+    """Serialized events on disk, generated once and replayed by the publisher processes
+
+    A dataset consists of three files sharing the cache key as name:
+    - `<key>.events`: one JSON event per line, duplicates included
+    - `<key>.idx`: byte offset of every event (and of the end of the file) as unsigned 64 bit integers
+    - `<key>.json`: metadata, written last so that only complete datasets are found in the cache
+
+    Duplicates are flagged in the highest bit of their offset.
+    """
+
+    DUPLICATE_BIT = 1 << 63
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.events_file = self.path.with_suffix(".events")
+        self.index_file = self.path.with_suffix(".idx")
+        self.meta_file = self.path.with_suffix(".json")
+
+    def exists(self) -> bool:
+        return self.meta_file.exists()
+
+    @property
+    def meta(self) -> dict:
+        with open(self.meta_file) as f:
+            return json.load(f)
+
+    def write(self, generator: NativeEventGenerator, num_records: int, meta: dict):
+        """Generate `num_records` events and write them to the dataset files"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # per process, variants running concurrently may generate the same dataset
+        events_tmp = self.events_file.with_suffix(f".events.{os.getpid()}.tmp")
+        index_tmp = self.index_file.with_suffix(f".idx.{os.getpid()}.tmp")
+        template = generator.template
+        offset = 0
+        with open(events_tmp, "wb") as events_f, open(index_tmp, "wb") as index_f:
+            written = 0
+            while written < num_records:
+                batch_size = min(WRITE_BATCH_SIZE, num_records - written)
+                flags = bytearray()
+                lines = [(template % row).encode() + b"\n" for row in generator.generate_batch(batch_size, flags)]
+                offsets = []
+                for line, is_duplicate in zip(lines, flags):
+                    offsets.append(offset | (self.DUPLICATE_BIT if is_duplicate else 0))
+                    offset += len(line)
+                events_f.write(b"".join(lines))
+                index_f.write(b"".join(o.to_bytes(8, "little") for o in offsets))
+                written += batch_size
+            index_f.write(offset.to_bytes(8, "little"))
+        os.replace(events_tmp, self.events_file)
+        os.replace(index_tmp, self.index_file)
+        with open(self.meta_file, "w") as f:
+            json.dump({
+                **meta,
+                "num_records": num_records,
+                "total_generated": generator.total_generated,
+                "total_duplicates": generator.total_duplicates,
+            }, f, indent=2)
+
+    def read_slice(self, start: int, count: int, batch_size: int):
+        """Yield the events [start, start + count) as lists of (event line, is duplicate)
+
+        The files are memory-mapped, so every process only pages in its own slice.
+        """
+        with open(self.events_file, "rb") as events_f, open(self.index_file, "rb") as index_f:
+            events = mmap.mmap(events_f.fileno(), 0, access=mmap.ACCESS_READ)
+            index_map = mmap.mmap(index_f.fileno(), 0, access=mmap.ACCESS_READ)
+            index = memoryview(index_map).cast("Q")
+            try:
+                mask = self.DUPLICATE_BIT - 1
+                for batch_start in range(start, start + count, batch_size):
+                    batch_end = min(batch_start + batch_size, start + count)
+                    offsets = index[batch_start:batch_end + 1].tolist()
+                    batch = []
+                    for begin, end in zip(offsets, offsets[1:]):
+                        # strip the newline, the duplicate flag only lives in the offset of an event
+                        batch.append((events[begin & mask:(end & mask) - 1], bool(begin & self.DUPLICATE_BIT)))
+                    yield batch
+            finally:
+                index.release()
+                index_map.close()
+                events.close()
+
+
+def dataset_key(schema: dict, seed: int, num_records: int, duplication_rate: float, id_field: str = None) -> str:
+    """Cache key of a dataset, a hash of everything that determines its events"""
+    key = json.dumps({
+        "schema": schema,
+        "seed": seed,
+        "num_records": num_records,
+        "duplication_rate": duplication_rate,
+        "id_field": id_field,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def prepare_dataset(
+    cache_dir: str,
+    source_config: SourceConfig,
+    generator_schema: str,
+    num_records: int,
+    duplication_rate: float = 0.1,
+    seed: int = 42,
+) -> EventDataset:
+    """Get the dataset of a variant from the cache, generating it first if it is not cached yet
+
+    Args:
+        cache_dir (str): Directory of the dataset cache
+        source_config (SourceConfig): Source configuration, decides whether duplicates are generated
+        generator_schema (str): Path to generator schema
+        num_records (int): Number of events, duplicates included
+        duplication_rate (float, optional): Duplication rate. Defaults to 0.1.
+        seed (int, optional): Seed of the generator. Defaults to 42.
+    """
+    schema = json.load(open(generator_schema))
+    deduplication = source_config.topics[0].deduplication
+    id_field = deduplication.id_field if deduplication.enabled else None
+    if not deduplication.enabled:
+        duplication_rate = 0
+    dataset = EventDataset(Path(cache_dir) / dataset_key(schema, seed, num_records, duplication_rate, id_field))
+    if dataset.exists():
+        log(
+            message=f"Dataset [italic u]{dataset.path.name}[/italic u] with {num_records} events",
+            status="Cached",
+            is_success=True,
+            component="Dataset",
+        )
+        return dataset
+
+    # the duplicates are generated within seconds, the time window does not matter here
+    duplication = {"ratio": duplication_rate, "time_window": "1d"} if duplication_rate else None
+    start_time = time.time()
+    generator = NativeEventGenerator(schema, duplication=duplication, seed=seed, id_field=id_field)
+    dataset.write(generator, num_records, {
+        "schema": schema,
+        "seed": seed,
+        "duplication_rate": duplication_rate,
+        "id_field": id_field,
+    })
+    log(
+        message=f"Dataset [italic u]{dataset.path.name}[/italic u] with {num_records} events in {round(time.time() - start_time, 1)}s",
+        status="Generated",
+        is_success=True,
+        component="Dataset",
+    )
+    return dataset
+
+
+def replay_events(
+    source_config: SourceConfig,
+    dataset_path: str,
+    start: int,
+    num_records: int,
+    bulk_size: int = 50000,
+    published_counter=None,
+    rate_limiter=None,
+    delivery_stats=None,
+):
+    """Publish the slice [start, start + num_records) of a cached dataset
+
+    Events are stamped with their publish time when they are produced, so replayed
+    events give the same per record latency as generated ones. The returned stats have
+    the same shape as the ones of `generate_events_with_duplicates`.
+    """
+    dataset = EventDataset(dataset_path)
+    producer = NativeEventProducer(
+        kafka_producer_config(source_config),
+        source_config.topics[0].name,
+        published_counter=published_counter,
+        rate_limiter=rate_limiter,
+        delivery_stats=delivery_stats,
+    )
+    stamp = f',"{PUBLISH_TIME_FIELD}":%d}}'.encode()
+
+    def render(event, publish_time_us):
+        return event[0][:-1] + stamp % publish_time_us
+
+    start_time = time.time()
+    count = 0
+    total_duplicates = 0
+    for batch in dataset.read_slice(start, num_records, bulk_size):
+        producer.produce_events(batch, render)
+        count += len(batch)
+        total_duplicates += sum(is_duplicate for _, is_duplicate in batch)
+    producer.flush()
+
+    total_generated = count - total_duplicates
+    return {
+        "time_taken_ms": round((time.time() - start_time) * 1000),
+        "num_records": count,
+        "total_generated": total_generated,
+        "total_duplicates": total_duplicates,
+        "duplication_ratio": round(total_duplicates / max(1, total_generated), 2),
+    }
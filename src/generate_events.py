@@ -1,8 +1,92 @@
 from glassflow_clickhouse_etl.models import SourceConfig
-import glassgen 
+from confluent_kafka import Producer
+from glassgen.config import validate_config
+from glassgen.schema.schema import ConfigSchema
+from glassgen.sinks import BaseSink
+from src.utils.kafka import kafka_brokers
+from src.utils.resources import active_resource_manager, ca_file
+from src.utils.logger import log
+import glassgen
 import json
-import base64
-import tempfile
+import time
+
+# Field added to every event with its publish time in epoch microseconds
+PUBLISH_TIME_FIELD = "published_at_us"
+# Number of events produced per rate limiter acquisition
+RATE_LIMIT_CHUNK_SIZE = 100
+
+
+class TimestampedKafkaSink(BaseSink):
+    """Kafka sink that stamps each event with its publish time right before producing it"""
+
+    def __init__(self, producer_config: dict, topic: str, published_counter=None, rate_limiter=None,
+                 delivery_stats=None):
+        self.topic = topic
+        # optional DeliveryStats recording every delivery report
+        self.delivery_stats = delivery_stats
+        if delivery_stats is not None:
+            producer_config = {**producer_config, **delivery_stats.producer_config()}
+        self.producer = Producer(producer_config)
+        # optional multiprocessing.Value shared with the parent process
+        self.published_counter = published_counter
+        # optional limiter (with an `acquire(tokens)` method) shared by all publishers
+        self.rate_limiter = rate_limiter
+
+    def delivery_report(self, err, msg):
+        """Reports message delivery status."""
+        if self.delivery_stats is not None:
+            self.delivery_stats.on_delivery(err, msg)
+        if err:
+            log(message="Message delivery failed", status=str(err), is_failure=True, component="Kafka")
+
+    def publish(self, record: dict) -> None:
+        self.publish_bulk([record])
+
+    def publish_bulk(self, records: list) -> None:
+        for i, record in enumerate(records):
+            if self.rate_limiter is not None and i % RATE_LIMIT_CHUNK_SIZE == 0:
+                self.rate_limiter.acquire(min(RATE_LIMIT_CHUNK_SIZE, len(records) - i))
+            record[PUBLISH_TIME_FIELD] = time.time_ns() // 1000
+            self.producer.produce(
+                self.topic,
+                value=json.dumps(record).encode("utf-8"),
+                callback=self.delivery_report,
+            )
+            self.producer.poll(0)
+        self.producer.flush()
+        if self.published_counter is not None:
+            with self.published_counter.get_lock():
+                self.published_counter.value += len(records)
+
+    def close(self) -> None:
+        self.producer.flush()
+
+
+def kafka_producer_config(source_config: SourceConfig) -> dict:
+    """Connection settings of a Kafka producer publishing to the source of the pipeline"""
+    return {
+        "bootstrap.servers": ",".join(kafka_brokers(source_config)),
+        "security.protocol": source_config.connection_params.protocol,
+        "sasl.mechanism": source_config.connection_params.mechanism,
+        "sasl.username": source_config.connection_params.username,
+        "sasl.password": source_config.connection_params.password,
+        "ssl.ca.location": ca_file(source_config.connection_params.root_ca),
+    }
+
+
+def create_kafka_producer(source_config: SourceConfig) -> Producer:
+    """Create a Kafka producer, shared by all callers while a resource manager is active
+
+    The publishers of a variant run in their own processes and create their own producers.
+    """
+    config = kafka_producer_config(source_config)
+    resources = active_resource_manager()
+    if resources is None:
+        return Producer(config)
+    return resources.shared(
+        ("kafka_producer", tuple(sorted(config.items()))), lambda: Producer(config), close=lambda p: p.flush()
+    )
+
 
 def generate_events_with_duplicates(
     source_config: SourceConfig,
@@ -11,15 +95,29 @@ def generate_events_with_duplicates(
     num_records: int = 10000,
     rps: int = 1000,
     bulk_size: int = 50000,
+    published_counter=None,
+    rate_limiter=None,
+    deadline: float = None,
+    delivery_stats=None,
 ):
     """Generate events with duplicates
 
+    Every event is stamped with its publish time (see `PUBLISH_TIME_FIELD`) so that
+    the end-to-end latency can be computed per record in the sink.
+
+    With a `deadline`, events are generated until the deadline passes or `num_records` are
+    published, whichever comes first.
+
     Args:
         source_config (SourceConfig): Source configuration
         duplication_rate (float, optional): Duplication rate. Defaults to 0.1.
         num_records (int, optional): Number of records to generate. Defaults to 10000.
         rps (int, optional): Records per second. Defaults to 1000.
         generator_schema (str, optional): Path to generator schema.
+        published_counter (multiprocessing.Value, optional): Shared counter incremented with every published bulk.
+        rate_limiter (SharedRateLimiter, optional): Limiter controlling the rate at which events are produced.
+        deadline (float, optional): Time after which no more bulks are started.
+        delivery_stats (DeliveryStats, optional): Stats recording the delivery reports of the producer.
     """
     glassgen_config = {
         "generator": {
@@ -44,29 +142,42 @@ def generate_events_with_duplicates(
     schema = json.load(open(generator_schema))
     glassgen_config["schema"] = schema
 
-    if source_config.connection_params.brokers[0] == "kafka:9094":
-        brokers = ["localhost:9093"]
-    else:
-        brokers = source_config.connection_params.brokers
-    
-    if source_config.connection_params.root_ca:
-        with tempfile.NamedTemporaryFile(delete=False, mode='w') as ca_cert_file:
-            # base64 decode the root ca
-            ca_cert_file.write(base64.b64decode(source_config.connection_params.root_ca).decode("utf-8"))
-            ca_cert_path = ca_cert_file.name
-    else:
-        ca_cert_path = None
-
-    glassgen_config["sink"] = {
-        "type": "kafka",
-        "params": {
-            "bootstrap.servers": ",".join(brokers),
-            "topic": source_config.topics[0].name,
-            "security.protocol": source_config.connection_params.protocol,
-            "sasl.mechanism": source_config.connection_params.mechanism,
-            "sasl.username": source_config.connection_params.username,
-            "sasl.password": source_config.connection_params.password,
-            "ssl.ca.location": ca_cert_path,
-        },
+    producer_config = kafka_producer_config(source_config)
+    sink = TimestampedKafkaSink(
+        producer_config, source_config.topics[0].name, published_counter, rate_limiter, delivery_stats
+    )
+    if deadline is None:
+        stats = glassgen.generate(config=glassgen_config, sink=sink)
+        return {**stats, **_generation_totals(stats)}
+
+    # one generator for the whole run, so that duplicates span the bulks; its bulks are
+    # published here to stop at the deadline, which glassgen.generate cannot
+    config = validate_config(glassgen_config)
+    schema_model = ConfigSchema.from_dict(config.schema_config)
+    schema_model.validate()
+    generator = glassgen.Generator(config.generator, schema_model)
+    start_time = time.time()
+    count = 0
+    for records in generator.generate():
+        sink.publish_bulk(records)
+        count += len(records)
+        if time.time() >= deadline:
+            break
+    sink.close()
+    stats = generator.duplicate_controller.get_results() if generator.duplicate_controller else {}
+    return {
+        "time_taken_ms": round((time.time() - start_time) * 1000),
+        "num_records": count,
+        **_generation_totals({**stats, "num_records": count}),
+    }
+
+
+def _generation_totals(stats: dict) -> dict:
+    """Generated and duplicate records of a glassgen run, which only counts them with duplication enabled"""
+    total_generated = stats.get("total_generated", stats["num_records"])
+    total_duplicates = stats.get("total_duplicates", 0)
+    return {
+        "total_generated": total_generated,
+        "total_duplicates": total_duplicates,
+        "duplication_ratio": round(total_duplicates / max(1, total_generated), 2),
     }
-    return glassgen.generate(config=glassgen_config)
@@ -0,0 +1,121 @@
+from glassflow_clickhouse_etl.models import JoinOrientation, PipelineConfig, SourceConfig
+from glassgen.schema.schema import ConfigSchema
+from src.generate_events import kafka_producer_config
+from src.native_events import NativeEventGenerator, NativeEventProducer
+from typing import Dict
+import time
+
+# Sink column of the publish time of the right event of a joined row, the left one keeps PUBLISH_TIME_FIELD
+JOIN_RIGHT_PUBLISH_TIME_COLUMN = "published_at_us_right"
+# Sides of a join, in the order of the join sources
+JOIN_SIDES = (JoinOrientation.LEFT.value, JoinOrientation.RIGHT.value)
+
+
+def join_sides(config: PipelineConfig) -> Dict[str, Dict]:
+    """Topic, join key and join key type of both sides of a join pipeline, by orientation"""
+    sides = {}
+    for source in config.join.sources:
+        topic = next(topic for topic in config.source.topics if topic.name == source.source_id)
+        key_type = next(field.type.value for field in topic.event_schema.fields if field.name == source.join_key)
+        sides[source.orientation.value] = {"topic": topic.name, "join_key": source.join_key, "key_type": key_type}
+    return sides
+
+
+def is_matched(index: int, match_rate: float) -> bool:
+    """Whether the pair `index` shares its join key, spread evenly so any n pairs hold floor(n * match_rate) matches"""
+    return int((index + 1) * match_rate) > int(index * match_rate)
+
+
+def matched_pairs(start: int, num_records: int, match_rate: float) -> int:
+    """Number of matched pairs among the pairs `start` to `start + num_records`"""
+    return int((start + num_records) * match_rate) - int(start * match_rate)
+
+
+def join_key_value(index: int, side: str, match_rate: float, key_type: str, tag: int) -> str:
+    """JSON encoded join key of the event `index` of a side
+
+    The left event of every pair has a key of its own. The right event of a matched pair
+    has the same key, the right event of an unmatched pair one no left event has. String
+    keys are UUIDs holding the `tag` of the variant and the index of the pair.
+    """
+    matched = side == JoinOrientation.LEFT.value or is_matched(index, match_rate)
+    if key_type.startswith("int") or key_type.startswith("uint"):
+        return str(index if matched else index + 2 ** 40)
+    return f'"{tag:08x}-0000-4000-{8 if matched else 9}000-{index:012x}"'
+
+
+def generate_join_events(
+    source_config: SourceConfig,
+    generator_schema: Dict,
+    side: Dict,
+    orientation: str,
+    start: int,
+    num_records: int,
+    match_rate: float = 1.0,
+    key_tag: int = 0,
+    bulk_size: int = 50000,
+    published_counter=None,
+    rate_limiter=None,
+    delivery_stats=None,
+):
+    """Generate and publish the events of one side of a join, for the pairs `start` to `start + num_records`
+
+    Events are generated like with the native producer engine (see `NativeEventGenerator`),
+    with the join key replaced by the key of their pair, see `join_key_value`.
+
+    Args:
+        source_config (SourceConfig): Source configuration
+        generator_schema (dict): glassgen schema of the events of this side
+        side (dict): Topic, join key and join key type of this side, see `join_sides`
+        orientation (str): Side of the join, "left" or "right"
+        start (int): Index of the first pair
+        num_records (int): Number of events to publish
+        match_rate (float, optional): Share of the pairs with a matching key. Defaults to 1.0.
+        key_tag (int, optional): Tag of the variant in string join keys.
+        bulk_size (int, optional): Number of events generated at once. Defaults to 50000.
+        published_counter (multiprocessing.Value, optional): Shared counter incremented with every produced bulk.
+        rate_limiter (SharedRateLimiter, optional): Limiter controlling the rate at which events are produced.
+        delivery_stats (DeliveryStats, optional): Stats recording the delivery reports of the producer.
+    """
+    generator = NativeEventGenerator(generator_schema)
+    key_index = list(ConfigSchema.from_dict(generator_schema).fields).index(side["join_key"])
+    producer = NativeEventProducer(
+        kafka_producer_config(source_config),
+        side["topic"],
+        published_counter=published_counter,
+        rate_limiter=rate_limiter,
+        delivery_stats=delivery_stats,
+    )
+    template = generator.stamped_template
+
+    def render(row, publish_time_us):
+        return (template % (*row, publish_time_us)).encode()
+
+    def generate(n):
+        # join events have no duplicates, every generated event is the next pair
+        first = start + generator.total_generated
+        return [
+            row[:key_index]
+            + (join_key_value(first + i, orientation, match_rate, side["key_type"], key_tag),)
+            + row[key_index + 1:]
+            for i, row in enumerate(generator.generate_batch(n))
+        ]
+
+    start_time = time.time()
+    count = 0
+    while count < num_records:
+        batch_size = min(bulk_size, num_records - count)
+        producer.produce_generated(generate, batch_size, render)
+        count += batch_size
+    producer.flush()
+
+    return {
+        "time_taken_ms": round((time.time() - start_time) * 1000),
+        "num_records": count,
+        "total_generated": generator.total_generated,
+        "total_duplicates": 0,
+        "duplication_ratio": 0.0,
+        "join_side": orientation,
+        # pairs whose two events will be joined, counted on the left side only
+        "matched_pairs": matched_pairs(start, count, match_rate) if orientation == JoinOrientation.LEFT.value else 0,
+    }
@@ -0,0 +1,169 @@
+import csv
+import math
+from pathlib import Path
+from typing import Dict, List, Optional
+from src.utils.sampler import time_to_reach
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# halvings of the search interval when solving for a time in a sine segment, down to well below a microsecond
+SINE_BISECTIONS = 48
+
+
+def parse_duration(duration: str) -> float:
+    """Convert a duration string such as "30s", "5m" or "6h" to seconds"""
+    unit = duration[-1]
+    if unit not in DURATION_UNITS:
+        raise ValueError(f"Invalid duration unit: {unit}")
+    return float(duration[:-1]) * DURATION_UNITS[unit]
+
+
+def _segment_rate(segment: Dict, t: float, duration: float) -> float:
+    """Offered rate `t` seconds into a segment"""
+    if segment["shape"] == "ramp":
+        return segment["rps"] + (segment["end_rps"] - segment["rps"]) * t / duration
+    if segment["shape"] == "sine":
+        period = parse_duration(segment["period"])
+        return segment["rps"] + segment["amplitude"] * math.sin(2 * math.pi * t / period)
+    return segment["rps"]
+
+
+def _segment_records(segment: Dict, duration: float, t: float = None) -> float:
+    """Number of records offered during the first `t` seconds of a segment, the whole segment by default"""
+    t = duration if t is None else t
+    if segment["shape"] == "ramp":
+        return segment["rps"] * t + (segment["end_rps"] - segment["rps"]) * t * t / (2 * duration)
+    if segment["shape"] == "sine":
+        period = parse_duration(segment["period"])
+        wave = segment["amplitude"] * period / (2 * math.pi) * (1 - math.cos(2 * math.pi * t / period))
+        return segment["rps"] * t + wave
+    return segment["rps"] * t
+
+
+def _segment_time_after(segment: Dict, duration: float, t: float, records: float) -> float:
+    """Time into a segment at which `records` more records have been offered, counting from `t`
+
+    The records must be offered before the end of the segment. Constant and ramp segments
+    are solved in closed form, sine segments (whose rate is never negative) by bisection.
+    """
+    if segment["shape"] == "ramp":
+        # t + x with rate(t) * x + slope / 2 * x^2 = records, in the form stable for either sign of slope
+        rate = _segment_rate(segment, t, duration)
+        slope = (segment["end_rps"] - segment["rps"]) / duration
+        return t + 2 * records / (rate + math.sqrt(max(rate * rate + 2 * slope * records, 0)))
+    if segment["shape"] == "sine":
+        target = _segment_records(segment, duration, t) + records
+        low, high = t, duration
+        for _ in range(SINE_BISECTIONS):
+            middle = (low + high) / 2
+            if _segment_records(segment, duration, middle) < target:
+                low = middle
+            else:
+                high = middle
+        return high
+    return t + records / segment["rps"]
+
+
+class LoadSchedule:
+    """Offered rate over time of a load profile
+
+    A load profile is a list of segments (see `LoadProfileSegment` in `src/models.py`)
+    played one after the other, the time `t` is in seconds since the start of the profile.
+    """
+
+    def __init__(self, segments: List[Dict]):
+        self.segments = []
+        start = 0.0
+        for segment in segments:
+            end = start + parse_duration(segment["duration"])
+            self.segments.append((start, end, segment))
+            start = end
+        self.duration = start
+
+    def rate_at(self, t: float) -> float:
+        for start, end, segment in self.segments:
+            if t < end:
+                return _segment_rate(segment, t - start, end - start)
+        return 0.0
+
+    def total_records(self) -> int:
+        return round(sum(_segment_records(segment, end - start) for start, end, segment in self.segments))
+
+    def time_after(self, t: float, records: float) -> float:
+        """Time at which `records` more records have been offered, counting from `t`"""
+        for start, end, segment in self.segments:
+            if records <= 0 or t >= end:
+                continue
+            offset = max(t - start, 0)
+            left = _segment_records(segment, end - start) - _segment_records(segment, end - start, offset)
+            if left > records:
+                return start + _segment_time_after(segment, end - start, offset, records)
+            records -= left
+            t = end
+        # records left over by rounding once the profile ended go out right away
+        return t
+
+
+def variant_total_records(variant_config: Dict) -> int:
+    """Number of records published by a variant, given by its load profile if it has one"""
+    if variant_config.get("load_profile"):
+        return LoadSchedule(variant_config["load_profile"]).total_records()
+    return variant_config["total_records"]
+
+
+def _value_at(samples: List[Dict], key: str, timestamp: float) -> float:
+    """Value of a sampled count at `timestamp`, interpolated between samples"""
+    if timestamp <= samples[0]["timestamp"]:
+        return samples[0][key]
+    for prev, sample in zip(samples, samples[1:]):
+        if sample["timestamp"] >= timestamp:
+            fraction = (timestamp - prev["timestamp"]) / (sample["timestamp"] - prev["timestamp"])
+            return prev[key] + fraction * (sample[key] - prev[key])
+    return samples[-1][key]
+
+
+def segment_stats(schedule: LoadSchedule, samples: List[Dict], profile_start_time: float,
+                  unique_ratio: float = 1.0) -> List[Dict]:
+    """How publishing and GlassFlow throughput responded to every segment of a load profile
+
+    For every segment the offered, published and sunk rates over the segment are derived
+    from the throughput samples, together with the backlog (published but not yet sunk
+    records) at the end of the segment and the drain lag: the time after the end of the
+    segment until the sink caught up with what was published during it.
+
+    Duplicates never reach the sink, so published counts are scaled by `unique_ratio`
+    (unique records / published records) when compared with sunk counts.
+    """
+    stats = []
+    for i, (start, end, segment) in enumerate(schedule.segments):
+        t0, t1 = profile_start_time + start, profile_start_time + end
+        duration = end - start
+        published_end = _value_at(samples, "published", t1)
+        sunk_end = _value_at(samples, "sunk", t1)
+        caught_up = time_to_reach(samples, published_end * unique_ratio)
+        stats.append({
+            "segment": i,
+            "name": segment.get("name") or segment["shape"],
+            "start_sec": start,
+            "end_sec": end,
+            "offered_rps": round(_segment_records(segment, duration) / duration),
+            "published_rps": round((published_end - _value_at(samples, "published", t0)) / duration),
+            "sink_rps": round((sunk_end - _value_at(samples, "sunk", t0)) / duration),
+            "backlog_end": max(round(published_end * unique_ratio - sunk_end), 0),
+            "drain_lag_sec": round(max(caught_up - t1, 0), 3) if caught_up is not None else None,
+        })
+    return stats
+
+
+def write_segment_stats(stats: List[Dict], segments_file: str):
+    """Write the per segment stats of a variant to a CSV file"""
+    path = Path(segments_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(stats[0].keys()))
+        writer.writeheader()
+        writer.writerows(stats)
+
+
+def max_drain_lag(stats: List[Dict]) -> Optional[float]:
+    lags = [s["drain_lag_sec"] for s in stats if s["drain_lag_sec"] is not None]
+    return max(lags) if lags else None
@@ -1,8 +1,13 @@
 import json
-from typing import List, Dict, Any
+import math
+import random
+from typing import Any, Dict, Iterator, List, Tuple
 import itertools
 import sys
-from src.models import LoadTestConfig, ParameterValues
+from src.models import LoadTestConfig, LoadProfileValues, ParameterValues
+
+# generator sets of a fractional factorial design compared exhaustively, see `minimum_aberration_generators`
+MAX_GENERATOR_SETS = 100000
 
 class LoadTestGenerator:
     def __init__(self, config_path: str):
@@ -16,6 +21,13 @@ class LoadTestGenerator:
         
         if isinstance(param_config, ParameterValues):
             return param_config.values
+
+        if isinstance(param_config, LoadProfileValues):
+            # variants are plain dicts, so are their load profiles
+            return [
+                [segment.model_dump(exclude_none=True) for segment in profile] if profile else None
+                for profile in param_config.values
+            ]
         
         values = []
         current = param_config.min
@@ -27,34 +39,92 @@ class LoadTestGenerator:
                 current = round(current, 3)
         return values
 
-    def _generate_grid_combinations(self) -> List[Dict[str, Any]]:
-        """Generate all possible combinations of parameters (grid search)"""
-        param_values = {
+    def _parameter_levels(self) -> Dict[str, List[Any]]:
+        """All values of every parameter"""
+        return {
             name: self._generate_range_values(name)
             for name in self.parameters.__class__.model_fields.keys()
         }
-        
-        # Generate all combinations
-        keys = list(param_values.keys())
-        values = list(param_values.values())
-        combinations = list(itertools.product(*values))
-        
-        # Convert to list of dictionaries
-        return [dict(zip(keys, combo)) for combo in combinations]
 
-    def generate_combinations(self) -> List[Dict[str, Any]]:
-        """Generate test combinations using grid search"""
-        combinations = self._generate_grid_combinations()
-
-        # Limit the number of combinations if needed
+    def _generate_grid_combinations(self) -> Iterator[Dict[str, Any]]:
+        """Generate all possible combinations of parameters (grid search), or evenly spaced
+        ones of them when limited by `max_combinations`"""
+        levels = self._parameter_levels()
+        total = math.prod(len(values) for values in levels.values())
         max_combinations = self.config.max_combinations
-        if max_combinations != -1 and len(combinations) > max_combinations:
+        if max_combinations == -1 or total <= max_combinations:
+            indices = range(total)
+        else:
             # Sample evenly across the space
-            step = len(combinations) / max_combinations
-            indices = [int(i * step) for i in range(max_combinations)]
-            combinations = [combinations[i] for i in indices]
+            step = total / max_combinations
+            indices = (int(i * step) for i in range(max_combinations))
+        for index in indices:
+            yield _combination_at(levels, index)
+
+    def _generate_random_combinations(self) -> Iterator[Dict[str, Any]]:
+        """Distinct combinations drawn uniformly at random"""
+        levels = self._parameter_levels()
+        total = math.prod(len(values) for values in levels.values())
+        n = total if self.config.max_combinations == -1 else min(self.config.max_combinations, total)
+        # sampling from a range does not build the range
+        for index in random.Random(self.config.seed).sample(range(total), n):
+            yield _combination_at(levels, index)
 
-        return combinations
+    def _generate_latin_hypercube_combinations(self) -> Iterator[Dict[str, Any]]:
+        """Latin hypercube sample: every parameter's range is split into as many strata as
+        there are runs, and every stratum of every parameter is used exactly once
+
+        Without a limit, there are as many runs as the parameter with the most values has values.
+        """
+        levels = self._parameter_levels()
+        n = self.config.max_combinations
+        if n == -1:
+            n = max(len(values) for values in levels.values())
+        rng = random.Random(self.config.seed)
+        strata = {}
+        for name in levels:
+            order = list(range(n))
+            rng.shuffle(order)
+            strata[name] = order
+        for run in range(n):
+            yield {
+                # a random point in the stratum of this run, mapped onto the values of the parameter
+                name: values[int((strata[name][run] + rng.random()) / n * len(values))]
+                for name, values in levels.items()
+            }
+
+    def _generate_fractional_factorial_combinations(self) -> Iterator[Dict[str, Any]]:
+        """Two-level fractional factorial design over the lowest and highest value of every
+        parameter with several values, see `fractional_factorial_runs`"""
+        levels = self._parameter_levels()
+        factors = [name for name, values in levels.items() if len(values) > 1]
+        for run in fractional_factorial_runs(len(factors), self.config.max_combinations):
+            combination = {name: values[0] for name, values in levels.items()}
+            for name, high in zip(factors, run):
+                combination[name] = levels[name][-1] if high else levels[name][0]
+            yield combination
+
+    def iter_combinations(self) -> Iterator[Dict[str, Any]]:
+        """Generate the test combinations one at a time with the configured sampling strategy
+
+        Identical combinations (possible when sampling) are only generated once.
+        """
+        strategies = {
+            "grid": self._generate_grid_combinations,
+            "random": self._generate_random_combinations,
+            "latin_hypercube": self._generate_latin_hypercube_combinations,
+            "fractional_factorial": self._generate_fractional_factorial_combinations,
+        }
+        seen = set()
+        for combination in strategies[self.config.sampling]():
+            key = json.dumps(combination, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                yield combination
+
+    def generate_combinations(self) -> List[Dict[str, Any]]:
+        """Generate test combinations with the configured sampling strategy"""
+        return list(self.iter_combinations())
 
     def print_combinations(self, combinations: List[Dict[str, Any]]):
         """Print the generated combinations in a readable format"""
@@ -64,6 +134,88 @@ class LoadTestGenerator:
             for param, value in combo.items():
                 print(f"  {param}: {value}")
 
+def _combination_at(levels: Dict[str, List[Any]], index: int) -> Dict[str, Any]:
+    """Combination at `index` in the order of `itertools.product` over the values of all parameters"""
+    combination = {}
+    for name, values in reversed(list(levels.items())):
+        index, position = divmod(index, len(values))
+        combination[name] = values[position]
+    return {name: combination[name] for name in levels}
+
+
+def fractional_factorial_min_runs(n_factors: int) -> int:
+    """Fewest runs of a two-level fractional factorial design of `n_factors` factors (resolution III)"""
+    base = 0
+    while 2 ** base - 1 < n_factors:
+        base += 1
+    return 2 ** base
+
+
+def _word_length_pattern(generators: Tuple[int, ...], base: int) -> Tuple[int, ...]:
+    """Number of words of every length in the defining relation of a design
+
+    Generator `i` is a bit mask of the base factors whose interaction sets factor `base + i`.
+    """
+    words = [mask | 1 << (base + i) for i, mask in enumerate(generators)]
+    pattern = [0] * (base + len(words) + 1)
+    for size in range(1, len(words) + 1):
+        for subset in itertools.combinations(words, size):
+            word = 0
+            for generator in subset:
+                word ^= generator
+            pattern[bin(word).count("1")] += 1
+    return tuple(pattern)
+
+
+def minimum_aberration_generators(n_factors: int, base: int) -> List[int]:
+    """Generators of the minimum aberration 2^(k-p) design with `base` base factors
+
+    Minimum aberration designs have the highest resolution, and of those the fewest
+    shortest words in their defining relation. Generator sets are compared exhaustively up
+    to `MAX_GENERATOR_SETS` of them, beyond that the generators are picked one at a time.
+    """
+    candidates = sorted(
+        (mask for mask in range(1 << base) if bin(mask).count("1") >= 2),
+        key=lambda mask: (-bin(mask).count("1"), mask),
+    )
+    n_generators = n_factors - base
+    if math.comb(len(candidates), n_generators) <= MAX_GENERATOR_SETS:
+        return list(min(
+            itertools.combinations(candidates, n_generators),
+            key=lambda generators: _word_length_pattern(generators, base),
+        ))
+    generators = []
+    for _ in range(n_generators):
+        generators.append(min(
+            (mask for mask in candidates if mask not in generators),
+            key=lambda mask: _word_length_pattern((*generators, mask), base),
+        ))
+    return generators
+
+
+def fractional_factorial_runs(n_factors: int, max_runs: int = -1) -> Iterator[List[int]]:
+    """Runs of a two-level 2^(k-p) fractional factorial design, as 0 (low) / 1 (high) per factor
+
+    The design has the most runs (a power of two) within `max_runs` (-1 for the full factorial).
+    The first factors form a full factorial, every other factor is set from an interaction
+    of those, see `minimum_aberration_generators`. E.g. 6 factors in 16 runs are set with
+    E=ABC and F=BCD (resolution IV), so no main effect is aliased with a two-factor interaction.
+    """
+    min_runs = fractional_factorial_min_runs(n_factors)
+    if max_runs != -1 and max_runs < min_runs:
+        raise ValueError(
+            f"A fractional factorial design of {n_factors} varied parameters needs at least {min_runs} runs, "
+            f"set max_combinations to {min_runs} or more (-1 for the full factorial)"
+        )
+    base = n_factors
+    if max_runs != -1:
+        while 2 ** base > max_runs:
+            base -= 1
+    generators = minimum_aberration_generators(n_factors, base)
+    for run in itertools.product([0, 1], repeat=base):
+        yield list(run) + [sum(run[i] for i in range(base) if mask >> i & 1) % 2 for mask in generators]
+
+
 def main():
     # Example usage
     config_path = sys.argv[1]
@@ -1,5 +1,5 @@
-from typing import List, Union
-from pydantic import BaseModel, Field
+from typing import List, Literal, Optional, Union
+from pydantic import BaseModel, Field, model_validator
 
 class ParameterRange(BaseModel):
     min: Union[int, float]
@@ -11,6 +11,31 @@ class ParameterValues(BaseModel):
     values: List[Union[str, int]]
     description: str
 
+class LoadProfileSegment(BaseModel):
+    """Segment of a load profile, steps and spikes are sequences of constant segments"""
+    shape: Literal["constant", "ramp", "sine"] = "constant"
+    duration: str
+    rps: int
+    end_rps: Optional[int] = None
+    amplitude: Optional[int] = None
+    period: Optional[str] = None
+    name: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_shape_params(self):
+        if self.shape == "ramp" and self.end_rps is None:
+            raise ValueError("ramp segments need an end_rps")
+        if self.shape == "sine":
+            if self.amplitude is None or self.period is None:
+                raise ValueError("sine segments need an amplitude and a period")
+            if self.amplitude > self.rps:
+                raise ValueError("the amplitude of sine segments cannot exceed their rps")
+        return self
+
+class LoadProfileValues(BaseModel):
+    values: List[Optional[List[LoadProfileSegment]]]
+    description: str
+
 class LoadTestParameters(BaseModel):
     num_processes: ParameterRange = Field(
         default=ParameterRange(
@@ -48,6 +73,44 @@ class LoadTestParameters(BaseModel):
             description="Max delay time for the sink"
         )
     )
+    target_rps: Union[ParameterRange, ParameterValues] = Field(
+        default=ParameterValues(
+            values=[0],
+            description="Aggregate records per second offered by all processes (0 = as fast as possible)"
+        )
+    )
+    producer_engine: ParameterValues = Field(
+        default=ParameterValues(
+            values=["glassgen"],
+            description="Engine generating and publishing the events (glassgen, native or replay)"
+        )
+    )
+    load_profile: LoadProfileValues = Field(
+        default=LoadProfileValues(
+            values=[None],
+            description="Time-varying offered load, overrides total_records and target_rps (null = no profile)"
+        )
+    )
+    soak_duration: ParameterValues = Field(
+        default=ParameterValues(
+            values=[""],
+            description="Publish continuously for this duration instead of total_records (empty = no soak test)"
+        )
+    )
+    join_match_rate: ParameterRange = Field(
+        default=ParameterRange(
+            min=1.0,
+            max=1.0,
+            step=0.1,
+            description="Share of the events of a join pipeline with a matching join key on the other side"
+        )
+    )
+    join_time_skew: ParameterValues = Field(
+        default=ParameterValues(
+            values=["0s"],
+            description="Delay of the right side of a join pipeline behind the left side, negative for the left side"
+        )
+    )
 
 class SingleTestConfig(BaseModel):
     num_processes: int = 1    
@@ -56,7 +119,43 @@ class SingleTestConfig(BaseModel):
     deduplication_window: str = "8h"
     max_batch_size: int = 5000
     max_delay_time: str = "10s"
+    target_rps: int = 0
+    producer_engine: Literal["glassgen", "native", "replay"] = "glassgen"
+    load_profile: Optional[List[LoadProfileSegment]] = None
+    soak_duration: str = ""
+    join_match_rate: float = Field(default=1.0, ge=0, le=1)
+    join_time_skew: str = "0s"
 
 class LoadTestConfig(BaseModel):
     parameters: LoadTestParameters
     max_combinations: int = 1
+    # how the variants are picked from all combinations of the parameter values
+    sampling: Literal["grid", "random", "latin_hypercube", "fractional_factorial"] = "grid"
+    seed: int = 42
+    # trials of every variant, their results are stored separately and summarized
+    repetitions: int = Field(default=1, ge=1)
+
+class CapacitySearchConfig(BaseModel):
+    """Search for the highest offered rate the pipeline sustains within the SLO"""
+    # every probe runs this variant, with the target_rps and total_records of the probe
+    variant: SingleTestConfig = Field(default_factory=lambda: SingleTestConfig(total_records=0))
+    min_rps: int = 1000
+    max_rps: int = 100000
+    start_rps: Optional[int] = None
+    probe_duration_sec: float = 60
+    slo_latency_p99_ms: float
+    max_drain_lag_sec: float = 30
+    # the search stops once the failing rate is within this fraction above the passing one
+    resolution: float = 0.05
+    confirm_trials: int = 3
+    max_probes: int = 20
+
+    @model_validator(mode="after")
+    def check_search_range(self):
+        if not 0 < self.min_rps <= self.max_rps:
+            raise ValueError("min_rps must be positive and at most max_rps")
+        if self.start_rps is not None and not self.min_rps <= self.start_rps <= self.max_rps:
+            raise ValueError("start_rps must be between min_rps and max_rps")
+        if self.variant.load_profile or self.variant.soak_duration:
+            raise ValueError("capacity search probes run at a constant rate, without load profile or soak duration")
+        return self
@@ -0,0 +1,340 @@
+from glassflow_clickhouse_etl.models import SourceConfig
+from confluent_kafka import Producer
+from glassgen.generator.generators import GeneratorType, registry
+from glassgen.schema.schema import ConfigSchema, SchemaField
+from collections import deque
+from faker import Faker
+from datetime import datetime, timedelta
+from src.generate_events import PUBLISH_TIME_FIELD, RATE_LIMIT_CHUNK_SIZE, kafka_producer_config
+from src.load_profile import parse_duration
+from src.utils.logger import log
+import json
+import os
+import random
+import time
+
+# Number of values precomputed for every field that is drawn from a pool
+VALUE_POOL_SIZE = 10000
+# Number of recent events duplicates are picked from, same as glassgen
+DUPLICATE_CANDIDATES = 1000
+# Generators whose values repeat by design, rejected for the deduplication id field
+NON_UNIQUE_GENERATORS = {
+    GeneratorType.CHOICE.value,
+    GeneratorType.BOOLEAN.value,
+    GeneratorType.DATETIME.value,
+    GeneratorType.TIMESTAMP.value,
+    GeneratorType.COUNTRY.value,
+    GeneratorType.CURRENCY_NAME.value,
+    GeneratorType.COLOR_NAME.value,
+    GeneratorType.GREETING.value,
+}
+
+# Producer settings tuned for throughput, on top of the connection settings
+TUNED_PRODUCER_CONFIG = {
+    "linger.ms": 20,
+    "batch.size": 1048576,
+    "compression.type": "lz4",
+    "queue.buffering.max.messages": 1000000,
+    "queue.buffering.max.kbytes": 1048576,
+}
+
+# uuid4 variant nibble for every possible random hex digit
+_UUID_VARIANT = {digit: "89ab"[int(digit, 16) & 3] for digit in "0123456789abcdef"}
+
+
+def _uuid4_values(rng: random.Random = None):
+    """JSON encoded uuid4 strings built from one batch of random bytes"""
+    def values(n: int) -> list:
+        h = (rng.randbytes(16 * n) if rng else os.urandom(16 * n)).hex()
+        return [
+            f'"{h[i:i + 8]}-{h[i + 8:i + 12]}-4{h[i + 13:i + 16]}-{_UUID_VARIANT[h[i + 16]]}{h[i + 17:i + 20]}-{h[i + 20:i + 32]}"'
+            for i in range(0, 32 * n, 32)
+        ]
+    return values
+
+
+def _datetime_values(format_str: str = None):
+    """Current time, formatted once per batch"""
+    def values(n: int) -> list:
+        now = datetime.now()
+        return [json.dumps(now.strftime(format_str) if format_str else now.isoformat())] * n
+    return values
+
+
+def _timestamp_values(n: int) -> list:
+    return [str(int(time.time()))] * n
+
+
+def _pooled_values(field: SchemaField, rng: random.Random):
+    """Values drawn from a pool precomputed with the glassgen generator of the field"""
+    generator = registry.get_generator(field.generator)
+    if field.generator == GeneratorType.CHOICE:
+        pool = [json.dumps(generator(field.params)) for _ in range(VALUE_POOL_SIZE)]
+    else:
+        pool = [json.dumps(generator(*field.params)) for _ in range(VALUE_POOL_SIZE)]
+
+    def values(n: int) -> list:
+        return rng.choices(pool, k=n)
+    return values
+
+
+def _fresh_values(field: SchemaField):
+    """Values generated one by one with the glassgen generator of the field, without a pool"""
+    generator = registry.get_generator(field.generator)
+
+    def values(n: int) -> list:
+        return [json.dumps(generator(*field.params)) for _ in range(n)]
+    return values
+
+
+def _field_values(field: SchemaField, rng: random.Random, seeded: bool, unique: bool = False):
+    """Function returning `n` JSON encoded values of a schema field
+
+    With `unique`, the values must not repeat, so they are not drawn from a pool.
+    """
+    if field.generator in (GeneratorType.UUID, GeneratorType.UUID4):
+        return _uuid4_values(rng if seeded else None)
+    if unique:
+        return _fresh_values(field)
+    if field.generator == GeneratorType.DATETIME:
+        return _datetime_values(*field.params)
+    if field.generator == GeneratorType.TIMESTAMP:
+        return _timestamp_values
+    return _pooled_values(field, rng)
+
+
+class NativeEventGenerator:
+    """Generates events of a glassgen schema in bulk
+
+    Supports flat schemas. uuid fields are built from batched random bytes, datetime and
+    timestamp fields are formatted once per batch, and all other fields are drawn from pools
+    of values precomputed with the glassgen generators, except for the `id_field` (the
+    deduplication key), whose values are generated one by one. Duplicates follow the glassgen
+    semantics: while the duplication ratio is below the target, an event is replaced by a
+    random one of the last `DUPLICATE_CANDIDATES` events generated within the time window.
+
+    With a `seed`, the generated events (apart from datetime and timestamp fields) are
+    reproducible.
+    """
+
+    def __init__(self, schema: dict, duplication: dict = None, seed: int = None, id_field: str = None):
+        self.rng = random.Random(seed)
+        if seed is not None:
+            # the glassgen generators draw from the global random state
+            random.seed(seed)
+            Faker.seed(seed)
+        fields = ConfigSchema.from_dict(schema).fields
+        if not all(isinstance(field, SchemaField) for field in fields.values()):
+            raise ValueError("The native producer engine only supports flat schemas")
+        if id_field in fields and fields[id_field].generator in NON_UNIQUE_GENERATORS:
+            raise ValueError(
+                f"The deduplication id field {id_field} uses the {fields[id_field].generator} generator, "
+                "which cannot generate unique values"
+            )
+        self.field_values = [
+            _field_values(field, self.rng, seed is not None, unique=name == id_field)
+            for name, field in fields.items()
+        ]
+        # events are rendered from a template of their JSON encoded field values
+        self.template = "{" + ",".join(
+            json.dumps(name).replace("%", "%%") + ":%s" for name in fields
+        ) + "}"
+        # same, with the publish time as the last value
+        self.stamped_template = self.template[:-1] + f',"{PUBLISH_TIME_FIELD}":%d}}'
+
+        self.duplication = duplication
+        self.candidates = deque(maxlen=DUPLICATE_CANDIDATES)
+        self.time_window = timedelta(seconds=parse_duration(duplication["time_window"])) if duplication else None
+        self.total_generated = 0
+        self.total_duplicates = 0
+
+    def generate_batch(self, n: int, duplicate_flags: bytearray = None) -> list:
+        """Generate `n` events as tuples of JSON encoded field values
+
+        If `duplicate_flags` is given, one flag per event (1 for duplicates) is appended to it.
+        """
+        rows = list(zip(*(values(n) for values in self.field_values)))
+        if not self.duplication:
+            self.total_generated += n
+            if duplicate_flags is not None:
+                duplicate_flags.extend(bytes(n))
+            return rows
+
+        now = datetime.now()
+        cutoff = now - self.time_window
+        while self.candidates and self.candidates[0][0] < cutoff:
+            self.candidates.popleft()
+        ratio = self.duplication["ratio"]
+        candidates, randrange = self.candidates, self.rng.randrange
+        generated, duplicates = self.total_generated, self.total_duplicates
+        flags = bytearray(n)
+        batch = []
+        fresh_rows = iter(rows)
+        for i in range(n):
+            if candidates and duplicates < ratio * max(1, generated):
+                batch.append(candidates[randrange(len(candidates))][1])
+                duplicates += 1
+                flags[i] = 1
+            else:
+                row = next(fresh_rows)
+                candidates.append((now, row))
+                generated += 1
+                batch.append(row)
+        self.total_generated, self.total_duplicates = generated, duplicates
+        if duplicate_flags is not None:
+            duplicate_flags.extend(flags)
+        return batch
+
+
+class NativeEventProducer:
+    """Produces events straight to Kafka with a producer tuned for throughput
+
+    Every event is stamped with its publish time right before it is produced. Produced
+    events are added to the shared `published_counter`, and the optional shared
+    `rate_limiter` controls the rate at which they are produced.
+    """
+
+    def __init__(self, producer_config: dict, topic: str, published_counter=None, rate_limiter=None,
+                 delivery_stats=None):
+        self.topic = topic
+        # with `delivery_stats` (DeliveryStats) every delivery is reported to it, otherwise only
+        # failed deliveries are reported, through a callback set once for all events
+        self.delivery_stats = delivery_stats
+        reporting = delivery_stats.producer_config() if delivery_stats is not None else {"delivery.report.only.error": True}
+        self.producer = Producer({
+            **producer_config,
+            **TUNED_PRODUCER_CONFIG,
+            **reporting,
+            "on_delivery": self._on_delivery,
+        })
+        self.published_counter = published_counter
+        self.rate_limiter = rate_limiter
+        self.delivery_errors = 0
+
+    def _on_delivery(self, err, msg):
+        if err:
+            self.delivery_errors += 1
+        if self.delivery_stats is not None:
+            self.delivery_stats.on_delivery(err, msg)
+
+    def produce_events(self, events: list, render):
+        """Produce events, `render(event, publish_time_us)` returns the payload of an event"""
+        for i in range(0, len(events), RATE_LIMIT_CHUNK_SIZE):
+            chunk = events[i:i + RATE_LIMIT_CHUNK_SIZE]
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(len(chunk))
+            self._produce_chunk(chunk, render)
+        self._count_published(len(events))
+
+    def produce_generated(self, generate, n: int, render):
+        """Produce `n` events returned by `generate(count)`, see `produce_events`
+
+        With a rate limiter, the events are generated one chunk at a time once the chunk is
+        allowed, so that their datetime and timestamp fields are not older than the chunk.
+        """
+        if self.rate_limiter is None:
+            self.produce_events(generate(n), render)
+            return
+        for i in range(0, n, RATE_LIMIT_CHUNK_SIZE):
+            count = min(RATE_LIMIT_CHUNK_SIZE, n - i)
+            self.rate_limiter.acquire(count)
+            self._produce_chunk(generate(count), render)
+        self._count_published(n)
+
+    def _produce_chunk(self, chunk: list, render):
+        # locals keep the per event loop cheap
+        topic, produce, time_ns = self.topic, self.producer.produce, time.time_ns
+        for event in chunk:
+            payload = render(event, time_ns() // 1000)
+            try:
+                produce(topic, payload)
+            except BufferError:
+                # local queue is full, wait for deliveries to make room and retry once
+                if self.delivery_stats is not None:
+                    self.delivery_stats.queue_full += 1
+                self.producer.poll(1)
+                produce(topic, payload)
+        self.producer.poll(0)
+
+    def _count_published(self, n: int):
+        if self.published_counter is not None:
+            with self.published_counter.get_lock():
+                self.published_counter.value += n
+
+    def flush(self):
+        self.producer.flush()
+        if self.delivery_errors:
+            log(
+                message=f"Message delivery failed for {self.delivery_errors} events",
+                status="Failed",
+                is_failure=True,
+                component="Kafka"
+            )
+
+
+def generate_events_native(
+    source_config: SourceConfig,
+    generator_schema: str,
+    duplication_rate: float = 0.1,
+    num_records: int = 10000,
+    rps: int = 0,
+    bulk_size: int = 50000,
+    published_counter=None,
+    rate_limiter=None,
+    deadline: float = None,
+    delivery_stats=None,
+):
+    """Generate events with duplicates with the native producer engine
+
+    Drop-in replacement of `generate_events_with_duplicates` that skips glassgen for
+    generating and publishing the events, see `NativeEventGenerator`.
+
+    Args:
+        source_config (SourceConfig): Source configuration
+        duplication_rate (float, optional): Duplication rate. Defaults to 0.1.
+        num_records (int, optional): Number of records to generate. Defaults to 10000.
+        rps (int, optional): Ignored, the rate is only controlled by `rate_limiter`.
+        bulk_size (int, optional): Number of events generated at once. Defaults to 50000.
+        generator_schema (str, optional): Path to generator schema.
+        published_counter (multiprocessing.Value, optional): Shared counter incremented with every produced bulk.
+        rate_limiter (SharedRateLimiter, optional): Limiter controlling the rate at which events are produced.
+        deadline (float, optional): Time after which no more bulks are started, even below `num_records`.
+        delivery_stats (DeliveryStats, optional): Stats recording the delivery reports of the producer.
+    """
+    deduplication = source_config.topics[0].deduplication
+    duplication = None
+    if deduplication.enabled:
+        duplication = {"ratio": duplication_rate, "time_window": deduplication.time_window}
+
+    generator = NativeEventGenerator(
+        json.load(open(generator_schema)),
+        duplication=duplication,
+        id_field=deduplication.id_field if deduplication.enabled else None,
+    )
+    producer = NativeEventProducer(
+        kafka_producer_config(source_config),
+        source_config.topics[0].name,
+        published_counter=published_counter,
+        rate_limiter=rate_limiter,
+        delivery_stats=delivery_stats,
+    )
+    template = generator.stamped_template
+
+    def render(row, publish_time_us):
+        return (template % (*row, publish_time_us)).encode()
+
+    start_time = time.time()
+    count = 0
+    while count < num_records and (deadline is None or time.time() < deadline):
+        batch_size = min(bulk_size, num_records - count)
+        producer.produce_generated(generator.generate_batch, batch_size, render)
+        count += batch_size
+    producer.flush()
+
+    return {
+        "time_taken_ms": round((time.time() - start_time) * 1000),
+        "num_records": count,
+        "total_generated": generator.total_generated,
+        "total_duplicates": generator.total_duplicates,
+        "duplication_ratio": round(generator.total_duplicates / max(1, generator.total_generated), 2),
+    }
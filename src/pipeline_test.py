@@ -1,31 +1,91 @@
 from src.pre_process import setup_pipeline
+import json
 import time
+from dataclasses import dataclass
+from typing import Optional
 from rich.console import Console
 from rich.panel import Panel
 from src.utils.logger import log
-from src.utils.clickhouse import read_clickhouse_table_size, create_clickhouse_client
+from src.utils.clickhouse import read_clickhouse_table_size, read_clickhouse_row_count, clickhouse_connection, read_clickhouse_latency_percentiles
 from src.utils.pipeline import GlassFlowPipeline
 from src.utils.metrics import TestResultModel
 from src.utils.publish import publish_to_kafka
+from src.utils.sampler import ThroughputSampler, write_timeseries, sink_rps_stats, time_to_reach
+from src.utils.soak import SoakMonitor
+from src.utils.telemetry import ResourceSampler
+from src.utils.delivery import write_delivery_stats
+from src.utils.metrics_channel import MetricsChannel
+from src.utils.dashboard import LiveDashboard
+from src.utils.exporter import MetricsExporter
+from src.utils.cleanup import CleanupManifest
+from src.utils.kafka import KafkaLagMonitor, create_kafka_admin_client, read_topic_watermarks
+from src.generate_events import PUBLISH_TIME_FIELD
+from src.dataset_cache import prepare_dataset
+from src.load_profile import LoadSchedule, parse_duration, variant_total_records, segment_stats, write_segment_stats, max_drain_lag
+from src.join_events import JOIN_RIGHT_PUBLISH_TIME_COLUMN
 
 console = Console(width=140)
 
-def wait_for_records(clickhouse_client, pipeline_config, n_records_before, total_generated, max_retries=30, retry_interval=10):
-    """Wait for records to be available in ClickHouse with retries"""
-    retries = 0
-    last_percentage = 0    
-    while retries < max_retries:
-        n_records_after = read_clickhouse_table_size(
-            pipeline_config.sink, clickhouse_client
+# seconds without new joined rows, on top of the max delay time of the sink, after which a join variant stops
+# waiting: the pairs published further apart than the join window are never joined
+JOIN_STALL_SEC = 60
+
+def next_poll_interval(remaining_records, sink_rps, min_interval=0.1, max_interval=5):
+    """Poll interval adapted to the expected time until all records are in ClickHouse
+
+    Polls often when the sink is close to the expected total and backs off during long drains.
+    """
+    if sink_rps <= 0:
+        return max_interval
+    interval = remaining_records / sink_rps / 4
+    return min(max(interval, min_interval), max_interval)
+
+def wait_for_records(clickhouse_client, pipeline_config, n_records_before, total_generated, timeout_sec=5000,
+                     min_interval=0.1, max_interval=5, count_mode="system", log_progress=True,
+                     stall_timeout_sec=None):
+    """Wait for records to be available in ClickHouse with an adaptive poll interval
+
+    With `count_mode="system"` progress is read from the table metadata in the system tables
+    and the exact `count()` is only run to confirm completion. Progress is logged every 5%
+    unless `log_progress` is off, e.g. while a live dashboard shows it. With a
+    `stall_timeout_sec`, waiting stops once no records arrived for that long.
+
+    Returns:
+        tuple[bool, float]: Whether all records arrived, and the time at which that was observed
+            (the time the last records arrived if waiting stopped early)
+    """
+    start_time = time.time()
+    last_percentage = 0
+    added_records = 0
+    last_added, last_progress_time = 0, start_time
+    while time.time() - start_time < timeout_sec:
+        n_records_after = read_clickhouse_row_count(
+            pipeline_config.sink, clickhouse_client, count_mode
         )
+        polled_at = time.time()
         added_records = n_records_after - n_records_before
-        
-        if added_records == total_generated:        
-            return True        
+
+        if added_records >= total_generated and count_mode != "exact":
+            # confirm with an exact count, the metadata can be ahead of it while parts are replaced
+            added_records = read_clickhouse_table_size(
+                pipeline_config.sink, clickhouse_client
+            ) - n_records_before
+        if added_records == total_generated:
+            return True, polled_at
+        if added_records != last_added:
+            last_added, last_progress_time = added_records, polled_at
+        elif stall_timeout_sec is not None and polled_at - last_progress_time >= stall_timeout_sec:
+            log(
+                message=f"No records arrived for {round(polled_at - last_progress_time)}s. Expected: {total_generated}, Found: {added_records}",
+                status="Stalled",
+                is_failure=True,
+                component="Pipeline"
+            )
+            return False, last_progress_time
         percentage = round(added_records/total_generated*100)
         # only log if percentage has changed by atleast 5
-        if abs(percentage - last_percentage) >= 5:
-            message = f"Waiting for records to be available... (attempt {retries + 1}/{max_retries}) Expected: {total_generated}, Found: {added_records} ({percentage}%)"
+        if log_progress and abs(percentage - last_percentage) >= 5:
+            message = f"Waiting for records to be available... ({round(polled_at - start_time)}s) Expected: {total_generated}, Found: {added_records} ({percentage}%)"
             log(
                 message=message,
                 status="Waiting",
@@ -33,8 +93,8 @@ def wait_for_records(clickhouse_client, pipeline_config, n_records_before, total
                 component="Pipeline"
             )
             last_percentage = percentage
-        time.sleep(retry_interval)
-        retries += 1
+        sink_rps = added_records / max(polled_at - start_time, 1e-3)
+        time.sleep(next_poll_interval(total_generated - added_records, sink_rps, min_interval, max_interval))
     
     console.print(Panel(
         f"[red]Timeout waiting for records[/red]\n"
@@ -42,12 +102,85 @@ def wait_for_records(clickhouse_client, pipeline_config, n_records_before, total
         title="❌ Timeout",
         border_style="red"
     ))
-    return False
+    return False, time.time()
+
+@dataclass
+class TrialOptions:
+    """Output files and run options of a variant trial, see `run_variant`
+
+    Files set to None are not written.
+    """
+    # published and sunk record counts, sampled every `sample_interval` seconds
+    timeseries_file: Optional[str] = None
+    # response of the pipeline to every segment of a load profile
+    segments_file: Optional[str] = None
+    # metrics per `soak_window_sec` window of a soak test
+    soak_windows_file: Optional[str] = None
+    # consumer lag on every partition of the topic
+    kafka_lag_file: Optional[str] = None
+    # CPU, memory, network and disk I/O, sampled every `resource_interval` seconds
+    resources_file: Optional[str] = None
+    # merged delivery latency histogram of the publishers
+    delivery_file: Optional[str] = None
+    # records published per partition
+    partitions_file: Optional[str] = None
+    # records the topics and tables created for the trial, for the cleanup after it
+    manifest: Optional[CleanupManifest] = None
+    sample_interval: float = 0.5
+    # how rows are counted while polling, see `read_clickhouse_row_count`
+    count_mode: str = "system"
+    dataset_cache_dir: str = "cache/datasets"
+    dataset_seed: int = 42
+    soak_window_sec: float = 60
+    # compose file of the containers whose resource usage is sampled
+    compose_file: Optional[str] = None
+    resource_interval: float = 1.0
+    dashboard: bool = True
+    exporter: Optional[MetricsExporter] = None
+
+
+def run_variant(pipeline_config_path: str, event_schema: str, variant_id: str, variant_config: dict, pipeline: GlassFlowPipeline, test_result: TestResultModel,
+                options: TrialOptions = None):
+    """Run a single variant of the load test
+
+    While publishing and draining, published and sunk record counts are sampled and written
+    to the time series file, together with the consumer lag of the pipeline on every
+    partition of the topic and the resource usage of the publishers and the containers of
+    the compose file (see `ResourceSampler`). The number of published records is verified
+    against the high watermarks of the topic, and the publishers record the delivery
+    reports of their records. The files and options are given by `options`.
 
-def run_variant(pipeline_config_path: str, event_schema: str, variant_id: str, variant_config: dict, pipeline: GlassFlowPipeline, test_result: TestResultModel):
-    """Run a single variant of the load test"""
-    # Set up pipeline with test configuration
-    pipeline = setup_pipeline(variant_id, pipeline_config_path, variant_config, pipeline)
+    With the "replay" producer engine, the events are taken from a seeded dataset in the
+    dataset cache, generated before publishing starts if it is not cached yet.
+
+    With a `load_profile`, the response of the pipeline to every segment of the profile is
+    derived from the samples and written to the segments file.
+
+    With a `soak_duration`, events are published continuously for that duration and the
+    samples are reduced to metrics per window while the test runs, see `SoakMonitor`.
+
+    With `dashboard`, a live dashboard of the rates, totals, lag and ETA replaces the
+    progress logs while publishing and draining, see `LiveDashboard`. The same live
+    metrics are exposed by the `exporter` (if given) until the samplers stop.
+
+    For join pipelines, two correlated streams are published concurrently, see
+    `_join_process_args`. The sink is expected to receive a row per matched pair, the
+    latency of a joined row is measured from the publish time of the later of its two
+    events, and waiting for the joined rows stops once none arrived for `JOIN_STALL_SEC`
+    beyond the max delay time of the sink.
+    """
+    options = options or TrialOptions()
+    soak = bool(variant_config.get("soak_duration"))
+    if soak and (variant_config.get("producer_engine") == "replay" or variant_config.get("load_profile")):
+        raise ValueError("Soak tests cannot use the replay producer engine or a load profile")
+    join = json.load(open(pipeline_config_path)).get("join", {}).get("enabled", False)
+    if join and (soak or variant_config.get("producer_engine") == "replay" or variant_config.get("load_profile")):
+        raise ValueError("Join pipelines cannot be tested with a soak duration, the replay producer engine or a load profile")
+
+    # Set up pipeline with test configuration, publishing starts once a canary event went through
+    glassflow_pipeline = pipeline
+    pipeline = setup_pipeline(variant_id, pipeline_config_path, variant_config, glassflow_pipeline, event_schema, options.manifest)
+    test_result.result_time_to_ready_ms = glassflow_pipeline.time_to_ready_ms
     
     log(
         message=f"Pipeline started: {pipeline.get_running_pipeline()}",
@@ -56,59 +189,226 @@ def run_variant(pipeline_config_path: str, event_schema: str, variant_id: str, v
         component="Pipeline"
     )
     
-    clickhouse_client = create_clickhouse_client(pipeline.config.sink)
-    n_records_before = read_clickhouse_table_size(
-        pipeline.config.sink, clickhouse_client
-    )
-    start_time = time.time()
-    
-    # Run multiple publishers in parallel
-    publish_stats = publish_to_kafka(pipeline, event_schema, variant_config)
-    # update
-    test_result.result_num_processes = variant_config["num_processes"]
-    test_result.result_total_generated = publish_stats['total_generated']
-    test_result.result_total_duplicates = publish_stats['total_duplicates']
-    test_result.result_num_records = publish_stats['num_records']    
-    test_result.result_time_taken_publish_ms = publish_stats['time_taken_publish_ms']
-    test_result.result_kafka_ingestion_rps = publish_stats['kafka_ingestion_rps']
+    dataset = None
+    if variant_config.get("producer_engine") == "replay":
+        dataset = prepare_dataset(
+            options.dataset_cache_dir, pipeline.config.source, event_schema,
+            num_records=variant_total_records(variant_config),
+            duplication_rate=variant_config["duplication_rate"],
+            seed=options.dataset_seed
+        )
+
+    with clickhouse_connection(pipeline.config.sink) as clickhouse_client:
+        n_records_before = read_clickhouse_table_size(
+            pipeline.config.sink, clickhouse_client
+        )
+        kafka_admin_client = create_kafka_admin_client(pipeline.config.source)
+        topics = [topic.name for topic in pipeline.config.source.topics]
+        watermarks_before = sum(sum(read_topic_watermarks(kafka_admin_client, topic).values()) for topic in topics)
+        start_time = time.time()
+        metrics_channel = MetricsChannel()
+        # expected share of unique records, see the duplication semantics of the producer engines
+        unique_ratio = 1 / (1 + variant_config["duplication_rate"]) if pipeline.config.source.topics[0].deduplication.enabled else 1.0
+        if join:
+            # a joined row per matched pair
+            unique_ratio = variant_config.get("join_match_rate", 1.0)
+        if soak:
+            sampler = SoakMonitor(
+                pipeline.config.sink, metrics_channel.published, start_time, options.soak_windows_file,
+                n_records_before=n_records_before, interval=options.sample_interval, count_mode=options.count_mode,
+                window_sec=options.soak_window_sec,
+                unique_ratio=unique_ratio
+            ).start()
+        else:
+            sampler = ThroughputSampler(
+                pipeline.config.sink, metrics_channel.published, start_time,
+                n_records_before=n_records_before, interval=options.sample_interval, count_mode=options.count_mode
+            ).start()
+        lag_monitor = KafkaLagMonitor(
+            pipeline.config.source, start_time, lag_file=options.kafka_lag_file, interval=options.sample_interval,
+            pipeline_id=pipeline.config.pipeline_id
+        ).start()
+        resource_sampler = ResourceSampler(
+            start_time, resources_file=options.resources_file, compose_file=options.compose_file,
+            interval=options.resource_interval
+        ).start()
+        live_dashboard = None
+        if options.dashboard:
+            live_dashboard = LiveDashboard(
+                variant_id, metrics_channel, sampler, lag_monitor, start_time,
+                expected_records=None if soak else round(variant_total_records(variant_config) * unique_ratio)
+            ).start()
+        exporter = options.exporter
+        if exporter:
+            exporter.set_variant(test_result, metrics_channel, sampler, lag_monitor, start_time)
     
-    console.print(Panel(
-        "[green]Data published successfully[/green]",
-        title="✅ Publication Complete",
-        border_style="green"
-    ))
+        # Run multiple publishers in parallel
+        try:
+            publish_stats = publish_to_kafka(pipeline, event_schema, variant_config, metrics_channel, dataset)
+        except Exception:
+            if live_dashboard:
+                live_dashboard.stop()
+            if exporter:
+                exporter.clear_variant()
+            sampler.stop()
+            lag_monitor.stop()
+            resource_sampler.stop()
+            raise
+        test_result.result_num_processes = variant_config["num_processes"]
+        _record_publish_stats(test_result, publish_stats)
+        write_delivery_stats(publish_stats['delivery'], options.delivery_file, options.partitions_file)
+
+        # the producers flushed, so the watermarks hold every record acknowledged by the brokers
+        watermarks_after = sum(sum(read_topic_watermarks(kafka_admin_client, topic).values()) for topic in topics)
+        watermark_records = watermarks_after - watermarks_before
+        test_result.result_kafka_watermark_records = watermark_records
+        if watermark_records != publish_stats['num_records']:
+            log(
+                message=f"Topic grew by {watermark_records} records, publishers reported {publish_stats['num_records']}",
+                status="Mismatch",
+                is_warning=True,
+                component="Kafka"
+            )
     
-    # Wait for records to be available in ClickHouse
-    total_generated = publish_stats['total_generated']
-
-    record_reading_start_time = time.time()
-    records_available = wait_for_records(
-        clickhouse_client=clickhouse_client,
-        pipeline_config=pipeline.config,
-        n_records_before=n_records_before,
-        total_generated=total_generated,
-        max_retries=1000,
-        retry_interval=5
-    )
-    record_reading_end_time = time.time()
-    if not records_available:
-        success = False
-    else:
         console.print(Panel(
-            f"[green]Excpeted records available in ClickHouse: Found {total_generated} records[/green]",
-            title="✅ Success",
+            "[green]Data published successfully[/green]",
+            title="✅ Publication Complete",
             border_style="green"
         ))
-        success = True
     
-    time_taken_complete_ms = round((time.time() - start_time) * 1000)
-    test_result.result_success = success
-    test_result.result_time_taken_ms = time_taken_complete_ms
-
-    # average latency 
-    test_result.result_avg_latency_ms = time_taken_complete_ms / publish_stats['num_records']
-    test_result.result_lag_ms = round((record_reading_end_time - record_reading_start_time) * 1000)
-    test_result.result_glassflow_rps = round((publish_stats['num_records'] / time_taken_complete_ms) * 1000)
+        # Wait for records to be available in ClickHouse
+        total_generated = publish_stats['sink_records_expected']
+        if join:
+            test_result.result_join_expected_rows = total_generated
+        if live_dashboard:
+            live_dashboard.expected_records = total_generated
+
+        record_reading_start_time = time.time()
+        try:
+            records_available, record_reading_end_time = wait_for_records(
+                clickhouse_client=clickhouse_client,
+                pipeline_config=pipeline.config,
+                n_records_before=n_records_before,
+                total_generated=total_generated,
+                timeout_sec=5000,
+                count_mode=options.count_mode,
+                log_progress=live_dashboard is None,
+                stall_timeout_sec=parse_duration(pipeline.config.sink.max_delay_time) + JOIN_STALL_SEC if join else None
+            )
+        finally:
+            if live_dashboard:
+                live_dashboard.stop()
+            if exporter:
+                exporter.clear_variant()
+        samples = sampler.stop()
+        lag_monitor.stop()
+        resource_sampler.stop()
+        test_result.result_kafka_max_lag = lag_monitor.max_total_lag
+        test_result.result_kafka_final_lag = lag_monitor.final_lag
+        for component, usage in resource_sampler.summary(publish_stats['num_records']).items():
+            setattr(test_result, f"result_{component}_cpu_sec_per_million", usage["cpu_sec_per_million"])
+            setattr(test_result, f"result_{component}_cpu_max_pct", usage["cpu_max_pct"])
+            setattr(test_result, f"result_{component}_rss_max_mb", usage["rss_max_mb"])
+        _record_sink_throughput(test_result, sampler, samples, soak, options.timeseries_file)
+        if variant_config.get("load_profile") and publish_stats["profile_start_time"] and len(samples) >= 2:
+            segments = segment_stats(
+                LoadSchedule(variant_config["load_profile"]), samples, publish_stats["profile_start_time"],
+                unique_ratio=publish_stats['total_generated'] / max(1, publish_stats["num_records"])
+            )
+            if options.segments_file:
+                write_segment_stats(segments, options.segments_file)
+            test_result.result_profile_max_backlog = max(s["backlog_end"] for s in segments)
+            test_result.result_profile_max_drain_lag_sec = max_drain_lag(segments)
+        if not records_available:
+            success = False
+        else:
+            console.print(Panel(
+                f"[green]Excpeted records available in ClickHouse: Found {total_generated} records[/green]",
+                title="✅ Success",
+                border_style="green"
+            ))
+            success = True
     
-    return test_result
+        time_taken_complete_ms = round((record_reading_end_time - start_time) * 1000)
+        test_result.result_success = success
+        test_result.result_time_taken_ms = time_taken_complete_ms
+
+        # average latency 
+        test_result.result_avg_latency_ms = time_taken_complete_ms / publish_stats['num_records']
+        test_result.result_lag_ms = round((record_reading_end_time - record_reading_start_time) * 1000)
+        test_result.result_glassflow_rps = round((publish_stats['num_records'] / time_taken_complete_ms) * 1000)
+
+        if join:
+            # joined-row throughput, from the start of publishing to the last joined row
+            joined_rows = samples[-1]["sunk"] if samples else 0
+            test_result.result_joined_rows = joined_rows
+            last_joined_at = time_to_reach(samples, joined_rows) if joined_rows > 0 else None
+            if last_joined_at is not None and last_joined_at > start_time:
+                test_result.result_joined_rps = round(joined_rows / (last_joined_at - start_time))
+
+        _record_latency(
+            test_result, pipeline.config.sink, clickhouse_client,
+            # a joined row can only be written once both of its events were published
+            f"greatest({PUBLISH_TIME_FIELD}, {JOIN_RIGHT_PUBLISH_TIME_COLUMN})" if join else PUBLISH_TIME_FIELD,
+            since=start_time
+        )
+        return test_result
+
+
+def _record_publish_stats(test_result: TestResultModel, publish_stats: dict):
+    """Set the results of the publishers, see `publish_to_kafka`"""
+    test_result.result_total_generated = publish_stats['total_generated']
+    test_result.result_total_duplicates = publish_stats['total_duplicates']
+    test_result.result_num_records = publish_stats['num_records']
+    test_result.result_time_taken_publish_ms = publish_stats['time_taken_publish_ms']
+    test_result.result_kafka_ingestion_rps = publish_stats['kafka_ingestion_rps']
+    test_result.result_offered_rps = publish_stats['offered_rps']
+    test_result.result_rps_sustained = publish_stats['rps_sustained']
+    test_result.result_delivery_latency_p50_ms = publish_stats['delivery_latency_p50_ms']
+    test_result.result_delivery_latency_p99_ms = publish_stats['delivery_latency_p99_ms']
+    test_result.result_delivery_latency_max_ms = publish_stats['delivery_latency_max_ms']
+    test_result.result_publish_mb_per_sec = publish_stats['publish_mb_per_sec']
+    test_result.result_delivery_errors = publish_stats['delivery_errors']
+    test_result.result_delivery_retries = publish_stats['delivery_retries']
+    test_result.result_producer_queue_full = publish_stats['producer_queue_full']
+    test_result.result_partition_skew = publish_stats['partition_skew']
 
+
+def _record_sink_throughput(test_result: TestResultModel, sampler, samples, soak: bool, timeseries_file: str = None):
+    """Set the sink throughput results from the samples, or the windows of a soak test"""
+    if soak:
+        # the soak monitor only keeps running aggregates of its windows
+        soak_summary = sampler.summary()
+        test_result.result_sink_rps_peak = soak_summary["sink_rps_max"]
+        test_result.result_sink_rps_mean = soak_summary["sink_rps_mean"]
+        test_result.result_soak_windows = soak_summary["windows"]
+        test_result.result_soak_sink_rps_min = soak_summary["sink_rps_min"]
+        test_result.result_soak_throughput_decay_pct = soak_summary["throughput_decay_pct"]
+        test_result.result_soak_latency_p99_max_ms = soak_summary["latency_p99_max_ms"]
+        return
+    if timeseries_file:
+        write_timeseries(samples, timeseries_file)
+    sink_rps = sink_rps_stats(samples)
+    test_result.result_sink_rps_peak = sink_rps["peak"]
+    test_result.result_sink_rps_mean = sink_rps["mean"]
+    test_result.result_sink_rps_steady = sink_rps["steady"]
+
+
+def _record_latency(test_result: TestResultModel, sink_config, clickhouse_client, publish_time_expression: str,
+                    since: float = None):
+    """Set the per record end-to-end latency, computed from publish and ingest timestamps in the sink
+
+    Only the rows inserted `since` (epoch seconds, if given) are taken into account.
+    """
+    latency = read_clickhouse_latency_percentiles(sink_config, clickhouse_client, publish_time_expression, since=since)
+    test_result.result_latency_p50_ms = latency["p50"]
+    test_result.result_latency_p90_ms = latency["p90"]
+    test_result.result_latency_p99_ms = latency["p99"]
+    test_result.result_latency_p999_ms = latency["p999"]
+    test_result.result_latency_max_ms = latency["max"]
+    log(
+        message=f"Latency p50: {latency['p50']} ms, p99: {latency['p99']} ms, max: {latency['max']} ms",
+        status="Measured",
+        is_success=True,
+        component="Clickhouse"
+    )
@@ -2,16 +2,29 @@ import json
 from glassflow_clickhouse_etl.models import PipelineConfig
 from src.utils.pipeline import GlassFlowPipeline
 from src.utils.kafka import create_topics_if_not_exists
-from src.utils.clickhouse import create_clickhouse_client, create_table_if_not_exists
+from src.utils.clickhouse import clickhouse_connection, create_table_if_not_exists
+from src.generate_events import PUBLISH_TIME_FIELD
+from src.join_events import JOIN_RIGHT_PUBLISH_TIME_COLUMN
+from src.utils.cleanup import CleanupManifest
 
-def pre_process_kafka_clickhouse(pipeline_config: PipelineConfig):
-    clickhouse_client = create_clickhouse_client(pipeline_config.sink)
+def pre_process_kafka_clickhouse(pipeline_config: PipelineConfig, manifest: CleanupManifest = None):
+    """Create the sink table and the source topics, recording them in the manifest
+
+    They are named after the variant, so a table or topic that already exists was left by
+    another run (an interrupted one, or one of the same parameters under another test ID)
+    and holds its records: it is dropped and created again, empty.
+    """
     if pipeline_config.join.enabled:
         join_key = pipeline_config.join.sources[0].join_key
     else:
         join_key = None
-    create_table_if_not_exists(pipeline_config.sink, clickhouse_client, join_key)    
-    create_topics_if_not_exists(pipeline_config.source)
+    with clickhouse_connection(pipeline_config.sink) as clickhouse_client:
+        create_table_if_not_exists(pipeline_config.sink, clickhouse_client, join_key, drop_existing=True)
+    if manifest is not None:
+        manifest.add_tables([pipeline_config.sink.table])
+    topics = create_topics_if_not_exists(pipeline_config.source, drop_existing=True)
+    if manifest is not None:
+        manifest.add_topics(topics)
 
 
 def update_pipeline_config(config, variant_id, variant_config):
@@ -21,20 +34,65 @@ def update_pipeline_config(config, variant_id, variant_config):
     max_delay_time = variant_config["max_delay_time"]
     #variant_config 
     config["pipeline_id"] = variant_id
-    config["source"]["topics"][0]["name"] = f"{variant_id}"
     config["sink"]["table"] = f"{variant_id}"
+    if config.get("join", {}).get("enabled"):
+        rename_join_topics(config, variant_id)
+    else:
+        config["source"]["topics"][0]["name"] = f"{variant_id}"
     
-    # Update all source_ids in table_mapping
-    for mapping in config["sink"]["table_mapping"]:
-        mapping["source_id"] = f"{variant_id}"
+        # Update all source_ids in table_mapping
+        for mapping in config["sink"]["table_mapping"]:
+            mapping["source_id"] = f"{variant_id}"
     
     # update the deduplication_window
-    config["source"]["topics"][0]["deduplication"]["time_window"] = dedup_window
+    if config["source"]["topics"][0].get("deduplication"):
+        config["source"]["topics"][0]["deduplication"]["time_window"] = dedup_window
     config["sink"]["max_batch_size"] = max_batch_size
     config["sink"]["max_delay_time"] = max_delay_time
+    if config.get("join", {}).get("enabled"):
+        # a joined row is complete once the later of its two events arrived
+        for source in config["join"]["sources"]:
+            column = PUBLISH_TIME_FIELD if source["orientation"] == "left" else JOIN_RIGHT_PUBLISH_TIME_COLUMN
+            add_publish_time_mapping(config, source["source_id"], column)
+    else:
+        add_publish_time_mapping(config, variant_id)
+    return config
+
+def rename_join_topics(config, variant_id):
+    """Name the topics of a join pipeline after the variant and the side of the join they feed"""
+    names = {
+        source["source_id"]: f"{variant_id}_{source['orientation']}"
+        for source in config["join"]["sources"]
+    }
+    for topic in config["source"]["topics"]:
+        topic["name"] = names.get(topic["name"], topic["name"])
+    for source in config["join"]["sources"]:
+        source["source_id"] = names[source["source_id"]]
+    for mapping in config["sink"]["table_mapping"]:
+        mapping["source_id"] = names.get(mapping["source_id"], mapping["source_id"])
+    return config
+
+def add_publish_time_mapping(config, source_id, column_name=PUBLISH_TIME_FIELD):
+    """Carry the publish timestamp of every event through the pipeline into the sink table"""
+    for topic in config["source"]["topics"]:
+        if topic["name"] != source_id:
+            continue
+        fields = topic["schema"]["fields"]
+        if not any(field["name"] == PUBLISH_TIME_FIELD for field in fields):
+            fields.append({"name": PUBLISH_TIME_FIELD, "type": "int64"})
+
+    table_mapping = config["sink"]["table_mapping"]
+    if not any(mapping["column_name"] == column_name for mapping in table_mapping):
+        table_mapping.append({
+            "source_id": source_id,
+            "field_name": PUBLISH_TIME_FIELD,
+            "column_name": column_name,
+            "column_type": "Int64"
+        })
     return config
 
-def setup_pipeline(variant_id: str, pipeline_config_path: str, variant_config: dict, pipeline: GlassFlowPipeline):
+def setup_pipeline(variant_id: str, pipeline_config_path: str, variant_config: dict, pipeline: GlassFlowPipeline,
+                   generator_schema: str = None, manifest: CleanupManifest = None):
     """Set up a pipeline with the given configuration
     
     Args:
@@ -42,6 +100,8 @@ def setup_pipeline(variant_id: str, pipeline_config_path: str, variant_config: d
         pipeline_config_path (str): Path to the pipeline configuration file
         variant_config (dict): Configuration for this variant
         pipeline (GlassFlowPipeline): Pipeline instance to use
+        generator_schema (str, optional): Path to the generator schema of the readiness canary event
+        manifest (CleanupManifest, optional): Manifest recording the topics and tables created for the variant
         
     Returns:
         Pipeline: The created pipeline
@@ -53,10 +113,10 @@ def setup_pipeline(variant_id: str, pipeline_config_path: str, variant_config: d
     updated_config = update_pipeline_config(pipeline_config, variant_id, variant_config)
     pipeline_config = GlassFlowPipeline.load_conf(updated_config)    
     # pre process the pipeline config to create the table and topics
-    pre_process_kafka_clickhouse(pipeline_config)
+    pre_process_kafka_clickhouse(pipeline_config, manifest)
 
     # create the pipeline
     # remove any existing pipeline and create a new one    
     pipeline.stop_pipeline_if_running()    
     # create the pipeline
-    return pipeline.create_pipeline(pipeline_config)
+    return pipeline.create_pipeline(pipeline_config, generator_schema)
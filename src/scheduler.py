@@ -0,0 +1,99 @@
+import json
+import multiprocessing
+from typing import Callable, Dict, List, Tuple
+from src.utils.pipeline import GlassFlowPipeline
+from src.utils.kafka import kafka_brokers
+from src.utils.clickhouse import clickhouse_host
+from src.utils.logger import get_log_queue, log, set_log_queue
+from src.utils.resources import ResourceManager
+
+
+def check_stacks_isolated(pipeline_config_paths: List[str]):
+    """Make sure the stacks do not share Kafka or ClickHouse
+
+    The topic and table of a variant are named after the variant, not its trial, so the
+    trials of a variant running concurrently on stacks sharing Kafka or ClickHouse would
+    publish to the same topic, count the rows of the same table, and delete them for each
+    other when cleaning up.
+    """
+    kafka_endpoints, clickhouse_endpoints = {}, {}
+    for path in pipeline_config_paths:
+        config = GlassFlowPipeline.load_conf(json.load(open(path)))
+        kafka = tuple(sorted(kafka_brokers(config.source)))
+        clickhouse = (clickhouse_host(config.sink), config.sink.port)
+        for endpoint, seen, name in ((kafka, kafka_endpoints, "Kafka"), (clickhouse, clickhouse_endpoints, "ClickHouse")):
+            if endpoint in seen:
+                raise ValueError(f"{seen[endpoint]} and {path} share {name} {endpoint}, every GlassFlow host needs its own stack")
+            seen[endpoint] = path
+
+
+def _stack_worker(glassflow_host: str, pipeline_config_path: str, queue, run_variant_test: Callable, log_queue=None):
+    """Run the variants taken from the queue one after the other on one stack"""
+    set_log_queue(log_queue)
+    # the clients of the parent process cannot be used after the fork
+    with ResourceManager():
+        _run_stack_variants(glassflow_host, pipeline_config_path, queue, run_variant_test)
+
+
+def _run_stack_variants(glassflow_host: str, pipeline_config_path: str, queue, run_variant_test: Callable):
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        variant_id, config, trial = item
+        log(
+            message=f"Variant [italic u]{variant_id}[/italic u] trial {trial} on {glassflow_host}",
+            status="Started",
+            is_success=True,
+            component="Scheduler",
+        )
+        try:
+            run_variant_test(variant_id, config, glassflow_host=glassflow_host, pipeline_config_path=pipeline_config_path,
+                             trial=trial)
+        except Exception as e:
+            # the trial has no result, so it runs again on resume
+            log(
+                message=f"Variant [italic u]{variant_id}[/italic u] trial {trial} on {glassflow_host}",
+                status=str(e),
+                is_failure=True,
+                component="Scheduler",
+            )
+
+
+def run_on_stacks(stacks: List[Tuple[str, str]], variants: List[Tuple[str, Dict, int]], run_variant_test: Callable):
+    """Run trials of variants concurrently, one at a time on each stack
+
+    `stacks` are (GlassFlow host, pipeline config path) pairs and `variants` are (variant ID,
+    config, trial) triples. Every stack gets its own process that takes the next trial from a
+    shared queue as soon as its previous one finished, so faster stacks run more trials.
+    `run_variant_test(variant_id, config, glassflow_host=..., pipeline_config_path=..., trial=...)`
+    runs one trial and writes its result.
+    """
+    queue = multiprocessing.Queue()
+    for variant in variants:
+        queue.put(variant)
+    for _ in stacks:
+        queue.put(None)
+
+    # not daemonic, the publishers of a variant run in child processes of the stack process
+    processes = [
+        multiprocessing.Process(
+            target=_stack_worker,
+            args=(host, pipeline_config_path, queue, run_variant_test, get_log_queue()),
+            name=f"stack-{i}",
+        )
+        for i, (host, pipeline_config_path) in enumerate(stacks)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    for (host, _), process in zip(stacks, processes):
+        if process.exitcode != 0:
+            log(
+                message=f"Stack {host} stopped with exit code {process.exitcode}, the trials it did not finish run again on resume",
+                status="Failed",
+                is_warning=True,
+                component="Scheduler",
+            )
@@ -1,53 +1,189 @@
 import uuid
 import json
 import time
-from typing import Dict, List
-from src.pipeline_test import run_variant
+from typing import Dict, List, Union
+from src.pipeline_test import TrialOptions, run_variant
+from src.scheduler import check_stacks_isolated, run_on_stacks
 from src.utils.pipeline import GlassFlowPipeline
-from src.utils.clickhouse import cleanup_clickhouse
-from src.utils.kafka import cleanup_kafka
+from src.utils.cleanup import CleanupManifest, cleanup_artifacts
 from src.utils.metrics import TestResultModel, TestResultsHandler
+from src.utils.resources import ResourceManager
+from src.utils.logger import log
+from src.utils.exporter import MetricsExporter
 from rich.console import Console
 from rich.panel import Panel
 import os
 console = Console(width=140)
 
+# default values of the variant parameters added after the first release, see `_create_variant_id`
+OPTIONAL_PARAMETER_DEFAULTS = {
+    "target_rps": 0,
+    "producer_engine": "glassgen",
+    "load_profile": None,
+    "soak_duration": "",
+    "join_match_rate": 1.0,
+    "join_time_skew": "0s",
+}
+
 class TestExecutor:
     def __init__(self, results_dir: str, 
                  test_id: str, 
-                 pipeline_config_path: str, 
-                 glassflow_host: str = "http://localhost:8080", 
-                 event_schema: str = "config/glassgen/user_event.json"):
+                 pipeline_config_path: Union[str, List[str]], 
+                 glassflow_host: Union[str, List[str]] = "http://localhost:8080", 
+                 event_schema: str = "config/glassgen/user_event.json",
+                 sample_interval: float = 0.5,
+                 count_mode: str = "system",
+                 dataset_cache_dir: str = "cache/datasets",
+                 dataset_seed: int = 42,
+                 soak_window_sec: float = 60,
+                 cleanup_workers: int = 4,
+                 compose_file: str = "docker-compose.yaml",
+                 resource_interval: float = 1.0,
+                 dashboard: bool = True,
+                 exporter: MetricsExporter = None):
         self.test_id = test_id        
-        self.pipeline_config_path = pipeline_config_path
-        self.glassflow_host = glassflow_host
+        # one stack (GlassFlow host and the pipeline config of its Kafka and ClickHouse) per host
+        hosts = [glassflow_host] if isinstance(glassflow_host, str) else list(glassflow_host)
+        config_paths = [pipeline_config_path] if isinstance(pipeline_config_path, str) else list(pipeline_config_path)
+        if len(config_paths) == 1:
+            config_paths = config_paths * len(hosts)
+        if len(config_paths) != len(hosts):
+            raise ValueError("Give either one pipeline config or one per GlassFlow host")
+        if len(hosts) > 1:
+            check_stacks_isolated(config_paths)
+        self.stacks = list(zip(hosts, config_paths))
+        self.glassflow_host, self.pipeline_config_path = self.stacks[0]
         self.event_schema = event_schema
+        self.results_dir = results_dir
+        self.sample_interval = sample_interval
+        self.count_mode = count_mode
+        self.dataset_cache_dir = dataset_cache_dir
+        self.dataset_seed = dataset_seed
+        self.soak_window_sec = soak_window_sec
+        self.cleanup_workers = cleanup_workers
+        # the containers of the compose file are those of a single local stack
+        self.compose_file = compose_file if len(self.stacks) == 1 else None
+        self.resource_interval = resource_interval
+        # a live dashboard per stack process would overwrite each other
+        self.dashboard = dashboard and len(self.stacks) == 1
+        # the live metrics of the variants run in the processes of several stacks do not reach the
+        # exporter, it only exports the finished variants then
+        self.exporter = exporter if len(self.stacks) == 1 else None
         results_file = os.path.join(results_dir, f"{test_id}_results.csv")
-        self.result_writer = TestResultsHandler(results_file)
+        self.result_writer = TestResultsHandler(results_file, test_id)
+        # Kafka and ClickHouse clients reused by all variants run in this process
+        self.resources = ResourceManager()
     
     def _create_variant_id(self, config: Dict) -> str:
-        """Create a unique test ID for a configuration"""
+        """Create a unique test ID for a configuration
+
+        Parameters added after the first release are left out while at their default, so a
+        configuration keeps the ID it had before they existed.
+        """
         # Create a deterministic test ID based on configuration
+        config = {
+            key: value for key, value in config.items()
+            if key not in OPTIONAL_PARAMETER_DEFAULTS or value != OPTIONAL_PARAMETER_DEFAULTS[key]
+        }
         config_str = json.dumps(config, sort_keys=True)
         config_hash = str(uuid.uuid5(uuid.NAMESPACE_DNS, config_str))[:8]
         return f"load_{config_hash}" 
 
-    def run_variant_test(self, variant_id: str, load_test_config: Dict):
-        """Run a single test configuration"""
-        pipeline = GlassFlowPipeline(host=self.glassflow_host)
-        pipeline_config = pipeline.load_conf(json.load(open(self.pipeline_config_path)))
-        cleanup_kafka(pipeline_config.source)
-        cleanup_clickhouse(pipeline_config.sink)
+    def _run_name(self, variant_id: str, trial: int) -> str:
+        """Name of the files of a trial, the first trial keeps the name of the variant"""
+        return variant_id if trial == 1 else f"{variant_id}_trial{trial}"
+
+    def _timeseries_file(self, run_name: str) -> str:
+        """Path of the throughput time-series file of a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_timeseries.csv")
+
+    def _segments_file(self, run_name: str) -> str:
+        """Path of the per load profile segment stats of a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_segments.csv")
+
+    def _soak_windows_file(self, run_name: str) -> str:
+        """Path of the windowed metrics of a soak test trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_soak.csv")
+
+    def _kafka_lag_file(self, run_name: str) -> str:
+        """Path of the per partition consumer lag of a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_kafka_lag.csv")
+
+    def _resources_file(self, run_name: str) -> str:
+        """Path of the resource usage of the publishers and containers during a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_resources.csv")
 
+    def _delivery_file(self, run_name: str) -> str:
+        """Path of the delivery latency histogram of the publishers of a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_delivery.csv")
+
+    def _partitions_file(self, run_name: str) -> str:
+        """Path of the records published per partition during a trial, next to the results file"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_partitions.csv")
+
+    def _manifest_file(self, run_name: str) -> str:
+        """Path of the manifest of the topics and tables created for a trial, removed once they are deleted"""
+        return os.path.join(self.results_dir, f"{self.test_id}_{run_name}_manifest.json")
+
+    def _trial_options(self, run_name: str, manifest: CleanupManifest) -> TrialOptions:
+        """Output files and run options of a trial, the files are next to the results file"""
+        return TrialOptions(
+            timeseries_file=self._timeseries_file(run_name),
+            segments_file=self._segments_file(run_name),
+            soak_windows_file=self._soak_windows_file(run_name),
+            kafka_lag_file=self._kafka_lag_file(run_name),
+            resources_file=self._resources_file(run_name),
+            delivery_file=self._delivery_file(run_name),
+            partitions_file=self._partitions_file(run_name),
+            manifest=manifest,
+            sample_interval=self.sample_interval,
+            count_mode=self.count_mode,
+            dataset_cache_dir=self.dataset_cache_dir,
+            dataset_seed=self.dataset_seed,
+            soak_window_sec=self.soak_window_sec,
+            compose_file=self.compose_file,
+            resource_interval=self.resource_interval,
+            dashboard=self.dashboard,
+            exporter=self.exporter,
+        )
+
+    def _cleanup_variant(self, pipeline: GlassFlowPipeline, pipeline_config, manifest: CleanupManifest) -> float:
+        """Stop the pipeline and delete the topics and tables of the variant, returns the time it took in seconds"""
         start_time = time.time()
-        test_result = TestResultModel.from_load_test_config(self.test_id, variant_id, load_test_config)        
+        try:
+            pipeline.cleanup_pipeline()
+        except Exception as e:
+            log(
+                message="Cleanup: Error stopping pipeline",
+                status=str(e),
+                is_failure=True,
+                component="Pipeline",
+            )
+        cleanup_artifacts(manifest, pipeline_config.source, pipeline_config.sink, self.cleanup_workers)
+        return time.time() - start_time
+
+    def run_variant_test(self, variant_id: str, load_test_config: Dict, glassflow_host: str = None,
+                         pipeline_config_path: str = None, trial: int = 1) -> TestResultModel:
+        """Run one trial of a test configuration, on the first stack unless another one is given"""
+        run_name = self._run_name(variant_id, trial)
+        glassflow_host = glassflow_host or self.glassflow_host
+        pipeline_config_path = pipeline_config_path or self.pipeline_config_path
+        pipeline = GlassFlowPipeline(host=glassflow_host)
+        pipeline_config = pipeline.load_conf(json.load(open(pipeline_config_path)))
+        # artifacts left behind by an interrupted earlier run of this variant
+        manifest = CleanupManifest(self._manifest_file(run_name))
+        cleanup_sec = cleanup_artifacts(manifest, pipeline_config.source, pipeline_config.sink, self.cleanup_workers)
+
+        start_time = time.time()
+        test_result = TestResultModel.from_load_test_config(self.test_id, variant_id, load_test_config, trial)        
+        test_result.glassflow_host = glassflow_host
         try:            
-            test_result = run_variant(self.pipeline_config_path, self.event_schema, variant_id, load_test_config, pipeline, test_result)
+            test_result = run_variant(
+                pipeline_config_path, self.event_schema, variant_id, load_test_config, pipeline, test_result,
+                self._trial_options(run_name, manifest)
+            )
             duration = time.time() - start_time
             test_result.duration_sec = duration        
-            cleanup_kafka(pipeline_config.source)
-            cleanup_clickhouse(pipeline_config.sink)
-            pipeline.cleanup_pipeline()          
             print(f"Test result: {test_result.result_success}")
         except Exception as e:
             duration = time.time() - start_time
@@ -62,46 +198,74 @@ class TestExecutor:
             test_result.result_success = False
             test_result.duration_sec = duration
 
+        cleanup_sec += self._cleanup_variant(pipeline, pipeline_config, manifest)
+        test_result.result_cleanup_ms = round(cleanup_sec * 1000)
+
         # now write the test result to the file 
         self.result_writer.write_result(test_result)
         self.result_writer.display_results(test_result)
+        summary = self.result_writer.write_trial_summary(variant_id)
+        if summary["trials"] > 1:
+            self.result_writer.display_trial_summary(summary)
+        return test_result
 
-    def run_tests(self, resume: bool = True, variant_configs: List[Dict] = None):
-        """Run all test configurations, with option to resume from last completed test"""
-        # Get test configurations        
-        # Get completed tests if resuming
-        completed_tests = self.result_writer.get_completed_tests() if resume else []
-        completed_variant_ids = {test["variant_id"] for test in completed_tests}
-        
+    def run_config(self, config: Dict, resume: bool = True) -> TestResultModel:
+        """Run a test configuration on the first stack and return its result
+
+        With `resume`, the stored result is returned instead if the configuration already ran.
+        """
+        variant_id = self._create_variant_id(config)
+        if resume:
+            test_result = self.result_writer.get_result(variant_id)
+            if test_result is not None:
+                return test_result
+        return self.run_variant_test(variant_id, config)
+
+    def run_tests(self, resume: bool = True, variant_configs: List[Dict] = None, repetitions: int = 1):
+        """Run all test configurations `repetitions` times, with option to resume from the last completed trial"""
         # Print test execution header
         console.print(Panel(
             f"[bold blue]Test ID:[/bold blue] {self.test_id}\n"
             f"[bold blue]Total Configurations:[/bold blue] {len(variant_configs)}\n"
+            f"[bold blue]Trials per Configuration:[/bold blue] {repetitions}\n"
             f"[bold blue]Resume Mode:[/bold blue] {'Enabled' if resume else 'Disabled'}",
             title="🚀 Test Execution Started",
             border_style="blue"
         ))
         
-        # Run each test configuration
+        with self.resources:
+            self._run_configurations(resume, variant_configs, repetitions)
+
+    def _run_configurations(self, resume: bool, variant_configs: List[Dict], repetitions: int = 1):
+        """Run the trials that did not complete yet"""
+        # Run each trial of each test configuration
+        pending = []
         for i, config in enumerate(variant_configs, 1):
             variant_id = self._create_variant_id(config)
-            if resume and variant_id in completed_variant_ids:                
-                console.print(Panel(
+            for trial in range(1, repetitions + 1):
+                header = (
                     f"[bold cyan]Test {i}/{len(variant_configs)}[/bold cyan]\n"
-                    f"[bold cyan]Variant ID:[/bold cyan] {variant_id}\n\n"
-                    f"[bold cyan]Configuration:[/bold cyan]\n{json.dumps(config, indent=2)}",
-                    title="⏭️ Skipped CompletedTest",
-                    border_style="cyan"
-                ))
-                continue
-
-            # Print test configuration
+                    + (f"[bold cyan]Trial {trial}/{repetitions}[/bold cyan]\n" if repetitions > 1 else "")
+                    + f"[bold cyan]Variant ID:[/bold cyan] {variant_id}\n\n"
+                    f"[bold cyan]Configuration:[/bold cyan]\n{json.dumps(config, indent=2)}"
+                )
+                if resume and self.result_writer.has_result(variant_id, trial):
+                    console.print(Panel(header, title="⏭️ Skipped CompletedTest", border_style="cyan"))
+                    continue
+
+                if len(self.stacks) > 1:
+                    pending.append((variant_id, config, trial))
+                    continue
+
+                # Print test configuration
+                console.print(Panel(header, title="🔄 Running Test", border_style="cyan"))
+                self.run_variant_test(variant_id, config, trial=trial)
+
+        if pending:
             console.print(Panel(
-                f"[bold cyan]Test {i}/{len(variant_configs)}[/bold cyan]\n"
-                f"[bold cyan]Variant ID:[/bold cyan] {variant_id}\n\n"
-                f"[bold cyan]Configuration:[/bold cyan]\n{json.dumps(config, indent=2)}",
-                title="🔄 Running Test",
+                f"[bold cyan]Trials:[/bold cyan] {len(pending)}\n"
+                f"[bold cyan]GlassFlow hosts:[/bold cyan]\n" + "\n".join(host for host, _ in self.stacks),
+                title="🔄 Running Tests Concurrently",
                 border_style="cyan"
             ))
-            
-            self.run_variant_test(variant_id, config)
+            run_on_stacks(self.stacks, pending, self.run_variant_test)
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from glassflow_clickhouse_etl import models
+from src.utils.clickhouse import cleanup_clickhouse
+from src.utils.kafka import cleanup_kafka
+
+
+class CleanupManifest:
+    """Topics and tables created for a variant, the only ones its cleanup deletes
+
+    With a `path`, the manifest is saved on every change, so the artifacts of a variant
+    that was interrupted are still known (and cleaned up) when it runs again.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.topics: List[str] = []
+        self.tables: List[str] = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.topics = saved["topics"]
+            self.tables = saved["tables"]
+
+    def __bool__(self):
+        return bool(self.topics or self.tables)
+
+    def add_topics(self, topics: List[str]):
+        self.topics += [topic for topic in topics if topic not in self.topics]
+        self._save()
+
+    def add_tables(self, tables: List[str]):
+        self.tables += [table for table in tables if table not in self.tables]
+        self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", 'w') as f:
+            json.dump({"topics": self.topics, "tables": self.tables}, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def clear(self):
+        self.topics, self.tables = [], []
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def cleanup_artifacts(manifest: CleanupManifest, source_config: models.SourceConfig,
+                      sink_config: models.SinkConfig, max_workers: int = 4) -> float:
+    """Delete the topics and tables of a manifest, returns the time it took in seconds
+
+    Topic deletions run on the brokers while the tables are dropped, at most `max_workers`
+    tables at a time. The manifest is cleared once everything is gone, otherwise it keeps
+    all artifacts so that the next cleanup tries again.
+    """
+    start_time = time.time()
+    if manifest:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            topics_future = executor.submit(cleanup_kafka, source_config, manifest.topics)
+            tables_deleted = cleanup_clickhouse(sink_config, manifest.tables, max_workers)
+            topics_deleted = topics_future.result()
+        if topics_deleted and tables_deleted:
+            manifest.clear()
+    return time.time() - start_time
@@ -1,17 +1,27 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
 from clickhouse_driver import Client
 from glassflow_clickhouse_etl import models
 from src.utils.logger import log
+from src.utils.resources import active_resource_manager
+
+# Column filled by ClickHouse with the time each row was inserted by the sink
+INGEST_TIME_COLUMN = "ingested_at"
+LATENCY_QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+def clickhouse_host(sink_config: models.SinkConfig) -> str:
+    """ClickHouse host as reached from the host running the load test"""
+    if sink_config.provider == "localhost":
+        return "localhost"
+    return sink_config.host
 
 def create_clickhouse_client(sink_config: models.SinkConfig):
     """Create a ClickHouse client"""
     # GlassFlow uses Clickhouse native port while the python client uses http
-    host = sink_config.host
-    if sink_config.provider == "localhost":
-        host = "localhost"
-    
     return Client(
-        host=host,
+        host=clickhouse_host(sink_config),
         port=sink_config.port,
         user=sink_config.username,
         password=base64.b64decode(sink_config.password).decode("utf-8"),
@@ -19,24 +29,59 @@ def create_clickhouse_client(sink_config: models.SinkConfig):
         secure=sink_config.secure,        
     )
 
+@contextmanager
+def clickhouse_connection(sink_config: models.SinkConfig):
+    """ClickHouse client for the duration of a `with` block
+
+    While a resource manager is active the client is lent from its pool, otherwise it is
+    created for the block and disconnected afterwards.
+    """
+    resources = active_resource_manager()
+    if resources is None:
+        client = create_clickhouse_client(sink_config)
+        try:
+            yield client
+        finally:
+            client.disconnect()
+        return
+    key = ("clickhouse", clickhouse_host(sink_config), sink_config.port, sink_config.username,
+           sink_config.password, sink_config.database, sink_config.secure)
+    with resources.lend(key, lambda: create_clickhouse_client(sink_config), close=lambda c: c.disconnect()) as client:
+        yield client
+
 def create_table_if_not_exists(
-    sink_config: models.SinkConfig, client, join_key: str = None
+    sink_config: models.SinkConfig, client, join_key: str = None, drop_existing: bool = False
 ):
-    """Create a table in ClickHouse if it doesn't exist"""
+    """Create a table in ClickHouse if it doesn't exist, returns whether it was created
+
+    With `drop_existing`, a table that already exists is stale: it is dropped and created
+    again, empty.
+    """
     if client.execute(f"EXISTS TABLE {sink_config.table}")[0][0]:
+        if not drop_existing:
+            log(
+                message=f"Sink [italic u]{sink_config.table}[/italic u]",
+                status="Already exists",
+                is_success=True,
+                component="Clickhouse",
+            )
+            return False
         log(
-            message=f"Sink [italic u]{sink_config.table}[/italic u]",
-            status="Already exists",
-            is_success=True,
+            message=f"Sink [italic u]{sink_config.table}[/italic u] left by an earlier run, dropping it",
+            status="Stale",
+            is_warning=True,
             component="Clickhouse",
         )
-        return
+        client.execute(f"DROP TABLE {sink_config.table} SYNC")
     order_by_column = (
         sink_config.table_mapping[0].column_name if not join_key else join_key
     )
     columns_def = [
         f"{m.column_name} {m.column_type}" for m in sink_config.table_mapping
     ]
+    columns_def.append(f"{INGEST_TIME_COLUMN} DateTime64(6) DEFAULT now64(6)")
+    # rows are inserted roughly in ingest time order, so windowed latency queries skip most granules
+    columns_def.append(f"INDEX {INGEST_TIME_COLUMN}_minmax {INGEST_TIME_COLUMN} TYPE minmax GRANULARITY 1")
     client.execute(
         f"""
         CREATE TABLE IF NOT EXISTS {sink_config.table} ({",".join(columns_def)})
@@ -50,11 +95,72 @@ def create_table_if_not_exists(
         is_success=True,
         component="Clickhouse",
     )
+    return True
 
 def read_clickhouse_table_size(sink_config: models.SinkConfig, client) -> int:
     """Read the size of a table in ClickHouse"""
     return client.execute(f"SELECT count() FROM {sink_config.table}")[0][0]
 
+def read_clickhouse_table_size_from_system(sink_config: models.SinkConfig, client) -> int:
+    """Read the number of rows of a table from the metadata in the system tables
+
+    Unlike `count()` this does not touch the table itself, which keeps polling cheap on
+    tables with many unmerged parts.
+    """
+    params = {"database": sink_config.database, "table": sink_config.table}
+    total_rows = client.execute(
+        "SELECT total_rows FROM system.tables WHERE database = %(database)s AND name = %(table)s",
+        params,
+    )
+    if total_rows and total_rows[0][0] is not None:
+        return total_rows[0][0]
+    return client.execute(
+        "SELECT sum(rows) FROM system.parts WHERE database = %(database)s AND table = %(table)s AND active",
+        params,
+    )[0][0]
+
+def read_clickhouse_row_count(sink_config: models.SinkConfig, client, count_mode: str = "system") -> int:
+    """Read the number of rows of a table, either from the system tables or with an exact count()"""
+    if count_mode == "exact":
+        return read_clickhouse_table_size(sink_config, client)
+    if count_mode == "system":
+        return read_clickhouse_table_size_from_system(sink_config, client)
+    raise ValueError(f"Invalid count mode: {count_mode}")
+
+def read_clickhouse_latency_percentiles(
+    sink_config: models.SinkConfig, client, publish_time_column: str,
+    since: float = None, until: float = None
+) -> dict:
+    """Compute end-to-end latency percentiles (in ms) of the rows in a ClickHouse table
+
+    Latency of a row is the time between its publish timestamp (epoch microseconds)
+    and the time it was inserted into the sink table. With `since` and/or `until`
+    (epoch seconds) only the rows inserted in that window are taken into account.
+    All values are None if there are no such rows.
+    """
+    levels = ", ".join(str(q) for q in LATENCY_QUANTILES.values())
+    latency_ms = f"(toUnixTimestamp64Micro({INGEST_TIME_COLUMN}) - {publish_time_column}) / 1000"
+    conditions = [f"{publish_time_column} > 0"]
+    params = {}
+    if since is not None:
+        conditions.append(f"{INGEST_TIME_COLUMN} >= fromUnixTimestamp64Micro(toInt64(%(since_us)s))")
+        params["since_us"] = int(since * 1_000_000)
+    if until is not None:
+        conditions.append(f"{INGEST_TIME_COLUMN} < fromUnixTimestamp64Micro(toInt64(%(until_us)s))")
+        params["until_us"] = int(until * 1_000_000)
+    quantiles, max_latency, n_rows = client.execute(
+        f"SELECT quantilesTDigest({levels})({latency_ms}), max({latency_ms}), count() "
+        f"FROM {sink_config.table} WHERE {' AND '.join(conditions)}",
+        params
+    )[0]
+    if n_rows == 0:
+        return {name: None for name in [*LATENCY_QUANTILES, "max"]}
+    percentiles = {
+        name: round(value, 3) for name, value in zip(LATENCY_QUANTILES, quantiles)
+    }
+    percentiles["max"] = round(max_latency, 3)
+    return percentiles
+
 def truncate_table(sink_config: models.SinkConfig, client):
     """Truncate a table in ClickHouse"""
     client.execute(f"TRUNCATE TABLE {sink_config.table}")
@@ -72,43 +178,36 @@ def get_clickhouse_table_rows(sink_config: models.SinkConfig, client, n_rows: in
     return [] 
 
 
-def cleanup_clickhouse(sink_config: models.SinkConfig):
-    """Delete all ClickHouse tables that begin with 'load_'"""
+def drop_clickhouse_table(sink_config: models.SinkConfig, table: str) -> bool:
+    """Drop a table in ClickHouse, returns whether it is gone"""
     try:
-        # Create ClickHouse client with the same configuration as used in the project
-        client = create_clickhouse_client(sink_config)
-
-        # Get all tables in the default database
-        result = client.execute("SHOW TABLES")
-        tables = [row[0] for row in result]  # Extract table names from result rows        
-        # Filter tables that begin with 'load_'
-        load_tables = [table for table in tables if table.startswith('load_')]
-        
-        if load_tables:
-            # Drop each table
-            for table in load_tables:
-                client.execute(f"DROP TABLE IF EXISTS {table}")
-                log(
-                    message=f"Cleanup: Deleted Table [italic u]{table}[/italic u]",
-                    status="Deleted",
-                    is_success=True,
-                    component="Clickhouse",
-                )
-        else:
-            log(
-                message="No tables to delete",
-                status="Skipped",
-                is_success=True,
-                component="Clickhouse",
-            )
-            
+        with clickhouse_connection(sink_config) as client:
+            client.execute(f"DROP TABLE IF EXISTS {table}")
     except Exception as e:
         log(
-            message="Error cleaning up ClickHouse tables",
+            message=f"Error deleting table {table}",
             status=str(e),
             is_failure=True,
             component="Clickhouse",
         )
-    finally:
-        if 'client' in locals():
-            client.disconnect()
\ No newline at end of file
+        return False
+    log(
+        message=f"Cleanup: Deleted Table [italic u]{table}[/italic u]",
+        status="Deleted",
+        is_success=True,
+        component="Clickhouse",
+    )
+    return True
+
+
+def cleanup_clickhouse(sink_config: models.SinkConfig, tables: List[str], max_workers: int = 4) -> bool:
+    """Drop the given ClickHouse tables, at most `max_workers` at a time
+
+    Returns:
+        bool: Whether all tables are gone
+    """
+    if not tables:
+        return True
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dropped = list(executor.map(lambda table: drop_clickhouse_table(sink_config, table), tables))
+    return all(dropped)
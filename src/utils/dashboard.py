@@ -0,0 +1,100 @@
+import time
+from typing import Optional
+from rich.console import Console
+from rich.live import Live
+from rich.panel import Panel
+from rich.table import Table
+from src.utils.metrics_channel import RateWindow
+
+console = Console(width=140)
+
+# seconds over which the current rates are computed
+RATE_WINDOW_SEC = 5
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+
+class LiveDashboard:
+    """Live view of a running variant, refreshed in place on the console
+
+    Shows the current publish and sink rates, the published, acknowledged and sunk totals,
+    the consumer lag and the time until all expected records are sunk. The publisher
+    counts are read from the `MetricsChannel` of the publishers, the sunk count from the
+    latest sample of the throughput `sampler` and the lag from the `lag_monitor`. When no
+    records were sunk for `stall_sec` while records are missing, the variant is shown as
+    stalled.
+    """
+
+    def __init__(self, variant_id: str, channel, sampler, lag_monitor, start_time: float,
+                 expected_records: Optional[int] = None, stall_sec: float = 30, refresh_per_second: float = 2):
+        self.variant_id = variant_id
+        self.channel = channel
+        self.sampler = sampler
+        self.lag_monitor = lag_monitor
+        self.start_time = start_time
+        # records expected in the sink, updated once the publishers know how many were unique
+        self.expected_records = expected_records
+        self.stall_sec = stall_sec
+        self.refresh_per_second = refresh_per_second
+        self._rates = RateWindow(RATE_WINDOW_SEC)
+        self._last_sunk = 0
+        self._last_progress = start_time
+        self._live: Optional[Live] = None
+
+    def start(self):
+        self._live = Live(self, console=console, refresh_per_second=self.refresh_per_second)
+        self._live.start()
+        return self
+
+    def stop(self):
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
+
+    def _sunk(self) -> int:
+        samples = self.sampler.samples
+        return samples[-1]["sunk"] if samples else 0
+
+    def __rich__(self) -> Panel:
+        now = time.time()
+        counts = self.channel.snapshot()
+        sunk = self._sunk()
+        publish_rps, sink_rps = self._rates.update(now, counts["published"], sunk)
+        if sunk != self._last_sunk:
+            self._last_sunk, self._last_progress = sunk, now
+
+        lag = sum(sample["lag"] for sample in self.lag_monitor.last_sample.values()) if self.lag_monitor.last_sample else None
+        remaining = self.expected_records - sunk if self.expected_records is not None else None
+        if remaining is not None and remaining <= 0:
+            eta = "done"
+        elif remaining is not None and sink_rps > 0:
+            eta = _format_duration(remaining / sink_rps)
+        else:
+            eta = "-"
+        stalled = remaining is not None and remaining > 0 and now - self._last_progress > self.stall_sec
+
+        table = Table(show_header=False, show_edge=False, box=None, padding=(0, 2))
+        table.add_column("Metric", style="cyan")
+        table.add_column("Value", style="green")
+        table.add_column("Metric", style="cyan")
+        table.add_column("Value", style="green")
+        table.add_row("Publish RPS", f"{publish_rps:,.0f}", "Published", f"{counts['published']:,}")
+        table.add_row("Sink RPS", f"{sink_rps:,.0f}", "Acknowledged", f"{counts['acknowledged']:,}")
+        table.add_row(
+            "Consumer lag", f"{lag:,}" if lag is not None else "-",
+            "Sunk", f"{sunk:,}" + (f" / {self.expected_records:,}" if self.expected_records is not None else "")
+        )
+        table.add_row("Elapsed", _format_duration(now - self.start_time), "ETA", eta)
+        if counts["errors"]:
+            table.add_row("[red]Delivery errors[/red]", f"[red]{counts['errors']:,}[/red]", "", "")
+        if stalled:
+            table.add_row("[red]Stalled[/red]", f"[red]no records sunk for {_format_duration(now - self._last_progress)}[/red]", "", "")
+        return Panel(
+            table,
+            title=f"📊 Variant {self.variant_id}",
+            border_style="red" if stalled else "blue",
+        )
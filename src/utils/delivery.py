@@ -0,0 +1,198 @@
+import csv
+import json
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# delivery latency histogram: 8 log-spaced buckets per doubling (9% wide), from 1 us to 2^30 us
+LATENCY_BUCKETS_PER_OCTAVE = 8
+LATENCY_BUCKETS = 30 * LATENCY_BUCKETS_PER_OCTAVE
+# deliveries after which the counts are added to the metrics channel
+CHANNEL_FLUSH_EVERY = 1000
+DELIVERY_FIELDS = ["latency_upper_ms", "count"]
+PARTITION_FIELDS = ["partition", "records", "bytes"]
+
+
+def bucket_upper_ms(index: int) -> float:
+    """Upper bound of a latency bucket in milliseconds"""
+    return 2 ** ((index + 1) / LATENCY_BUCKETS_PER_OCTAVE) / 1000
+
+
+class DeliveryStats:
+    """Delivery reports of the messages produced by one publisher process
+
+    `on_delivery` is the delivery callback of the producer: it counts delivered records
+    and bytes per partition, errors by name, and the produce to acknowledgement latency
+    of every record (as measured by librdkafka) in a log-spaced histogram, so that the
+    histograms of all processes can be merged by adding their buckets. `on_statistics` is
+    the statistics callback, it reads how often librdkafka retried produce requests.
+
+    With a `channel` (MetricsChannel), the acknowledged and failed records, the latency
+    histogram and the summed latency are also added to its shared counters every `CHANNEL_FLUSH_EVERY` deliveries.
+    """
+
+    def __init__(self, channel=None):
+        self.channel = channel
+        self._unflushed_acks = 0
+        self._unflushed_errors = 0
+        self.latency_buckets = [0] * LATENCY_BUCKETS
+        self.latency_sum_us = 0
+        # histogram and summed latency as last added to the channel
+        self._flushed_buckets = [0] * LATENCY_BUCKETS
+        self._flushed_sum_us = 0
+        self.delivered = 0
+        self.bytes = 0
+        self.errors: Dict[str, int] = {}
+        self.partitions: Dict[int, List[int]] = {}
+        self.retries = 0
+        # produce calls retried because the local queue of the producer was full
+        self.queue_full = 0
+        self.start_time: Optional[float] = None
+        self.last_ack_time: Optional[float] = None
+
+    def producer_config(self) -> dict:
+        """Producer settings reporting every delivery and the statistics to these stats"""
+        return {
+            "delivery.report.only.error": False,
+            "statistics.interval.ms": 1000,
+            "stats_cb": self.on_statistics,
+        }
+
+    def on_delivery(self, err, msg):
+        if err:
+            name = err.name()
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self._unflushed_errors += 1
+            # failures are rare and worth showing right away
+            self.flush_channel()
+            return
+        self.delivered += 1
+        self._unflushed_acks += 1
+        size = len(msg)
+        self.bytes += size
+        partition = self.partitions.setdefault(msg.partition(), [0, 0])
+        partition[0] += 1
+        partition[1] += size
+        latency = msg.latency()
+        if latency is not None:
+            index = int(math.log2(max(latency * 1e6, 1)) * LATENCY_BUCKETS_PER_OCTAVE)
+            self.latency_buckets[min(index, LATENCY_BUCKETS - 1)] += 1
+            self.latency_sum_us += round(latency * 1e6)
+        # delivery reports are served by poll and flush, right after the acknowledgement arrived
+        self.last_ack_time = time.time()
+        if self.channel is not None and self._unflushed_acks >= CHANNEL_FLUSH_EVERY:
+            self.flush_channel()
+
+    def flush_channel(self):
+        """Add the deliveries since the last flush to the metrics channel"""
+        if self.channel is None:
+            return
+        if self._unflushed_acks:
+            self.channel.add(self.channel.acknowledged, self._unflushed_acks)
+        if self._unflushed_errors:
+            self.channel.add(self.channel.errors, self._unflushed_errors)
+        deltas = [
+            (index, count - flushed)
+            for index, (count, flushed) in enumerate(zip(self.latency_buckets, self._flushed_buckets))
+            if count != flushed
+        ]
+        if deltas:
+            self.channel.add_latencies(deltas, self.latency_sum_us - self._flushed_sum_us)
+            self._flushed_buckets = list(self.latency_buckets)
+            self._flushed_sum_us = self.latency_sum_us
+        self._unflushed_acks = self._unflushed_errors = 0
+
+    def on_statistics(self, stats_json: str):
+        # the broker counters are totals since the producer was created
+        brokers = json.loads(stats_json).get("brokers", {}).values()
+        self.retries = sum(broker.get("txretries", 0) for broker in brokers)
+
+    def to_dict(self) -> Dict:
+        """Picklable stats, returned by the publisher processes"""
+        self.flush_channel()
+        return {
+            "latency_buckets": self.latency_buckets,
+            "delivered": self.delivered,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "partitions": self.partitions,
+            "retries": self.retries,
+            "queue_full": self.queue_full,
+            "start_time": self.start_time,
+            "last_ack_time": self.last_ack_time,
+        }
+
+
+def merge_delivery_stats(stats: List[Dict]) -> Dict:
+    """Delivery stats of all publisher processes of a variant
+
+    The publishing window runs from the earliest start of a process to the latest
+    acknowledgement of any of them, so that the ingestion rate covers the time all
+    processes together took.
+    """
+    merged = {
+        "latency_buckets": [sum(buckets) for buckets in zip(*(s["latency_buckets"] for s in stats))],
+        "delivered": sum(s["delivered"] for s in stats),
+        "bytes": sum(s["bytes"] for s in stats),
+        "errors": {},
+        "partitions": {},
+        "retries": sum(s["retries"] for s in stats),
+        "queue_full": sum(s["queue_full"] for s in stats),
+        "start_time": min((s["start_time"] for s in stats if s["start_time"]), default=None),
+        "last_ack_time": max((s["last_ack_time"] for s in stats if s["last_ack_time"]), default=None),
+    }
+    for s in stats:
+        for name, count in s["errors"].items():
+            merged["errors"][name] = merged["errors"].get(name, 0) + count
+        for partition, (records, size) in s["partitions"].items():
+            totals = merged["partitions"].setdefault(partition, [0, 0])
+            totals[0] += records
+            totals[1] += size
+    return merged
+
+
+def histogram_percentile(buckets: List[int], q: float) -> Optional[float]:
+    """Upper bound in milliseconds of the bucket holding the `q` (0 to 1) percentile"""
+    total = sum(buckets)
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        seen += count
+        if count and seen >= rank:
+            return round(bucket_upper_ms(index), 3)
+    return None
+
+
+def partition_skew(partitions: Dict[int, List[int]]) -> Optional[float]:
+    """Records of the busiest partition relative to the mean of the partitions written to"""
+    if not partitions:
+        return None
+    records = [records for records, _ in partitions.values()]
+    return round(max(records) / (sum(records) / len(records)), 3)
+
+
+def write_delivery_stats(merged: Dict, delivery_file: str = None, partitions_file: str = None):
+    """Write the merged latency histogram (non-empty buckets) and the per partition counts"""
+    if delivery_file:
+        path = Path(delivery_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=DELIVERY_FIELDS)
+            writer.writeheader()
+            writer.writerows(
+                {"latency_upper_ms": round(bucket_upper_ms(index), 3), "count": count}
+                for index, count in enumerate(merged["latency_buckets"]) if count
+            )
+    if partitions_file:
+        path = Path(partitions_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PARTITION_FIELDS)
+            writer.writeheader()
+            writer.writerows(
+                {"partition": partition, "records": records, "bytes": size}
+                for partition, (records, size) in sorted(merged["partitions"].items())
+            )
@@ -0,0 +1,210 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from src.utils.delivery import LATENCY_BUCKETS_PER_OCTAVE, bucket_upper_ms, histogram_percentile
+from src.utils.logger import log
+from src.utils.metrics import TestResultModel
+from src.utils.metrics_channel import RateWindow
+from src.utils.results_store import RESULTS_DB, ResultsStore
+
+# prefix of every exported metric
+METRIC_PREFIX = "loadtest"
+# seconds over which the live rates are computed
+RATE_WINDOW_SEC = 5
+# delivery latency quantiles exported as gauges
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(round(value, 9)) if isinstance(value, float) else str(value)
+
+
+def variant_labels(result: TestResultModel) -> Dict:
+    """Labels identifying a variant trial"""
+    return {"test_id": result.test_id, "variant_id": result.variant_id, "trial": result.trial}
+
+
+def parameter_labels(result: TestResultModel) -> Dict:
+    """Labels of the parameters of a variant, only set on the info metrics to be joined on the variant labels"""
+    return {
+        name[len("param_"):]: value
+        for name, value in result.model_dump().items() if name.startswith("param_")
+    }
+
+
+class _Exposition:
+    """Metrics in the Prometheus text format, the samples of every family are written together"""
+
+    def __init__(self):
+        self._families: Dict[str, List[str]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, labels: Dict, value, suffix: str = ""):
+        name = f"{METRIC_PREFIX}_{name}"
+        lines = self._families.get(name)
+        if lines is None:
+            lines = self._families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+    def text(self) -> str:
+        return "".join(line + "\n" for lines in self._families.values() for line in lines)
+
+
+class MetricsExporter:
+    """HTTP endpoint exposing the harness metrics in the Prometheus text format
+
+    While a variant runs, `set_variant` registers the sources of its live metrics: the
+    publish and sink rates, the published, acknowledged and sunk totals, the consumer lag
+    and the delivery latency histogram of the publishers, labelled with the variant and
+    its parameters. The summaries of the finished variants of the test are read from the
+    results database on every scrape, so the variants finished by the processes of other
+    stacks are exported too.
+    """
+
+    def __init__(self, port: int, results_dir: str, test_id: str, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.test_id = test_id
+        self.store = ResultsStore(Path(results_dir) / RESULTS_DB, TestResultModel)
+        self._live: Optional[Dict] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are not worth a console line each
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        log(
+            message=f"Metrics exposed on http://{self.host}:{self.port}/metrics",
+            status="Started",
+            is_success=True,
+            component="Exporter",
+        )
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def set_variant(self, test_result: TestResultModel, channel, sampler, lag_monitor, start_time: float):
+        """Export the live metrics of the running variant trial"""
+        self._live = {
+            "labels": variant_labels(test_result),
+            "parameters": parameter_labels(test_result),
+            "channel": channel,
+            "sampler": sampler,
+            "lag_monitor": lag_monitor,
+            "start_time": start_time,
+            "rates": RateWindow(RATE_WINDOW_SEC),
+        }
+
+    def clear_variant(self):
+        self._live = None
+
+    def render(self) -> str:
+        exposition = _Exposition()
+        live = self._live
+        if live is not None:
+            self._render_live(exposition, live)
+        try:
+            results = self.store.read(self.test_id)
+        except Exception as e:
+            results = []
+            log(
+                message="Reading the finished variants failed",
+                status=str(e),
+                is_warning=True,
+                component="Exporter",
+            )
+        for result in results:
+            self._render_result(exposition, result)
+        return exposition.text()
+
+    def _render_live(self, exposition: _Exposition, live: Dict):
+        labels = live["labels"]
+        now = time.time()
+        counts = live["channel"].snapshot()
+        samples = live["sampler"].samples
+        sunk = samples[-1]["sunk"] if samples else 0
+        publish_rps, sink_rps = live["rates"].update(now, counts["published"], sunk)
+        last_lag = live["lag_monitor"].last_sample
+
+        exposition.add("variant_info", "gauge", "Variant trial currently running, with its parameters as labels",
+                       {**labels, **live["parameters"]}, 1)
+        exposition.add("variant_elapsed_seconds", "gauge", "Seconds since the running variant started publishing",
+                       labels, round(now - live["start_time"], 3))
+        exposition.add("publish_rps", "gauge", f"Records published per second over the last {RATE_WINDOW_SEC}s, or since the previous scrape",
+                       labels, round(publish_rps, 1))
+        exposition.add("sink_rps", "gauge", f"Records sunk per second over the last {RATE_WINDOW_SEC}s, or since the previous scrape",
+                       labels, round(sink_rps, 1))
+        # the publisher counts only grow during a trial, which the variant labels identify
+        exposition.add("published_records_total", "counter", "Records produced by the publishers", labels, counts["published"])
+        exposition.add("acknowledged_records_total", "counter", "Records acknowledged by Kafka", labels, counts["acknowledged"])
+        exposition.add("delivery_errors_total", "counter", "Records Kafka failed to acknowledge", labels, counts["errors"])
+        exposition.add("sunk_records", "gauge", "Records of the variant in the ClickHouse table", labels, sunk)
+        if last_lag:
+            exposition.add("consumer_lag_records", "gauge", "Consumer lag of the pipeline over all partitions of its topics",
+                           labels, sum(sample["lag"] for sample in last_lag.values()))
+
+        buckets, sum_us = live["channel"].latency_snapshot()
+        total = sum(buckets)
+        if not total:
+            return
+        for quantile in LATENCY_QUANTILES:
+            exposition.add("delivery_latency_quantile_seconds", "gauge",
+                           "Produce to acknowledgement latency quantile (upper bound of its histogram bucket)",
+                           {**labels, "quantile": quantile}, histogram_percentile(buckets, quantile) / 1000)
+        # the cumulative histogram at every doubling of the latency, the finer buckets are summed up
+        seen = 0
+        help_text = "Produce to acknowledgement latency of the published records"
+        for index, count in enumerate(buckets):
+            seen += count
+            if (index + 1) % LATENCY_BUCKETS_PER_OCTAVE == 0:
+                exposition.add("delivery_latency_seconds", "histogram", help_text,
+                               {**labels, "le": format(bucket_upper_ms(index) / 1000, "g")}, seen, suffix="_bucket")
+        exposition.add("delivery_latency_seconds", "histogram", help_text, {**labels, "le": "+Inf"}, total, suffix="_bucket")
+        exposition.add("delivery_latency_seconds", "histogram", help_text, labels, sum_us / 1e6, suffix="_sum")
+        exposition.add("delivery_latency_seconds", "histogram", help_text, labels, total, suffix="_count")
+
+    def _render_result(self, exposition: _Exposition, result: TestResultModel):
+        labels = variant_labels(result)
+        exposition.add("result_info", "gauge", "Finished variant trial, with its parameters as labels",
+                       {**labels, **parameter_labels(result)}, 1)
+        exposition.add("result_duration_seconds", "gauge", "Duration of a finished variant trial", labels, result.duration_sec)
+        for name, value in result.model_dump().items():
+            if name.startswith("result_") and isinstance(value, (int, float)):
+                exposition.add(name, "gauge", f"{name} of a finished variant trial, see the results file", labels, value)
@@ -1,43 +1,69 @@
-import base64
-import tempfile
+import csv
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from confluent_kafka import ConsumerGroupTopicPartitions, TopicPartition
 from confluent_kafka.admin import (
     AdminClient,
     NewTopic,
     KafkaError,
-    KafkaException
+    KafkaException,
+    OffsetSpec
 )
 from glassflow_clickhouse_etl import models
 from src.utils.logger import log
+from src.utils.resources import active_resource_manager, ca_file
 
+LAG_FIELDS = ["timestamp", "elapsed_sec", "topic", "partition", "high_watermark", "committed", "lag"]
+# longest wait in seconds between two lookups of the consumer group of a pipeline, see `KafkaLagMonitor`
+MAX_GROUP_LOOKUP_INTERVAL = 30
+# seconds to wait until a stale topic is deleted and can be created again, and between two attempts
+STALE_TOPIC_TIMEOUT = 30
+STALE_TOPIC_POLL_INTERVAL = 0.5
 
-def create_kafka_admin_client(source_config: models.SourceConfig):
-    """Create a Kafka admin client"""
-    if source_config.connection_params.root_ca:
-        with tempfile.NamedTemporaryFile(delete=False, mode='w') as ca_cert_file:
-            # base64 decode the root ca
-            ca_cert_file.write(base64.b64decode(source_config.connection_params.root_ca).decode("utf-8"))
-            ca_cert_path = ca_cert_file.name
-    else:
-        ca_cert_path = None
 
+def kafka_brokers(source_config: models.SourceConfig) -> List[str]:
+    """Brokers as reached from the host running the load test"""
     if source_config.connection_params.brokers[0] == "kafka:9094":
-        brokers = ["localhost:9093"]
-    else:
-        brokers = source_config.connection_params.brokers
-    
-    return AdminClient({
-            "bootstrap.servers": ",".join(brokers),
-            "security.protocol": source_config.connection_params.protocol.value,
-            "sasl.mechanisms": source_config.connection_params.mechanism.value,
-            "sasl.username": source_config.connection_params.username,
-            "sasl.password": source_config.connection_params.password,        
-            "ssl.ca.location": ca_cert_path        
-        }
-    )
+        # the local docker setup exposes the internal listener on another port
+        return ["localhost:9093"]
+    return source_config.connection_params.brokers
+
+
+def kafka_admin_config(source_config: models.SourceConfig) -> dict:
+    """Connection settings of a Kafka admin client"""
+    return {
+        "bootstrap.servers": ",".join(kafka_brokers(source_config)),
+        "security.protocol": source_config.connection_params.protocol.value,
+        "sasl.mechanisms": source_config.connection_params.mechanism.value,
+        "sasl.username": source_config.connection_params.username,
+        "sasl.password": source_config.connection_params.password,
+        "ssl.ca.location": ca_file(source_config.connection_params.root_ca),
+    }
+
+
+def create_kafka_admin_client(source_config: models.SourceConfig):
+    """Create a Kafka admin client, shared by all callers while a resource manager is active"""
+    config = kafka_admin_config(source_config)
+    resources = active_resource_manager()
+    if resources is None:
+        return AdminClient(config)
+    return resources.shared(("kafka_admin", tuple(sorted(config.items()))), lambda: AdminClient(config))
+
+def create_topics_if_not_exists(source_config: models.SourceConfig, drop_existing: bool = False,
+                                timeout: float = STALE_TOPIC_TIMEOUT) -> List[str]:
+    """Create topics in Kafka
 
-def create_topics_if_not_exists(source_config: models.SourceConfig):
-    """Create topics in Kafka"""
+    With `drop_existing`, a topic that already exists is stale: it is deleted and created
+    again, empty. Deletion completes asynchronously on the brokers, so creating it is
+    retried for up to `timeout` seconds.
+
+    Returns:
+        List[str]: The topics that were created, without the ones that already existed
+    """
     admin_client = create_kafka_admin_client(source_config)
+    created = []
 
     # Create topic configuration
     for topic_config in source_config.topics:
@@ -53,30 +79,45 @@ def create_topics_if_not_exists(source_config: models.SourceConfig):
             config=topic_config
         )
         admin_client.poll(3)
-        
-        fs = admin_client.create_topics([topic])
-
-        for topic, f in fs.items():
+        deadline = time.time() + timeout
+        dropped = False
+        while True:
             try:
-                f.result()
+                admin_client.create_topics([topic])[topic_name].result()
+                created.append(topic_name)
                 log(
-                    message=f"Topic [italic u]{topic}[/italic u]",
-                    status="Created",
+                    message=f"Topic [italic u]{topic_name}[/italic u]",
+                    status="Recreated" if dropped else "Created",
                     is_success=True,
                     component="Kafka",
                 )
+                break
             except KafkaException as e:
-                if e.args[0].code() == KafkaError.TOPIC_ALREADY_EXISTS:
+                if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+                    raise Exception(f"❌ Failed to create topic {topic_name}: {e}")
+                if not drop_existing:
                     log(
-                        message=f"Topic [italic u]{topic}[/italic u]",
+                        message=f"Topic [italic u]{topic_name}[/italic u]",
                         status="Already exists",
                         is_success=True,
                         component="Kafka",
                     )
+                    break
+                if not dropped:
+                    log(
+                        message=f"Topic [italic u]{topic_name}[/italic u] left by an earlier run, deleting it",
+                        status="Stale",
+                        is_warning=True,
+                        component="Kafka",
+                    )
+                    admin_client.delete_topics([topic_name], operation_timeout=timeout)[topic_name].result()
+                    dropped = True
+                elif time.time() >= deadline:
+                    raise Exception(f"❌ Stale topic {topic_name} still not deleted after {timeout}s")
                 else:
-                    raise Exception(f"❌ Failed to create topic {topic}: {e}")
+                    time.sleep(STALE_TOPIC_POLL_INTERVAL)
             except Exception as e:
-                err_msg = f"❌ Failed to create topic {topic}: {e}"
+                err_msg = f"❌ Failed to create topic {topic_name}: {e}"
                 log(
                     message=err_msg,
                     status="Failed",
@@ -84,61 +125,199 @@ def create_topics_if_not_exists(source_config: models.SourceConfig):
                     component="Kafka",
                 )
                 raise Exception(err_msg)
+    return created
+
+
+def cleanup_kafka(source_config: models.SourceConfig, topics: List[str], timeout: float = 30) -> bool:
+    """Delete the given Kafka topics
 
+    All deletions are sent in one request and complete concurrently on the brokers.
+    Topics that do not exist (anymore) count as deleted.
 
-def cleanup_kafka(source_config: models.SourceConfig):
-    """Delete all Kafka topics that begin with 'load_'"""
+    Returns:
+        bool: Whether all topics are gone
+    """
+    if not topics:
+        return True
     try:
-        # Create Kafka admin client with the same configuration as used in the project
         admin_client = create_kafka_admin_client(source_config)
-
-        # Get all topics
-        metadata = admin_client.list_topics(timeout=10)
-        topics = [topic.topic for topic in metadata.topics.values()]
-        
-        # Filter topics that begin with 'load_'
-        load_topics = [topic for topic in topics if topic.startswith('load_')]
-        
-        if load_topics:
-            # Delete the filtered topics
-            fs = admin_client.delete_topics(load_topics, operation_timeout=30)
-            
-            # Wait for all operations to complete
-            for topic, future in fs.items():
-                try:
-                    future.result()  # Wait for the operation to complete
-                    log(
-                        message=f"Cleanup: Deleted Topic [italic u]{topic}[/italic u]",
-                        status="Deleted",
-                        is_success=True,
-                        component="Kafka",
-                    )
-                except KafkaError as e:
-                    log(
-                        message=f"Error deleting topic {topic}",
-                        status=str(e),
-                        is_failure=True,
-                        component="Kafka",
-                    )
-        else:
-            log(
-                message="No topics to delete",
-                status="Skipped",
-                is_success=True,
-                component="Kafka",
-            )
-            
-    except KafkaError as e:
-        log(
-            message="Error deleting topics",
-            status=str(e),
-            is_warning=True,
-            component="Kafka",
-        )
+        futures = admin_client.delete_topics(list(topics), operation_timeout=timeout, request_timeout=timeout)
     except Exception as e:
         log(
             message="Error cleaning up Kafka topics",
             status=str(e),
             is_failure=True,
             component="Kafka",
-        )
\ No newline at end of file
+        )
+        return False
+
+    all_deleted = True
+    for topic, future in futures.items():
+        try:
+            future.result()
+            log(
+                message=f"Cleanup: Deleted Topic [italic u]{topic}[/italic u]",
+                status="Deleted",
+                is_success=True,
+                component="Kafka",
+            )
+        except KafkaException as e:
+            if e.args[0].code() == KafkaError.UNKNOWN_TOPIC_OR_PART:
+                continue
+            all_deleted = False
+            log(
+                message=f"Error deleting topic {topic}",
+                status=str(e),
+                is_failure=True,
+                component="Kafka",
+            )
+    return all_deleted
+
+def read_topic_watermarks(admin_client: AdminClient, topic: str, timeout: float = 10) -> Dict[int, int]:
+    """High watermark (offset of the next appended record) of every partition of a topic"""
+    metadata = admin_client.list_topics(topic, timeout=timeout)
+    requests = {
+        TopicPartition(topic, partition): OffsetSpec.latest()
+        for partition in metadata.topics[topic].partitions
+    }
+    futures = admin_client.list_offsets(requests, request_timeout=timeout)
+    return {tp.partition: future.result().offset for tp, future in futures.items()}
+
+
+def read_committed_offsets(
+    admin_client: AdminClient, group_id: str, topic: str, partitions: List[int], timeout: float = 10
+) -> Dict[int, Optional[int]]:
+    """Committed offset of a consumer group for every partition, None where nothing was committed"""
+    request = ConsumerGroupTopicPartitions(group_id, [TopicPartition(topic, p) for p in partitions])
+    result = admin_client.list_consumer_group_offsets([request], request_timeout=timeout)[group_id].result()
+    return {tp.partition: tp.offset if tp.offset >= 0 else None for tp in result.topic_partitions}
+
+
+def find_consumer_group(
+    admin_client: AdminClient, pipeline_id: str, topic: str, partitions: List[int], timeout: float = 10
+) -> Optional[str]:
+    """Consumer group of a pipeline, None until the brokers know it
+
+    GlassFlow does not expose the group id of its Kafka consumers, but it names the group
+    after the pipeline, so it is the group whose id contains the pipeline id. When there
+    are several (e.g. one per topic of a join), only the offsets of those groups are read,
+    and the group is the one that committed offsets for the topic, None until one did.
+    """
+    groups = admin_client.list_consumer_groups(request_timeout=timeout).result().valid
+    candidates = [group.group_id for group in groups if pipeline_id in group.group_id]
+    if len(candidates) == 1:
+        return candidates[0]
+    for group_id in candidates:
+        committed = read_committed_offsets(admin_client, group_id, topic, partitions, timeout)
+        if any(offset is not None for offset in committed.values()):
+            return group_id
+    return None
+
+
+class KafkaLagMonitor:
+    """Background thread sampling the consumer lag of the pipeline on every partition of its topics
+
+    Every `interval` seconds, the committed offsets of the consumer group of every topic
+    (given as `group_id` or discovered from the `pipeline_id`, see `find_consumer_group`)
+    are compared with the high watermarks of the topic. Until the group of a topic is
+    found, its lookups back off from every sample to every `MAX_GROUP_LOOKUP_INTERVAL`
+    seconds. The per partition samples are appended to `lag_file` as they are taken, only
+    the last sample (by topic and partition) and the highest total lag over all topics are
+    kept in memory.
+    """
+
+    def __init__(
+        self,
+        source_config: models.SourceConfig,
+        start_time: float,
+        lag_file: str = None,
+        interval: float = 1.0,
+        group_id: str = None,
+        pipeline_id: str = None,
+    ):
+        self.source_config = source_config
+        self.topics = [topic.name for topic in source_config.topics]
+        self.start_time = start_time
+        self.lag_file = Path(lag_file) if lag_file else None
+        self.interval = interval
+        self.group_ids: Dict[str, Optional[str]] = {topic: group_id for topic in self.topics}
+        self.pipeline_id = pipeline_id
+        # next lookup time and lookup interval of the topics whose group is not known yet
+        self._lookups = {topic: (0.0, interval) for topic in self.topics}
+        self.max_total_lag = None
+        self.last_sample: Dict[Tuple[str, int], Dict] = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[Tuple[str, int], Dict]:
+        """Stop sampling and return the last sample, by topic and partition"""
+        self._stop_event.set()
+        self._thread.join()
+        return self.last_sample
+
+    @property
+    def final_lag(self) -> Optional[int]:
+        if not self.last_sample:
+            return None
+        return sum(sample["lag"] for sample in self.last_sample.values())
+
+    def _run(self):
+        admin_client = create_kafka_admin_client(self.source_config)
+        if self.lag_file:
+            self.lag_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lag_file, 'w', newline='') as f:
+                csv.DictWriter(f, fieldnames=LAG_FIELDS).writeheader()
+        try:
+            while True:
+                self._take_sample(admin_client)
+                if self._stop_event.wait(self.interval):
+                    break
+            # always end with a sample taken after the drain finished
+            self._take_sample(admin_client)
+        except Exception as e:
+            log(
+                message="Kafka lag monitor stopped",
+                status=str(e),
+                is_warning=True,
+                component="Kafka",
+            )
+
+    def _take_sample(self, admin_client: AdminClient):
+        sample = {}
+        for topic in self.topics:
+            watermarks = read_topic_watermarks(admin_client, topic)
+            committed = self._committed_offsets(admin_client, topic, list(watermarks))
+            now = time.time()
+            for partition, high_watermark in sorted(watermarks.items()):
+                offset = committed.get(partition)
+                sample[(topic, partition)] = {
+                    "timestamp": now,
+                    "elapsed_sec": round(now - self.start_time, 3),
+                    "topic": topic,
+                    "partition": partition,
+                    "high_watermark": high_watermark,
+                    "committed": offset if offset is not None else "",
+                    # nothing committed yet means nothing consumed yet from the freshly created topic
+                    "lag": high_watermark - (offset or 0),
+                }
+        self.last_sample = sample
+        total_lag = sum(s["lag"] for s in sample.values())
+        self.max_total_lag = total_lag if self.max_total_lag is None else max(self.max_total_lag, total_lag)
+        if self.lag_file:
+            with open(self.lag_file, 'a', newline='') as f:
+                csv.DictWriter(f, fieldnames=LAG_FIELDS).writerows(sample.values())
+
+    def _committed_offsets(self, admin_client: AdminClient, topic: str, partitions: List[int]) -> Dict[int, Optional[int]]:
+        """Committed offsets of the consumer group of a topic, looked up first if not known yet"""
+        if self.group_ids[topic] is None and self.pipeline_id is not None:
+            next_lookup, lookup_interval = self._lookups[topic]
+            if time.time() >= next_lookup:
+                self.group_ids[topic] = find_consumer_group(admin_client, self.pipeline_id, topic, partitions)
+                self._lookups[topic] = (time.time() + lookup_interval, min(lookup_interval * 2, MAX_GROUP_LOOKUP_INTERVAL))
+        if self.group_ids[topic] is None:
+            return {}
+        return read_committed_offsets(admin_client, self.group_ids[topic], topic, partitions)
@@ -1,9 +1,33 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
 from rich import print, box
 from rich.table import Table
+from rich.text import Text
 from rich.console import Console
 
 console = Console(width=140)
 
+# queue of the running LogListener, inherited by the worker processes or set with `set_log_queue`
+_log_queue = None
+
+
+def get_log_queue():
+    """Queue of the running LogListener, to be handed to worker processes"""
+    return _log_queue
+
+
+def set_log_queue(queue):
+    """Send the records logged in this process to the listener of `queue`, or render them right away if None"""
+    global _log_queue
+    _log_queue = queue
+
+
 def log(
     message: str,
     status: str = "Success",
@@ -13,15 +37,17 @@ def log(
     component: str = "GlassFlow",
     **print_kwargs,
 ):
+    """Log a message of a component
+
+    While a LogListener runs, the record is put on its queue and rendered by the listener,
+    otherwise it is rendered right away.
+    """
     if is_success and not is_failure and not is_warning:
-        status_icon = "[green]✔[/green]"
-        status_message = f"[green]{status}[/green]"
+        level = "success"
     elif is_failure and not is_success and not is_warning:
-        status_icon = "[red]✗[/red]"
-        status_message = f"[red]{status}[/red]"
+        level = "failure"
     elif is_warning and not is_success and not is_failure:
-        status_icon = "[yellow]△[/yellow]"
-        status_message = f"[yellow]{status}[/yellow]"
+        level = "warning"
     elif not any([is_success, is_failure, is_warning]):
         raise ValueError(
             "At least one of is_success, is_failure, or is_warning must be True"
@@ -30,14 +56,42 @@ def log(
         raise ValueError(
             "Only one of is_success, is_failure, or is_warning can be True"
         )
-            
+
+    record = {
+        "time": time.time(),
+        "level": level,
+        "component": component,
+        "message": message,
+        "status": status,
+        "process": multiprocessing.current_process().name,
+        "pid": os.getpid(),
+    }
+    if _log_queue is not None:
+        _log_queue.put((record, print_kwargs))
+    else:
+        render(record, **print_kwargs)
+
+
+def render(record: Dict, **print_kwargs):
+    """Print a log record as a table row"""
+    if record["level"] == "success":
+        status_icon = "[green]✔[/green]"
+        status_message = f"[green]{record['status']}[/green]"
+    elif record["level"] == "failure":
+        status_icon = "[red]✗[/red]"
+        status_message = f"[red]{record['status']}[/red]"
+    else:
+        status_icon = "[yellow]△[/yellow]"
+        status_message = f"[yellow]{record['status']}[/yellow]"
+
+    component = record["component"]
     if component == "Kafka":
         component_str = "[bold sky_blue3][Kafka][/bold sky_blue3]"
     elif component == "Clickhouse":
         component_str = "[bold yellow][Clickhouse][/bold yellow]"
     else:
         component_str = f"[bold orange_red1][{component}][/bold orange_red1]"
-    
+
     table = Table(
         show_header=False,
         show_edge=False,
@@ -49,5 +103,75 @@ def log(
     table.add_column("Component", justify="left", width=12)
     table.add_column("Message", justify="left", width=80)
     table.add_column("Status", justify="left", width=20)
-    table.add_row(status_icon, component_str, message, status_message)
-    print(table, **print_kwargs) 
\ No newline at end of file
+    table.add_row(status_icon, component_str, record["message"], status_message)
+    print(table, **print_kwargs)
+
+
+def _json_line(record: Dict) -> str:
+    """Log record as a JSON line, with the rich markup removed from the message"""
+    return json.dumps({
+        **record,
+        "time": datetime.fromtimestamp(record["time"]).isoformat(),
+        "message": Text.from_markup(record["message"]).plain,
+    }) + "\n"
+
+
+class LogListener:
+    """Thread of the parent process rendering the log records of all processes
+
+    While it runs, `log` puts its records on a queue instead of rendering them, in this
+    process and in the worker processes started after it (see `get_log_queue`). The
+    listener writes every record as a JSON line to `log_file` (if given) and renders it
+    to the console, so logging from the publishers costs a put on the queue, and the
+    output of concurrent processes does not interleave.
+    """
+
+    def __init__(self, log_file: str = None):
+        self.log_file = Path(log_file) if log_file else None
+        self._queue = None
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.log_file:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.log_file, 'a')
+        # writes straight to its pipe, unlike Queue which loses the records still buffered
+        # by its feeder thread when a pool terminates its workers
+        self._queue = multiprocessing.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        set_log_queue(self._queue)
+        return self
+
+    def stop(self):
+        """Render the records logged so far and stop"""
+        if self._thread is None:
+            return
+        set_log_queue(None)
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            record, print_kwargs = item
+            try:
+                if self._file:
+                    self._file.write(_json_line(record))
+                    self._file.flush()
+                render(record, **print_kwargs)
+            except Exception as e:
+                console.print(f"[red]Log record could not be written: {e}[/red]")
@@ -4,10 +4,23 @@ from datetime import datetime
 from typing import Optional, Dict, List
 from pydantic import BaseModel, Field
 import csv
+import fcntl
+import json
 import os
 from pathlib import Path
 from rich.table import Table
 from rich.console import Console
+from src.utils.results_store import RESULTS_DB, ResultsStore, parse_csv_row
+from src.utils.stats import trial_summary
+
+# metrics summarized over the trials of a variant
+TRIAL_SUMMARY_METRICS = [
+    "result_glassflow_rps",
+    "result_sink_rps_mean",
+    "result_avg_latency_ms",
+    "result_latency_p50_ms",
+    "result_latency_p99_ms",
+]
 
 
 class TestResultModel(BaseModel):
@@ -15,7 +28,10 @@ class TestResultModel(BaseModel):
     # Test identification
     test_id: str
     variant_id: str
+    # repetition of the variant, from 1
+    trial: int = 1
     timestamp: datetime = Field(default_factory=datetime.now)
+    glassflow_host: str = ""
         
     # Test duration
     duration_sec: float
@@ -27,127 +43,258 @@ class TestResultModel(BaseModel):
     param_deduplication_window: str
     param_max_batch_size: int
     param_max_delay_time: str
+    param_target_rps: int = 0
+    param_producer_engine: str = "glassgen"
+    param_load_profile: str = ""
+    param_soak_duration: str = ""
+    param_join_match_rate: float = 1.0
+    param_join_time_skew: str = "0s"
     
     # Test results
+    result_time_to_ready_ms: Optional[float] = None
+    result_cleanup_ms: Optional[float] = None
     result_total_generated: Optional[int] = None
     result_total_duplicates: Optional[int] = None
     result_num_records: Optional[int] = None
     result_num_processes: Optional[int] = None
     result_time_taken_publish_ms: Optional[float] = None
     result_kafka_ingestion_rps: Optional[float] = None
+    result_offered_rps: Optional[float] = None
+    result_rps_sustained: Optional[bool] = None
     result_success: Optional[bool] = None
     result_time_taken_ms: Optional[float] = None
     result_avg_latency_ms: Optional[float] = None
     result_lag_ms: Optional[float] = None
     result_glassflow_rps: Optional[float] = None
+    result_latency_p50_ms: Optional[float] = None
+    result_latency_p90_ms: Optional[float] = None
+    result_latency_p99_ms: Optional[float] = None
+    result_latency_p999_ms: Optional[float] = None
+    result_latency_max_ms: Optional[float] = None
+    result_sink_rps_peak: Optional[float] = None
+    result_sink_rps_mean: Optional[float] = None
+    result_sink_rps_steady: Optional[float] = None
+    result_profile_max_backlog: Optional[int] = None
+    result_profile_max_drain_lag_sec: Optional[float] = None
+    result_delivery_latency_p50_ms: Optional[float] = None
+    result_delivery_latency_p99_ms: Optional[float] = None
+    result_delivery_latency_max_ms: Optional[float] = None
+    result_publish_mb_per_sec: Optional[float] = None
+    result_delivery_errors: Optional[int] = None
+    result_delivery_retries: Optional[int] = None
+    result_producer_queue_full: Optional[int] = None
+    result_partition_skew: Optional[float] = None
+    result_join_expected_rows: Optional[int] = None
+    result_joined_rows: Optional[int] = None
+    result_joined_rps: Optional[float] = None
+    result_kafka_watermark_records: Optional[int] = None
+    result_kafka_max_lag: Optional[int] = None
+    result_kafka_final_lag: Optional[int] = None
+    result_soak_windows: Optional[int] = None
+    result_soak_sink_rps_min: Optional[float] = None
+    result_soak_throughput_decay_pct: Optional[float] = None
+    result_soak_latency_p99_max_ms: Optional[float] = None
+    result_publishers_cpu_sec_per_million: Optional[float] = None
+    result_publishers_cpu_max_pct: Optional[float] = None
+    result_publishers_rss_max_mb: Optional[float] = None
+    result_kafka_cpu_sec_per_million: Optional[float] = None
+    result_kafka_cpu_max_pct: Optional[float] = None
+    result_kafka_rss_max_mb: Optional[float] = None
+    result_glassflow_cpu_sec_per_million: Optional[float] = None
+    result_glassflow_cpu_max_pct: Optional[float] = None
+    result_glassflow_rss_max_mb: Optional[float] = None
+    result_clickhouse_cpu_sec_per_million: Optional[float] = None
+    result_clickhouse_cpu_max_pct: Optional[float] = None
+    result_clickhouse_rss_max_mb: Optional[float] = None
     
     def to_csv_row(self) -> dict:
-        """Convert the model to a dictionary suitable for CSV writing"""
-        return {
-            'test_id': self.test_id,
-            'variant_id': self.variant_id,
-            'timestamp': self.timestamp.isoformat(),            
-            'duration_sec': str(self.duration_sec),
-            'param_num_processes': str(self.param_num_processes),            
-            'param_total_records': str(self.param_total_records),
-            'param_duplication_rate': str(self.param_duplication_rate),
-            'param_deduplication_window': self.param_deduplication_window,
-            'param_max_batch_size': str(self.param_max_batch_size),
-            'param_max_delay_time': self.param_max_delay_time,
-            'result_total_generated': str(self.result_total_generated) if self.result_total_generated is not None else '',
-            'result_total_duplicates': str(self.result_total_duplicates) if self.result_total_duplicates is not None else '',
-            'result_num_records': str(self.result_num_records) if self.result_num_records is not None else '',
-            'result_num_processes': str(self.result_num_processes) if self.result_num_processes is not None else '',
-            'result_time_taken_publish_ms': str(self.result_time_taken_publish_ms) if self.result_time_taken_publish_ms is not None else '',
-            'result_kafka_ingestion_rps': str(self.result_kafka_ingestion_rps) if self.result_kafka_ingestion_rps is not None else '',
-            'result_success': str(self.result_success) if self.result_success is not None else '',
-            'result_time_taken_ms': str(self.result_time_taken_ms) if self.result_time_taken_ms is not None else '',
-            'result_avg_latency_ms': str(self.result_avg_latency_ms) if self.result_avg_latency_ms is not None else '',
-            'result_lag_ms': str(self.result_lag_ms) if self.result_lag_ms is not None else '',
-            'result_glassflow_rps': str(self.result_glassflow_rps) if self.result_glassflow_rps is not None else ''
-        }
+        """Convert the model to a dictionary suitable for CSV writing, unset results are empty"""
+        row = {}
+        for name in self.__class__.model_fields:
+            value = getattr(self, name)
+            if isinstance(value, datetime):
+                row[name] = value.isoformat()
+            elif value is None and name.startswith("result_"):
+                row[name] = ''
+            else:
+                row[name] = str(value)
+        return row
 
     @classmethod
-    def from_load_test_config(cls, test_id: str, variant_id: str, load_test_config: Dict) -> 'TestResultModel':
+    def from_load_test_config(cls, test_id: str, variant_id: str, load_test_config: Dict,
+                              trial: int = 1) -> 'TestResultModel':
         """Initialize a TestResultModel with parameter fields from load test config"""
         return cls(
             test_id=test_id,
             variant_id=variant_id,
+            trial=trial,
             duration_sec=0.0,  # Default to 0 until test completes
             param_num_processes=load_test_config["num_processes"],            
             param_total_records=load_test_config["total_records"],
             param_duplication_rate=load_test_config["duplication_rate"],
             param_deduplication_window=load_test_config["deduplication_window"],
             param_max_batch_size=load_test_config["max_batch_size"],
-            param_max_delay_time=load_test_config["max_delay_time"]
+            param_max_delay_time=load_test_config["max_delay_time"],
+            param_target_rps=load_test_config.get("target_rps", 0),
+            param_producer_engine=load_test_config.get("producer_engine", "glassgen"),
+            # the profile is stored as JSON, one column for any number of segments
+            param_load_profile=json.dumps(load_test_config["load_profile"]) if load_test_config.get("load_profile") else "",
+            param_soak_duration=load_test_config.get("soak_duration", ""),
+            param_join_match_rate=load_test_config.get("join_match_rate", 1.0),
+            param_join_time_skew=load_test_config.get("join_time_skew", "0s")
         )
 
 
+def summarize_trials(results: List[TestResultModel]) -> Dict:
+    """Summary of the trials of one variant, failed trials are counted but not measured"""
+    successful = [result for result in results if result.result_success]
+    summary = {
+        "test_id": results[0].test_id,
+        "variant_id": results[0].variant_id,
+        "trials": len(results),
+        "successful_trials": len(successful),
+    }
+    for metric in TRIAL_SUMMARY_METRICS:
+        values = [getattr(result, metric) for result in successful if getattr(result, metric) is not None]
+        name = metric.removeprefix("result_")
+        summary.update({f"{name}_{key}": value for key, value in trial_summary(values).items()})
+    return summary
+
+
 class TestResultsHandler:
-    """Class for handling CSV operations for test results"""
+    """Class for storing and reading test results
+
+    Results are stored in the results database next to the CSV file (see `ResultsStore`),
+    which holds the results of all test IDs. The CSV file of the test is kept up to date as
+    an export. Results of a CSV file written before the database existed are imported the
+    first time the test is opened.
+    """
     
-    def __init__(self, results_file: Path):  
+    def __init__(self, results_file: Path, test_id: str = None):  
         print(f"Results file: {results_file}")
         self.results_file = Path(results_file)
+        self.test_id = test_id or self.results_file.name.removesuffix("_results.csv")
         self._ensure_directory()
+        self.store = ResultsStore(self.results_file.parent / RESULTS_DB, TestResultModel)
+        if self.results_file.exists() and self.store.count(self.test_id) == 0:
+            self._import_csv()
 
     def _ensure_directory(self):
         """Ensure the directory for the CSV file exists"""
         self.results_file.parent.mkdir(parents=True, exist_ok=True)
 
+    def _import_csv(self):
+        """Import the results of the CSV file into the database"""
+        with open(self.results_file, 'r', newline='') as f:
+            results = [parse_csv_row(TestResultModel, row) for row in csv.DictReader(f)]
+        results = [result for result in results if result is not None and result.test_id == self.test_id]
+        self.store.write(results)
+        print(f"Imported {len(results)} results from {self.results_file}")
+
     def write_result(self, result: TestResultModel):
-        """Write a single test result to the CSV file"""
-        file_exists = self.results_file.exists()
+        """Write a single test result to the database and to the CSV file
+
+        The CSV file is locked while writing, so that variants running concurrently on several
+        stacks can share it. The CSV file is rewritten from the database when the trial
+        already had a result, or when it has the columns of an older version, instead of
+        appending a duplicate or misaligned row.
+        """
         print(f"Writing result to {self.results_file}")
-        with open(self.results_file, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=TestResultModel.model_fields.keys())
-            if not file_exists:
+        replaced = self.store.has_result(result.test_id, result.variant_id, result.trial)
+        self.store.write([result])
+        fieldnames = list(TestResultModel.model_fields.keys())
+        with open(self.results_file, 'a+', newline='') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # checked under the lock, another process may have just created the file
+                f.seek(0)
+                header = next(csv.reader([f.readline()]), [])
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                if header == fieldnames and not replaced:
+                    f.seek(0, os.SEEK_END)
+                    writer.writerow(result.to_csv_row())
+                else:
+                    f.seek(0)
+                    f.truncate()
+                    writer.writeheader()
+                    writer.writerows(self.store.export_csv_rows(self.test_id))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def has_result(self, variant_id: str, trial: int = 1) -> bool:
+        """Whether the trial of the variant already has a result"""
+        return self.store.has_result(self.test_id, variant_id, trial)
+
+    def get_result(self, variant_id: str, trial: int = 1) -> Optional[TestResultModel]:
+        """Result of a trial of a variant, None if it has none"""
+        return self.store.read_variant(self.test_id, variant_id, trial)
+
+    @property
+    def summary_file(self) -> Path:
+        return self.results_file.with_name(f"{self.test_id}_summary.csv")
+
+    def write_trial_summary(self, variant_id: str) -> Dict:
+        """Summarize the trials of a variant and rewrite the summary file of the test
+
+        The summary file has a row per variant with the mean, standard deviation, range and
+        95% confidence interval of the throughput and latency over its successful trials.
+        It is rebuilt from the database, so it includes variants run by other processes.
+        """
+        variant_ids = dict.fromkeys(row["variant_id"] for row in self.store.query(["variant_id"], [self.test_id]))
+        summaries = [summarize_trials(self.store.read_trials(self.test_id, v)) for v in variant_ids]
+        with open(self.summary_file, 'a+', newline='') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                f.truncate()
+                writer = csv.DictWriter(f, fieldnames=list(summaries[0]))
                 writer.writeheader()
-            writer.writerow(result.to_csv_row())
+                writer.writerows(summaries)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return next(summary for summary in summaries if summary["variant_id"] == variant_id)
 
     def get_completed_tests(self) -> List[Dict]:
-        """Read completed tests from the CSV file"""
-        completed_tests = []
-        if self.results_file.exists():
-            with open(self.results_file, 'r') as f:
-                reader = csv.DictReader(f)
-                completed_tests = list(reader)
-        return completed_tests
+        """Read completed tests from the database"""
+        return self.store.export_csv_rows(self.test_id)
 
     def read_validated_results(self) -> List[Dict]:
         """
-        Reads the CSV file, validates each row using TestResultModel,
-        and returns a list of validated JSON objects.
+        Reads the results of the test from the database, validated with TestResultModel.
         
         Returns:
             List[Dict]: List of validated test results as JSON objects
             
         Raises:
-            FileNotFoundError: If the results file doesn't exist
-            ValueError: If any row fails validation
+            FileNotFoundError: If the test has no results
         """
-        if not self.results_file.exists():
+        results = self.store.read(self.test_id)
+        if not results:
             raise FileNotFoundError(f"Results file not found: {self.results_file}")
+        return [result.model_dump() for result in results]
 
-        with open(self.results_file, 'r') as f:
-            reader = csv.DictReader(f)
-            data = list(reader)
-        expected_fields = set(TestResultModel.model_fields.keys())
-        parsed_rows = []
-        for i, row in enumerate(data):
-            try:
-                actual_fields = set(row.keys())
-                # Step 1: Strict field match check
-                if actual_fields != expected_fields:
-                    print(f"Row {i} skipped due to mismatched fields: {actual_fields ^ expected_fields}")
-                    continue
-
-                # Pydantic handles type conversion
-                parsed = TestResultModel(**row)
-                parsed_rows.append(parsed.model_dump())
-            except Exception as e:
-                print(f"Failed to parse row {row}: {e}")
-        return parsed_rows
+    def display_trial_summary(self, summary: Dict):
+        """Display the summary of the trials of a variant in a table"""
+        console = Console(width=140)
+        table = Table(
+            title=f"Trials of {summary['variant_id']}: {summary['successful_trials']}/{summary['trials']} successful",
+            show_header=True, header_style="bold magenta"
+        )
+        table.add_column("Metric", style="cyan")
+        for column in ["Mean", "Stddev", "Min", "Max", "95% CI"]:
+            table.add_column(column, style="green")
+        for metric in TRIAL_SUMMARY_METRICS:
+            name = metric.removeprefix("result_")
+            low, high = summary[f"{name}_ci95_low"], summary[f"{name}_ci95_high"]
+            table.add_row(
+                name,
+                *(str(summary[f"{name}_{key}"]) if summary[f"{name}_{key}"] is not None else "-"
+                  for key in ("mean", "stddev", "min", "max")),
+                f"[{low}, {high}]" if low is not None else "-",
+            )
+        console.print(table)
 
     def display_results(self, test_result: TestResultModel):
         """Display test results in a formatted table"""
@@ -158,9 +305,87 @@ class TestResultsHandler:
 
         table.add_row("Status", "✅ Success" if test_result.result_success else "❌ Failed")
         table.add_row("Duration", f"{round(test_result.duration_sec, 2)} seconds")
-        table.add_row("Records Processed", str(test_result.result_num_records))
-        table.add_row("Source RPS in Kafka", str(test_result.result_kafka_ingestion_rps))
-        table.add_row("Average Latency", f"{round(test_result.result_avg_latency_ms, 4)} ms")
-        table.add_row("Lag", f"{round(test_result.result_lag_ms, 2)} ms")            
-        table.add_row("GlassFlow RPS", f"{round(test_result.result_glassflow_rps, 2)} records/s")
+        if test_result.result_time_to_ready_ms is not None:
+            table.add_row("Pipeline Time to Ready", f"{round(test_result.result_time_to_ready_ms / 1000, 2)} s")
+        if test_result.result_cleanup_ms is not None:
+            table.add_row("Cleanup Time", f"{round(test_result.result_cleanup_ms / 1000, 2)} s")
+        if test_result.result_num_records is not None:
+            table.add_row("Records Processed", str(test_result.result_num_records))
+        if test_result.result_kafka_ingestion_rps is not None:
+            table.add_row("Source RPS in Kafka", str(test_result.result_kafka_ingestion_rps))
+        if test_result.result_offered_rps is not None:
+            table.add_row(
+                "Offered RPS",
+                f"{test_result.result_offered_rps} ({'sustained' if test_result.result_rps_sustained else 'not sustained'})"
+            )
+        # unset when the variant failed before its records were sunk
+        if test_result.result_avg_latency_ms is not None:
+            table.add_row("Average Latency", f"{round(test_result.result_avg_latency_ms, 4)} ms")
+        if test_result.result_lag_ms is not None:
+            table.add_row("Lag", f"{round(test_result.result_lag_ms, 2)} ms")
+        if test_result.result_glassflow_rps is not None:
+            table.add_row("GlassFlow RPS", f"{round(test_result.result_glassflow_rps, 2)} records/s")
+        if test_result.result_sink_rps_steady is not None:
+            table.add_row(
+                "Sink RPS peak / mean / steady",
+                f"{test_result.result_sink_rps_peak} / {test_result.result_sink_rps_mean} / "
+                f"{test_result.result_sink_rps_steady} records/s"
+            )
+        if test_result.result_delivery_latency_p99_ms is not None:
+            table.add_row(
+                "Delivery latency p50 / p99 / max",
+                f"{test_result.result_delivery_latency_p50_ms} / {test_result.result_delivery_latency_p99_ms} / "
+                f"{test_result.result_delivery_latency_max_ms} ms"
+            )
+        if test_result.result_publish_mb_per_sec is not None:
+            table.add_row(
+                "Published MB/s / errors / retries / queue full / partition skew",
+                f"{test_result.result_publish_mb_per_sec} / {test_result.result_delivery_errors} / "
+                f"{test_result.result_delivery_retries} / {test_result.result_producer_queue_full} / "
+                f"{test_result.result_partition_skew}"
+            )
+        if test_result.result_join_expected_rows is not None:
+            table.add_row(
+                "Joined rows / expected / joined-row RPS",
+                f"{test_result.result_joined_rows} / {test_result.result_join_expected_rows} / "
+                f"{test_result.result_joined_rps} rows/s"
+            )
+        if test_result.result_kafka_watermark_records is not None:
+            table.add_row(
+                "Records in Kafka (watermarks)",
+                f"{test_result.result_kafka_watermark_records}"
+                + (" (mismatch)" if test_result.result_kafka_watermark_records != test_result.result_num_records else "")
+            )
+        if test_result.result_kafka_max_lag is not None:
+            table.add_row(
+                "Consumer lag max / final",
+                f"{test_result.result_kafka_max_lag} / {test_result.result_kafka_final_lag} records"
+            )
+        if test_result.result_profile_max_backlog is not None:
+            table.add_row(
+                "Load profile max backlog / drain lag",
+                f"{test_result.result_profile_max_backlog} records / {test_result.result_profile_max_drain_lag_sec} s"
+            )
+        if test_result.result_soak_windows is not None:
+            table.add_row(
+                "Soak windows / min sink RPS / throughput decay / max p99",
+                f"{test_result.result_soak_windows} / {test_result.result_soak_sink_rps_min} records/s / "
+                f"{test_result.result_soak_throughput_decay_pct}% / {test_result.result_soak_latency_p99_max_ms} ms"
+            )
+        components = {"publishers": "Publishers", "kafka": "Kafka", "glassflow": "GlassFlow", "clickhouse": "ClickHouse"}
+        for component, name in components.items():
+            if getattr(test_result, f"result_{component}_cpu_sec_per_million") is not None:
+                table.add_row(
+                    f"{name} CPU s per 1M records / max CPU / max RSS",
+                    f"{getattr(test_result, f'result_{component}_cpu_sec_per_million')} s / "
+                    f"{getattr(test_result, f'result_{component}_cpu_max_pct')}% / "
+                    f"{getattr(test_result, f'result_{component}_rss_max_mb')} MB"
+                )
+        if test_result.result_latency_p99_ms is not None:
+            table.add_row(
+                "Latency p50 / p90 / p99 / p99.9 / max",
+                f"{test_result.result_latency_p50_ms} / {test_result.result_latency_p90_ms} / "
+                f"{test_result.result_latency_p99_ms} / {test_result.result_latency_p999_ms} / "
+                f"{test_result.result_latency_max_ms} ms"
+            )
         console.print(table)
\ No newline at end of file
@@ -0,0 +1,63 @@
+import multiprocessing
+from collections import deque
+from typing import List, Tuple
+from src.utils.delivery import LATENCY_BUCKETS
+
+
+class MetricsChannel:
+    """Counters shared by the publisher processes of a variant with the parent process
+
+    `published` counts produced records, `acknowledged` and `errors` the delivery reports
+    received for them, and `latency_buckets` and `latency_sum_us` their delivery latency
+    histogram and summed latency (see `DeliveryStats`). The counters are shared memory, the parent reads them while the
+    publishers run. Publishers add to them per bulk, not per record.
+    """
+
+    def __init__(self):
+        self.published = multiprocessing.Value("q", 0)
+        self.acknowledged = multiprocessing.Value("q", 0)
+        self.errors = multiprocessing.Value("q", 0)
+        self.latency_buckets = multiprocessing.Array("q", LATENCY_BUCKETS)
+        # guarded by the lock of `latency_buckets`
+        self.latency_sum_us = multiprocessing.Value("q", 0, lock=False)
+
+    @staticmethod
+    def add(counter, n: int):
+        with counter.get_lock():
+            counter.value += n
+
+    def add_latencies(self, deltas: List[Tuple[int, int]], sum_us: int = 0):
+        """Add (bucket index, count) pairs and their summed latency to the latency histogram"""
+        with self.latency_buckets.get_lock():
+            for index, count in deltas:
+                self.latency_buckets[index] += count
+            self.latency_sum_us.value += sum_us
+
+    def snapshot(self) -> dict:
+        return {
+            "published": self.published.value,
+            "acknowledged": self.acknowledged.value,
+            "errors": self.errors.value,
+        }
+
+    def latency_snapshot(self) -> Tuple[List[int], int]:
+        """Latency histogram and summed latency in microseconds, consistent with each other"""
+        with self.latency_buckets.get_lock():
+            return list(self.latency_buckets), self.latency_sum_us.value
+
+
+class RateWindow:
+    """Rates of growing counts over the last `window_sec` seconds, from the counts seen at every update"""
+
+    def __init__(self, window_sec: float = 5):
+        self.window_sec = window_sec
+        self._points = deque()
+
+    def update(self, now: float, *counts) -> List[float]:
+        self._points.append((now, counts))
+        while len(self._points) > 2 and now - self._points[1][0] >= self.window_sec:
+            self._points.popleft()
+        first_time, first_counts = self._points[0]
+        if now - first_time <= 0:
+            return [0.0] * len(counts)
+        return [(count - first) / (now - first_time) for count, first in zip(counts, first_counts)]
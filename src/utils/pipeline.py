@@ -4,6 +4,7 @@ import time
 from glassflow_clickhouse_etl import errors, models, Pipeline
 from rich.console import Console
 from src.utils.logger import log
+from src.utils.readiness import wait_until_running, wait_for_canary
 
 console = Console(width=140)
 
@@ -18,6 +19,10 @@ class GlassFlowPipeline:
         """
         self.host = host
         self.pipeline = None
+        # durations of the last `create_pipeline`, from the start of the create request
+        self.create_request_ms = None
+        self.time_to_running_ms = None
+        self.time_to_ready_ms = None
 
     @staticmethod
     def load_conf(config_json: dict) -> models.PipelineConfig:
@@ -70,26 +75,51 @@ class GlassFlowPipeline:
         """Delete a pipeline"""
         Pipeline(url=self.host).delete()
 
-    def create_pipeline(self, config: models.PipelineConfig) -> Pipeline:
+    def wait_until_deleted(self, timeout: float = 120):
+        """Poll the pipeline status until no pipeline is running anymore"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                Pipeline(url=self.host).get_running_pipeline()
+            except errors.PipelineNotFoundError:
+                return
+            time.sleep(0.2)
+        raise TimeoutError(f"Pipeline still running {timeout}s after deleting it")
+
+    def create_pipeline(self, config: models.PipelineConfig, generator_schema: str = None,
+                        readiness_timeout: float = 300) -> Pipeline:
         """
-        Create GlassFlow pipeline
+        Create GlassFlow pipeline and wait until it is ready
+
+        The pipeline is ready once its status shows it running and, if a `generator_schema`
+        is given, a canary event of that schema made it from the source topic into the sink
+        table (see `wait_for_canary`). Join pipelines are only checked for their status.
 
         Args:
             config (models.PipelineConfig): Pipeline configuration
+            generator_schema (str, optional): Path to the generator schema of the canary event
+            readiness_timeout (float, optional): Seconds to wait for the pipeline to be ready. Defaults to 300.
 
         Returns:
             Pipeline: GlassFlow pipeline
         """
         self.pipeline = Pipeline(config, url=self.host)
         try:
+            start_time = time.time()
             self.pipeline.create()
+            self.create_request_ms = round((time.time() - start_time) * 1000)
             with console.status(
-                "[bold green]Waiting for pipeline to start...[/bold green]",
+                "[bold green]Waiting for pipeline to be ready...[/bold green]",
                 spinner="dots",
             ):
-                time.sleep(10)
+                wait_until_running(self.host, config.pipeline_id, readiness_timeout)
+                self.time_to_running_ms = round((time.time() - start_time) * 1000)
+                if generator_schema and not config.join.enabled:
+                    wait_for_canary(config, generator_schema, readiness_timeout - self.time_to_running_ms / 1000)
+            self.time_to_ready_ms = round((time.time() - start_time) * 1000)
             log(
-                message=f"Pipeline [italic u]{config.pipeline_id}[/italic u]",
+                message=f"Pipeline [italic u]{config.pipeline_id}[/italic u] running after "
+                        f"{round(self.time_to_running_ms / 1000, 2)}s, ready after {round(self.time_to_ready_ms / 1000, 2)}s",
                 status="Created",
                 is_success=True,
                 component="GlassFlow",
@@ -1,75 +1,339 @@
 from glassflow_clickhouse_etl import Pipeline
 from src.generate_events import generate_events_with_duplicates
+from src.native_events import generate_events_native
+from src.dataset_cache import replay_events
+from src.join_events import JOIN_SIDES, generate_join_events, join_sides
+from src.load_profile import LoadSchedule, parse_duration, variant_total_records
+import json
 import multiprocessing
+import random
+import sys
+import time
 from typing import List, Dict
-from src.utils.logger import log
+from src.utils.logger import get_log_queue, log, set_log_queue
+from src.utils.delivery import DeliveryStats, histogram_percentile, merge_delivery_stats, partition_skew
 
+# functions generating and publishing the events, by producer engine. The "replay"
+# engine publishes events of a pre-generated dataset instead, see `src/dataset_cache.py`
+PRODUCER_ENGINES = {
+    "glassgen": generate_events_with_duplicates,
+    "native": generate_events_native,
+}
 
-def publish_events(pipeline: Pipeline, generator_schema, num_records, variant_config):    
-    gen_stats = generate_events_with_duplicates(
+# share of the target RPS a variant has to reach to count as sustained
+SUSTAINED_RPS_RATIO = 0.95
+
+# seconds the publisher processes wait for each other before they start publishing
+START_BARRIER_TIMEOUT_SEC = 120
+
+# state shared with the parent process, set by the pool initializer
+_metrics_channel = None
+_published_counter = None
+_rate_limiter = None
+# rate limiters of the two sides of a join, by orientation
+_join_rate_limiters = None
+_start_barrier = None
+
+
+class SharedRateLimiter:
+    """Token bucket shared by all publisher processes of a variant
+
+    The bucket is kept as the time at which the next token becomes available, stored in
+    shared memory so that the aggregate rate of all processes stays at `rate`. Publishers
+    that fall behind may catch up with a burst of at most `burst_sec` worth of tokens.
+
+    With a `schedule` (LoadSchedule) the rate follows the load profile instead, starting
+    when the first tokens are acquired by any process.
+    """
+
+    def __init__(self, rate: float = 0, burst_sec: float = 0.1, schedule: LoadSchedule = None):
+        self.rate = rate
+        self.burst_sec = burst_sec
+        self.schedule = schedule
+        self._next_token_time = multiprocessing.Value("d", 0.0)
+        # guarded by the lock of `_next_token_time`
+        self._start_time = multiprocessing.Value("d", 0.0, lock=False)
+
+    @property
+    def start_time(self):
+        """Time the first tokens were acquired, None before that"""
+        return self._start_time.value or None
+
+    def acquire(self, tokens: int = 1):
+        """Block until `tokens` tokens are available"""
+        with self._next_token_time.get_lock():
+            now = time.time()
+            if not self._start_time.value:
+                self._start_time.value = now
+            available_at = max(self._next_token_time.value, now - self.burst_sec)
+            if self.schedule is None:
+                self._next_token_time.value = available_at + tokens / self.rate
+            else:
+                start = self._start_time.value
+                self._next_token_time.value = start + self.schedule.time_after(available_at - start, tokens)
+        wait = available_at - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _init_worker(metrics_channel, rate_limiter, start_barrier, log_queue, join_rate_limiters=None):
+    """Initializer of the publisher processes"""
+    set_log_queue(log_queue)
+    global _metrics_channel, _published_counter, _rate_limiter, _join_rate_limiters, _start_barrier
+    _metrics_channel = metrics_channel
+    _published_counter = metrics_channel.published if metrics_channel is not None else None
+    _rate_limiter = rate_limiter
+    _join_rate_limiters = join_rate_limiters
+    _start_barrier = start_barrier
+
+
+def publish_events(pipeline: Pipeline, generator_schema, num_records, variant_config, dataset_slice=None, deadline=None,
+                   delivery_stats=None, join_task=None):
+    if join_task is not None:
+        orientation = join_task["orientation"]
+        return generate_join_events(
+            source_config=pipeline.config.source,
+            generator_schema=join_task["schema"],
+            side=join_task["side"],
+            orientation=orientation,
+            start=join_task["start"],
+            num_records=num_records,
+            match_rate=join_task["match_rate"],
+            key_tag=join_task["key_tag"],
+            bulk_size=variant_config["max_batch_size"],
+            published_counter=_published_counter,
+            rate_limiter=_join_rate_limiters[orientation] if _join_rate_limiters else None,
+            delivery_stats=delivery_stats,
+        )
+    if dataset_slice is not None:
+        dataset_path, start = dataset_slice
+        return replay_events(
+            source_config=pipeline.config.source,
+            dataset_path=dataset_path,
+            start=start,
+            num_records=num_records,
+            bulk_size=variant_config["max_batch_size"],
+            published_counter=_published_counter,
+            rate_limiter=_rate_limiter,
+            delivery_stats=delivery_stats,
+        )
+    generate_events = PRODUCER_ENGINES[variant_config.get("producer_engine", "glassgen")]
+    gen_stats = generate_events(
         source_config=pipeline.config.source,
         duplication_rate=variant_config["duplication_rate"],
-        num_records=num_records,        
-        rps=20000,
+        num_records=num_records,
+        # the rate is controlled by the shared rate limiter, not per process by glassgen
+        rps=0,
         bulk_size=variant_config["max_batch_size"],
         generator_schema=generator_schema,
+        published_counter=_published_counter,
+        rate_limiter=_rate_limiter,
+        deadline=deadline,
+        delivery_stats=delivery_stats,
     )
     return gen_stats
 
 def publish_events_worker(args):
-    """Worker function that will be run in a separate process"""
-    pipeline_config, generator_schema, num_records, variant_config, process_id = args
+    """Worker function that will be run in a separate process
+
+    The processes wait for each other at the start barrier, so that none of them publishes
+    while the others are still starting up. The processes of the delayed side of a join
+    wait for the time skew after that.
+    """
+    pipeline_config, generator_schema, num_records, variant_config, process_id, dataset_slice, deadline, join_task = args
     # Create a new pipeline instance for this process
     pipeline = Pipeline(config=pipeline_config)
+    delivery_stats = DeliveryStats(_metrics_channel)
+    _start_barrier.wait(START_BARRIER_TIMEOUT_SEC)
+    delivery_stats.start_time = time.time()
+    if join_task is not None and join_task["delay_sec"] > 0:
+        time.sleep(join_task["delay_sec"])
     log(
         message=f"Process {process_id} started publishing events",
         status="Started",
         is_success=True,
         component="GlassGen"
     )
-    stats = publish_events(pipeline, generator_schema, num_records, variant_config)
+    stats = publish_events(pipeline, generator_schema, num_records, variant_config, dataset_slice, deadline, delivery_stats,
+                           join_task)
     log(
         message=f"Process {process_id} finished publishing events",
         status="Finished",
         is_success=True,
         component="GlassGen"
     )
-    return stats
+    return {**stats, "delivery": delivery_stats.to_dict()}
 
-def publish_to_kafka(pipeline: Pipeline, generator_schema: str, variant_config: Dict) -> List[Dict]:
-    """Run multiple publish_events processes in parallel"""
-    # Prepare arguments for each process
+def _join_process_args(pipeline: Pipeline, generator_schema: str, variant_config: Dict, total_records: int):
+    """Tasks of the publisher processes of a join pipeline, and the rate limiters of its sides
+
+    Both sides publish `total_records` events with `num_processes` processes each. The
+    pairs are split between the processes of a side in the same way, every pair has one
+    event on each side and `join_match_rate` of the pairs share their join key. The side
+    delayed by `join_time_skew` (the right one if positive, the left one if negative)
+    starts publishing that much later. With a `target_rps`, each side publishes at half
+    of it.
+    """
     num_processes = variant_config["num_processes"]
-    total_records = variant_config["total_records"]
-    
-    # Calculate base records per process and remainder
+    schemas = json.load(open(generator_schema))
+    if not all(side in schemas for side in JOIN_SIDES):
+        raise ValueError(f"The generator schema of a join pipeline needs a {' and a '.join(JOIN_SIDES)} schema")
+    sides = join_sides(pipeline.config)
+    skew_sec = parse_duration(variant_config.get("join_time_skew", "0s"))
+    match_rate = variant_config.get("join_match_rate", 1.0)
+    # keeps the string join keys of the variant apart from those of earlier runs
+    key_tag = random.getrandbits(32)
+    target_rps = variant_config.get("target_rps", 0)
+    rate_limiters = {side: SharedRateLimiter(target_rps / 2) for side in JOIN_SIDES} if target_rps > 0 else None
+
     base_records = total_records // num_processes
     remainder = total_records % num_processes
-    
-    # Create process arguments with adjusted record counts
     process_args = []
-    for i in range(num_processes):        
-        # Give all remainder records to the first process
-        num_records = base_records + (remainder if i == 0 else 0)
-        process_args.append((pipeline.config, generator_schema, num_records, variant_config, i))
+    for orientation in JOIN_SIDES:
+        delay_sec = max(skew_sec, 0) if orientation == "right" else max(-skew_sec, 0)
+        start = 0
+        for i in range(num_processes):
+            num_records = base_records + (remainder if i == 0 else 0)
+            join_task = {
+                "orientation": orientation,
+                "side": sides[orientation],
+                "schema": schemas[orientation],
+                "start": start,
+                "match_rate": match_rate,
+                "key_tag": key_tag,
+                "delay_sec": delay_sec,
+            }
+            process_args.append((pipeline.config, generator_schema, num_records, variant_config,
+                                 f"{orientation}-{i}", None, None, join_task))
+            start += num_records
+    return process_args, rate_limiters
+
+def publish_to_kafka(pipeline: Pipeline, generator_schema: str, variant_config: Dict, metrics_channel=None, dataset=None) -> List[Dict]:
+    """Run multiple publish_events processes in parallel
+
+    If a `metrics_channel` (MetricsChannel) is given, the workers add every published bulk
+    and their delivery reports to it so that progress can be followed while publishing.
+
+    If the variant has a `target_rps`, all processes share one rate limiter that keeps
+    the aggregate offered load at that rate. With a `load_profile` the shared limiter
+    follows the profile instead, and the variant publishes as many records as the
+    profile offers. Otherwise every process publishes as fast as it can.
+
+    If a pre-generated `dataset` (EventDataset) is given, every process replays its own
+    disjoint slice of it instead of generating events.
+
+    With a `soak_duration`, the processes publish continuously until the duration has
+    passed instead of stopping after `total_records`.
+
+    The processes start publishing together and record their delivery reports (see
+    `DeliveryStats`). The Kafka ingestion RPS covers the window from their common start to
+    the last acknowledged record of any of them; the merged stats are returned as `delivery`.
+
+    For join pipelines, `generator_schema` holds a schema per side, see
+    `_join_process_args`. The records expected in the sink are returned as
+    `sink_records_expected`: the unique records generated, or the matched pairs of a join.
+    """
+    # Prepare arguments for each process
+    num_processes = variant_config["num_processes"]
+    deadline = None
+    if variant_config.get("soak_duration"):
+        deadline = time.time() + parse_duration(variant_config["soak_duration"])
+        # no record limit, every process stops at the deadline
+        total_records = sys.maxsize // num_processes * num_processes
+    else:
+        total_records = variant_total_records(variant_config)
+    target_rps = variant_config.get("target_rps", 0)
+    schedule = None
+    if variant_config.get("load_profile"):
+        schedule = LoadSchedule(variant_config["load_profile"])
+        # the offered load is averaged over the profile
+        target_rps = round(total_records / schedule.duration)
+        rate_limiter = SharedRateLimiter(schedule=schedule)
+    elif target_rps > 0:
+        rate_limiter = SharedRateLimiter(target_rps)
+    else:
+        rate_limiter = None
     
+    join_rate_limiters = None
+    if pipeline.config.join.enabled:
+        process_args, join_rate_limiters = _join_process_args(pipeline, generator_schema, variant_config, total_records)
+        rate_limiter = None
+    else:
+        # Calculate base records per process and remainder
+        base_records = total_records // num_processes
+        remainder = total_records % num_processes
+
+        # Create process arguments with adjusted record counts
+        process_args = []
+        start = 0
+        for i in range(num_processes):
+            # Give all remainder records to the first process
+            num_records = base_records + (remainder if i == 0 else 0)
+            dataset_slice = (str(dataset.path), start) if dataset is not None else None
+            process_args.append((pipeline.config, generator_schema, num_records, variant_config, i, dataset_slice, deadline, None))
+            start += num_records
+    
+    # every process takes one task and waits at the barrier until all of them did
+    start_barrier = multiprocessing.Barrier(len(process_args))
     # Create a pool of workers
-    with multiprocessing.Pool(processes=num_processes) as pool:
+    with multiprocessing.Pool(processes=len(process_args), initializer=_init_worker,
+                              initargs=(metrics_channel, rate_limiter, start_barrier, get_log_queue(),
+                                        join_rate_limiters)) as pool:
         # Map the work across the processes
-        results = pool.map(publish_events_worker, process_args)
+        results = pool.map(publish_events_worker, process_args, chunksize=1)
 
+    delivery = merge_delivery_stats([stats["delivery"] for stats in results])
     num_records = sum(stats["num_records"] for stats in results)
-    time_taken_publish_ms = max(stats["time_taken_ms"] for stats in results)
+    if delivery["start_time"] and delivery["last_ack_time"]:
+        time_taken_publish_ms = max(1, round((delivery["last_ack_time"] - delivery["start_time"]) * 1000))
+    else:
+        time_taken_publish_ms = max(stats["time_taken_ms"] for stats in results)
     total_generated = sum(stats["total_generated"] for stats in results)
+    if pipeline.config.join.enabled:
+        sink_records_expected = sum(stats["matched_pairs"] for stats in results)
+    else:
+        sink_records_expected = total_generated
     total_duplicates = sum(stats["total_duplicates"] for stats in results)
     kafka_ingestion_rps = round(num_records * 1000 / time_taken_publish_ms)
+    offered_rps = target_rps if target_rps > 0 else None
+    rps_sustained = kafka_ingestion_rps >= SUSTAINED_RPS_RATIO * target_rps if offered_rps else None
+    if rps_sustained is False:
+        log(
+            message=f"Publishers could not sustain the target of {target_rps} records/s, achieved {kafka_ingestion_rps} records/s",
+            status="Not sustained",
+            is_warning=True,
+            component="GlassGen"
+        )
     
+    delivery_errors = sum(delivery["errors"].values())
+    if delivery_errors:
+        log(
+            message=f"{delivery_errors} records were not delivered: "
+                    + ", ".join(f"{name} {count}" for name, count in delivery["errors"].items()),
+            status="Failed",
+            is_warning=True,
+            component="Kafka"
+        )
+
     publish_stats = {
         "total_generated": total_generated,
         "total_duplicates": total_duplicates,
+        "sink_records_expected": sink_records_expected,
         "num_records": num_records,
         "time_taken_publish_ms": time_taken_publish_ms,
-        "kafka_ingestion_rps": kafka_ingestion_rps
+        "kafka_ingestion_rps": kafka_ingestion_rps,
+        "offered_rps": offered_rps,
+        "rps_sustained": rps_sustained,
+        "profile_start_time": rate_limiter.start_time if schedule is not None else None,
+        "delivery": delivery,
+        "delivery_latency_p50_ms": histogram_percentile(delivery["latency_buckets"], 0.5),
+        "delivery_latency_p99_ms": histogram_percentile(delivery["latency_buckets"], 0.99),
+        "delivery_latency_max_ms": histogram_percentile(delivery["latency_buckets"], 1.0),
+        "publish_mb_per_sec": round(delivery["bytes"] / 1024 / 1024 / (time_taken_publish_ms / 1000), 3),
+        "delivery_errors": delivery_errors,
+        "delivery_retries": delivery["retries"],
+        "producer_queue_full": delivery["queue_full"],
+        "partition_skew": partition_skew(delivery["partitions"]),
     }
     
     return publish_stats
@@ -0,0 +1,117 @@
+import json
+import random
+import time
+import uuid
+from glassflow_clickhouse_etl import errors, models, Pipeline
+from glassflow_clickhouse_etl.models import ClickhouseDataType, KafkaDataType
+from src.generate_events import PUBLISH_TIME_FIELD, create_kafka_producer
+from src.native_events import NativeEventGenerator
+from src.load_profile import parse_duration
+from src.utils.clickhouse import clickhouse_connection
+
+# Seconds between two polls of the pipeline status and of the sink table
+READINESS_POLL_INTERVAL = 0.2
+# Seconds between two sends of the canary when deduplication drops the extra ones
+CANARY_RESEND_INTERVAL = 1.0
+
+
+def canary_event(config: models.PipelineConfig, generator_schema: str):
+    """Event of the generator schema that can be found back in the sink table
+
+    The id field (the deduplication key, or else a field stored in a String or UUID column)
+    gets a fresh random id, and the publish time is 0, so the canary is left out of the
+    latency percentiles.
+
+    Returns:
+        tuple[dict, str, str | int]: The event, the column holding the id and the id
+    """
+    topic = config.source.topics[0]
+    generator = NativeEventGenerator(json.load(open(generator_schema)))
+    event = json.loads(generator.template % generator.generate_batch(1)[0])
+
+    field_types = {field.name: field.type for field in topic.event_schema.fields}
+    if topic.deduplication.enabled:
+        candidates = [topic.deduplication.id_field]
+    else:
+        candidates = [name for name, field_type in field_types.items() if field_type == KafkaDataType.STRING]
+    for mapping in config.sink.table_mapping:
+        if mapping.field_name not in candidates:
+            continue
+        if field_types[mapping.field_name] != KafkaDataType.STRING:
+            canary_id = random.getrandbits(31)
+        elif mapping.column_type in (ClickhouseDataType.STRING, ClickhouseDataType.UUID):
+            canary_id = str(uuid.uuid4())
+        else:
+            continue
+        event[mapping.field_name] = canary_id
+        event[PUBLISH_TIME_FIELD] = 0
+        return event, mapping.column_name, canary_id
+    raise ValueError("The sink table has no column to find the canary event in")
+
+
+def wait_until_running(host: str, pipeline_id: str, timeout: float):
+    """Poll the pipeline status until the pipeline is running"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if Pipeline(url=host).get_running_pipeline() == pipeline_id:
+                return
+        except errors.PipelineNotFoundError:
+            pass
+        time.sleep(READINESS_POLL_INTERVAL)
+    raise TimeoutError(f"Pipeline {pipeline_id} not running after {timeout}s")
+
+
+def wait_for_canary(config: models.PipelineConfig, generator_schema: str, timeout: float):
+    """Send a canary event to the source topic until it arrives in the sink table
+
+    A canary sent before the pipeline consumes is lost (the consumers start at the latest
+    offset), so it is resent until one arrives. With deduplication the pipeline drops every
+    resend once the first one went through, so the canary is resent every
+    `CANARY_RESEND_INTERVAL` seconds. Without deduplication a resend would end up in the
+    sink as well, so it is only resent after the max delay time of the sink, by which an
+    earlier canary that was consumed must have been flushed. A canary flushed later than
+    that is found while the resend is still on its way, so once the canary arrived after
+    several sends, it waits until no canary arrived for another resend interval: the row
+    count read as the baseline of the variant must not grow with canaries afterwards.
+    """
+    topic = config.source.topics[0]
+    event, column, canary_id = canary_event(config, generator_schema)
+    payload = json.dumps(event).encode("utf-8")
+    if topic.deduplication.enabled:
+        resend_interval = CANARY_RESEND_INTERVAL
+    else:
+        resend_interval = parse_duration(config.sink.max_delay_time) + 5
+
+    producer = create_kafka_producer(config.source)
+    deadline = time.time() + timeout
+    last_sent = 0.0
+    sends = 0
+    with clickhouse_connection(config.sink) as client:
+        def count_canaries():
+            return client.execute(
+                f"SELECT count() FROM {config.sink.table} WHERE {column} = %(canary_id)s",
+                {"canary_id": canary_id},
+            )[0][0]
+
+        while time.time() < deadline:
+            if time.time() - last_sent >= resend_interval:
+                producer.produce(topic.name, value=payload)
+                producer.flush()
+                last_sent = time.time()
+                sends += 1
+            found = count_canaries()
+            if found:
+                break
+            time.sleep(READINESS_POLL_INTERVAL)
+        else:
+            raise TimeoutError(f"Canary event did not arrive in {config.sink.table} within {timeout}s")
+
+        if topic.deduplication.enabled or sends == 1:
+            return
+        last_change = time.time()
+        while time.time() - last_change < resend_interval and time.time() < deadline:
+            time.sleep(READINESS_POLL_INTERVAL)
+            arrived = count_canaries()
+            if arrived != found:
+                found, last_change = arrived, time.time()
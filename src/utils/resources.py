@@ -0,0 +1,131 @@
+import atexit
+import base64
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, List, Optional
+
+# CA files written by this process, by base64 encoded root CA
+_ca_files: Dict[str, str] = {}
+_ca_lock = threading.Lock()
+_active_manager: Optional["ResourceManager"] = None
+
+
+def ca_file(root_ca: Optional[str]) -> Optional[str]:
+    """Path of a file holding the (base64 encoded) root CA, written once per process
+
+    Publisher processes forked after the file was written use the same file.
+    """
+    if not root_ca:
+        return None
+    with _ca_lock:
+        path = _ca_files.get(root_ca)
+        if path is None or not os.path.exists(path):
+            with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix=".pem") as ca_cert_file:
+                ca_cert_file.write(base64.b64decode(root_ca).decode("utf-8"))
+            path = _ca_files[root_ca] = ca_cert_file.name
+        return path
+
+
+def remove_ca_files():
+    """Delete the CA files written by this process"""
+    with _ca_lock:
+        for path in _ca_files.values():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        _ca_files.clear()
+
+
+# forked children leave through os._exit and do not run this, so they never delete the parent's files
+atexit.register(remove_ca_files)
+
+
+def active_resource_manager() -> Optional["ResourceManager"]:
+    """Resource manager of the running load test, None outside of one
+
+    A manager is only active in the process that entered it, processes forked from it
+    cannot use its clients and create their own.
+    """
+    if _active_manager is not None and _active_manager.pid == os.getpid():
+        return _active_manager
+    return None
+
+
+class ResourceManager:
+    """Kafka and ClickHouse clients shared by all variants of a load test
+
+    Thread safe clients (Kafka admin clients and producers) are created once per connection
+    and shared by all users. ClickHouse clients are not thread safe, they are lent to one
+    user at a time from a pool per connection, see `lend`. While the manager is active
+    (inside `with manager:`), `create_kafka_admin_client`, `create_kafka_producer` and
+    `clickhouse_connection` take their clients from it. Leaving it closes every client and
+    deletes the CA files.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._shared: Dict[Hashable, object] = {}
+        self._idle: Dict[Hashable, List] = {}
+        self._close_functions: Dict[Hashable, Callable] = {}
+
+    def __enter__(self):
+        global _active_manager
+        self._previous = _active_manager
+        _active_manager = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_manager
+        _active_manager = self._previous
+        self.close()
+
+    def shared(self, key: Hashable, factory: Callable, close: Callable = None):
+        """The client for `key`, created with `factory()` on first use"""
+        with self._lock:
+            if key not in self._shared:
+                self._shared[key] = factory()
+                if close is not None:
+                    self._close_functions[key] = close
+            return self._shared[key]
+
+    @contextmanager
+    def lend(self, key: Hashable, factory: Callable, close: Callable):
+        """Lend an idle client for `key` (or a new one from `factory()`) for a `with` block
+
+        The client goes back to the pool afterwards, unless the block raised, in which case
+        the client may be in a broken state and is closed.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            client = idle.pop() if idle else None
+            self._close_functions[key] = close
+        if client is None:
+            client = factory()
+        try:
+            yield client
+        except BaseException:
+            close(client)
+            raise
+        with self._lock:
+            self._idle[key].append(client)
+
+    def close(self):
+        """Close all clients and delete the CA files"""
+        with self._lock:
+            clients = [(key, client) for key, client in self._shared.items()]
+            clients += [(key, client) for key, idle in self._idle.items() for client in idle]
+            self._shared.clear()
+            self._idle.clear()
+        for key, client in clients:
+            close = self._close_functions.get(key)
+            if close is None:
+                continue
+            try:
+                close(client)
+            except Exception:
+                pass
+        remove_ca_files()
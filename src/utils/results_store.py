@@ -0,0 +1,177 @@
+import sqlite3
+import typing
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+# Database holding the results of all test IDs, next to their CSV files
+RESULTS_DB = "results.db"
+RESULTS_TABLE = "results"
+# a row per trial of a variant
+RESULTS_KEY = ("test_id", "variant_id", "trial")
+
+
+def _column_type(annotation) -> str:
+    """SQLite type of a model field, Optional fields map to the type they wrap"""
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if args:
+        annotation = args[0]
+    if annotation in (int, bool):
+        return "INTEGER"
+    if annotation is float:
+        return "REAL"
+    return "TEXT"
+
+
+class ResultsStore:
+    """Results of all tests in an SQLite database, one row per (test_id, variant_id, trial)
+
+    The columns follow the fields of `model`. Fields added to the model are added as
+    columns when the store is opened, columns of removed fields stay in the database and
+    are ignored. Writing the result of a trial again replaces its row.
+    """
+
+    def __init__(self, db_path: Path, model: typing.Type[BaseModel]):
+        self.db_path = Path(db_path)
+        self.model = model
+        self.fields = list(model.model_fields)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._migrate()
+
+    def _connect(self) -> sqlite3.Connection:
+        # several stack processes write to the same database
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _migrate(self):
+        """Create the table and add the columns of new model fields
+
+        A table with another primary key, from before results had trials, is rebuilt with
+        the rows it holds, which keep the default key values of the new key columns.
+        """
+        columns = {name: _column_type(field.annotation) for name, field in self.model.model_fields.items()}
+        create_table = (
+            f"CREATE TABLE IF NOT EXISTS {RESULTS_TABLE} ("
+            + ", ".join(f"{name} {column_type}" for name, column_type in columns.items())
+            + f", PRIMARY KEY ({', '.join(RESULTS_KEY)}))"
+        )
+        with closing(self._connect()) as connection, connection:
+            connection.execute(create_table)
+            table_info = list(connection.execute(f"PRAGMA table_info({RESULTS_TABLE})"))
+            existing = [row[1] for row in table_info]
+            primary_key = tuple(row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5])
+            if primary_key != RESULTS_KEY:
+                self._rebuild(connection, create_table, existing)
+                existing = list(columns)
+            for name, column_type in columns.items():
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE {RESULTS_TABLE} ADD COLUMN {name} {column_type}")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {RESULTS_TABLE}_variant_id ON {RESULTS_TABLE} (variant_id)")
+
+    def _rebuild(self, connection: sqlite3.Connection, create_table: str, existing: List[str]):
+        """Recreate the table with the primary key of the model and copy its rows"""
+        kept = [name for name in existing if name in self.fields]
+        added = [name for name in RESULTS_KEY if name not in kept]
+        connection.execute(f"ALTER TABLE {RESULTS_TABLE} RENAME TO {RESULTS_TABLE}_old")
+        connection.execute(create_table)
+        connection.execute(
+            f"INSERT INTO {RESULTS_TABLE} ({', '.join(kept + added)}) "
+            f"SELECT {', '.join(kept + ['?' for _ in added])} FROM {RESULTS_TABLE}_old",
+            [self.model.model_fields[name].default for name in added],
+        )
+        connection.execute(f"DROP TABLE {RESULTS_TABLE}_old")
+
+    def write(self, results: List[BaseModel]):
+        """Insert or replace the rows of the given results"""
+        rows = []
+        for result in results:
+            values = result.model_dump()
+            rows.append([
+                values[name].isoformat() if isinstance(values[name], datetime) else values[name]
+                for name in self.fields
+            ])
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {RESULTS_TABLE} ({', '.join(self.fields)}) "
+                f"VALUES ({', '.join('?' for _ in self.fields)})",
+                rows,
+            )
+
+    def has_result(self, test_id: str, variant_id: str, trial: int = 1) -> bool:
+        """Whether a result of the trial was written, one primary key lookup"""
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                f"SELECT 1 FROM {RESULTS_TABLE} WHERE test_id = ? AND variant_id = ? AND trial = ?",
+                (test_id, variant_id, trial)
+            ).fetchone() is not None
+
+    def read_variant(self, test_id: str, variant_id: str, trial: int = 1) -> Optional[BaseModel]:
+        """Result of one trial of a variant, None if it has none"""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(self.fields)} FROM {RESULTS_TABLE} WHERE test_id = ? AND variant_id = ? AND trial = ?",
+                (test_id, variant_id, trial)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._to_model(dict(zip(self.fields, row)))
+
+    def read_trials(self, test_id: str, variant_id: str) -> List[BaseModel]:
+        """Results of all trials of a variant, by trial"""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(self.fields)} FROM {RESULTS_TABLE} WHERE test_id = ? AND variant_id = ? ORDER BY trial",
+                (test_id, variant_id)
+            ).fetchall()
+        return [self._to_model(dict(zip(self.fields, row))) for row in rows]
+
+    def count(self, test_id: str) -> int:
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                f"SELECT count() FROM {RESULTS_TABLE} WHERE test_id = ?", (test_id,)
+            ).fetchone()[0]
+
+    def query(self, columns: List[str] = None, test_ids: List[str] = None) -> List[Dict]:
+        """Raw values of the given columns (all fields by default), for all or the given test IDs"""
+        columns = columns or self.fields
+        sql = f"SELECT {', '.join(columns)} FROM {RESULTS_TABLE}"
+        params = []
+        if test_ids:
+            sql += f" WHERE test_id IN ({', '.join('?' for _ in test_ids)})"
+            params = list(test_ids)
+        sql += " ORDER BY test_id, timestamp"
+        with closing(self._connect()) as connection:
+            return [dict(zip(columns, row)) for row in connection.execute(sql, params)]
+
+    def read(self, test_id: str) -> List[BaseModel]:
+        """Results of a test as models, in the order they were measured"""
+        return [self._to_model(row) for row in self.query(test_ids=[test_id])]
+
+    def _to_model(self, row: Dict) -> BaseModel:
+        # columns added after a row was written are NULL, the field defaults apply
+        return self.model(**{name: value for name, value in row.items() if value is not None})
+
+    def export_csv_rows(self, test_id: str) -> List[Dict]:
+        """Rows of a test as written to its CSV file"""
+        return [result.to_csv_row() for result in self.read(test_id)]
+
+    def test_ids(self) -> List[str]:
+        with closing(self._connect()) as connection:
+            return [row[0] for row in connection.execute(f"SELECT DISTINCT test_id FROM {RESULTS_TABLE} ORDER BY test_id")]
+
+
+def parse_csv_row(model: typing.Type[BaseModel], row: Dict[str, str]) -> Optional[BaseModel]:
+    """Model of a row of a results CSV file written by any version of the load test
+
+    Empty values take the default of their field and columns the model does not know are
+    ignored. Returns None (after printing why) if the row still does not validate.
+    """
+    values = {name: value for name, value in row.items() if name in model.model_fields and value not in ("", None)}
+    try:
+        return model(**values)
+    except Exception as e:
+        print(f"Failed to parse row {row}: {e}")
+        return None
@@ -0,0 +1,132 @@
+import csv
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from glassflow_clickhouse_etl import models
+from src.utils.clickhouse import clickhouse_connection, read_clickhouse_row_count
+from src.utils.logger import log
+
+
+class ThroughputSampler:
+    """Background thread sampling published and sunk record counts during a variant
+
+    Every `interval` seconds a sample of (timestamp, published count, ClickHouse row count)
+    is recorded. The published count is read from a counter shared with the publisher
+    processes, the row count from the sink table.
+    """
+
+    def __init__(
+        self,
+        sink_config: models.SinkConfig,
+        published_counter,
+        start_time: float,
+        n_records_before: int = 0,
+        interval: float = 0.5,
+        count_mode: str = "system",
+    ):
+        self.sink_config = sink_config
+        self.published_counter = published_counter
+        self.start_time = start_time
+        self.n_records_before = n_records_before
+        self.interval = interval
+        self.count_mode = count_mode
+        self.samples: List[Dict] = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> List[Dict]:
+        """Stop sampling and return the collected samples"""
+        self._stop_event.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        # clickhouse_driver clients are not thread safe, the sampler uses its own
+        try:
+            with clickhouse_connection(self.sink_config) as client:
+                while True:
+                    self._take_sample(client)
+                    if self._stop_event.wait(self.interval):
+                        break
+                # always end with a sample taken after the drain finished
+                self._take_sample(client)
+        except Exception as e:
+            log(
+                message="Throughput sampler stopped",
+                status=str(e),
+                is_warning=True,
+                component="Sampler",
+            )
+
+    def _take_sample(self, client):
+        sunk = read_clickhouse_row_count(self.sink_config, client, self.count_mode) - self.n_records_before
+        now = time.time()
+        self.samples.append({
+            "timestamp": now,
+            "elapsed_sec": round(now - self.start_time, 3),
+            "published": self.published_counter.value,
+            "sunk": sunk,
+        })
+
+
+def write_timeseries(samples: List[Dict], timeseries_file: str):
+    """Write the samples of a variant to a CSV file"""
+    path = Path(timeseries_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["timestamp", "elapsed_sec", "published", "sunk"])
+        writer.writeheader()
+        writer.writerows(samples)
+
+
+def time_to_reach(samples: List[Dict], count: float) -> Optional[float]:
+    """Interpolated time at which the sunk count first reached `count`"""
+    if samples[0]["sunk"] >= count:
+        return samples[0]["timestamp"]
+    for prev, sample in zip(samples, samples[1:]):
+        if sample["sunk"] >= count:
+            if sample["sunk"] == prev["sunk"]:
+                return sample["timestamp"]
+            fraction = (count - prev["sunk"]) / (sample["sunk"] - prev["sunk"])
+            return prev["timestamp"] + fraction * (sample["timestamp"] - prev["timestamp"])
+    return None
+
+
+def sink_rps_stats(samples: List[Dict], window_sec: float = 1.0, steady_range=(0.1, 0.9)) -> Dict:
+    """Derive peak, mean and steady-state sink RPS from the samples
+
+    - peak: highest rate over any window of at least `window_sec` (the sink writes in
+      batches, so rates between two sub-second samples are meaningless)
+    - mean: all sunk records over the time from the first sample to the last record
+    - steady: rate between the moments the sink reached the lower and upper fraction
+      of its final count, which leaves out pipeline warm-up and the drain tail
+    """
+    stats = {"peak": None, "mean": None, "steady": None}
+    if len(samples) < 2 or samples[-1]["sunk"] <= 0:
+        return stats
+    total = samples[-1]["sunk"]
+
+    peak = 0.0
+    j = 0
+    for sample in samples:
+        while j + 1 < len(samples) and sample["timestamp"] - samples[j + 1]["timestamp"] >= window_sec:
+            j += 1
+        elapsed = sample["timestamp"] - samples[j]["timestamp"]
+        if elapsed >= window_sec:
+            peak = max(peak, (sample["sunk"] - samples[j]["sunk"]) / elapsed)
+    stats["peak"] = round(peak)
+
+    end_time = time_to_reach(samples, total)
+    if end_time is not None and end_time > samples[0]["timestamp"]:
+        stats["mean"] = round((total - samples[0]["sunk"]) / (end_time - samples[0]["timestamp"]))
+
+    low, high = (total * fraction for fraction in steady_range)
+    low_time, high_time = time_to_reach(samples, low), time_to_reach(samples, high)
+    if low_time is not None and high_time is not None and high_time > low_time:
+        stats["steady"] = round((high - low) / (high_time - low_time))
+    return stats
@@ -0,0 +1,143 @@
+import csv
+from collections import deque
+from pathlib import Path
+from typing import Dict, List
+from glassflow_clickhouse_etl import models
+from src.utils.clickhouse import read_clickhouse_latency_percentiles
+from src.utils.sampler import ThroughputSampler
+from src.utils.logger import log
+from src.generate_events import PUBLISH_TIME_FIELD
+
+WINDOW_FIELDS = [
+    "window", "start_sec", "end_sec", "published", "sunk", "published_rps", "sink_rps", "backlog",
+    "latency_p50_ms", "latency_p90_ms", "latency_p99_ms", "latency_max_ms",
+]
+
+
+class SoakMonitor(ThroughputSampler):
+    """Throughput sampler for soak tests that reduces its samples to windowed metrics on the fly
+
+    Every `window_sec` the samples of the window are reduced to one row of metrics (publish
+    and sink throughput, estimated backlog and the latency percentiles of the rows inserted
+    during the window), which is appended to `windows_file` and logged right away. Only the
+    last sample and a few running aggregates are kept in memory, so memory use does not
+    grow with the duration of the soak test.
+
+    Duplicates never reach the sink, so the backlog is estimated from the published count
+    scaled by `unique_ratio` (unique records / published records).
+    """
+
+    def __init__(
+        self,
+        sink_config: models.SinkConfig,
+        published_counter,
+        start_time: float,
+        windows_file: str,
+        n_records_before: int = 0,
+        interval: float = 0.5,
+        count_mode: str = "system",
+        window_sec: float = 60,
+        unique_ratio: float = 1.0,
+        trend_windows: int = 5,
+    ):
+        super().__init__(sink_config, published_counter, start_time, n_records_before, interval, count_mode)
+        self.windows_file = Path(windows_file)
+        self.window_sec = window_sec
+        self.unique_ratio = unique_ratio
+        self._window_start = None
+        self._windows = 0
+        # aggregates over the windows during which events were published
+        self._active_windows = 0
+        self._sink_rps_sum = 0.0
+        self._sink_rps_min = None
+        self._sink_rps_max = None
+        self._latency_p99_max = None
+        self._first_sink_rps: List[float] = []
+        self._last_sink_rps = deque(maxlen=trend_windows)
+
+    def _take_sample(self, client):
+        super()._take_sample(client)
+        sample = self.samples[-1]
+        # only the last sample is kept
+        self.samples = [sample]
+        if self._window_start is None:
+            self._window_start = sample
+            return
+        elapsed = sample["timestamp"] - self._window_start["timestamp"]
+        # the sample taken when stopping closes the last, partial window
+        if elapsed >= self.window_sec or (self._stop_event.is_set() and elapsed > 0):
+            self._close_window(client, self._window_start, sample)
+            self._window_start = sample
+
+    def _close_window(self, client, first: Dict, last: Dict):
+        duration = last["timestamp"] - first["timestamp"]
+        latency = read_clickhouse_latency_percentiles(
+            self.sink_config, client, PUBLISH_TIME_FIELD, since=first["timestamp"], until=last["timestamp"]
+        )
+        window = {
+            "window": self._windows,
+            "start_sec": first["elapsed_sec"],
+            "end_sec": last["elapsed_sec"],
+            "published": last["published"],
+            "sunk": last["sunk"],
+            "published_rps": round((last["published"] - first["published"]) / duration),
+            "sink_rps": round((last["sunk"] - first["sunk"]) / duration),
+            "backlog": max(round(last["published"] * self.unique_ratio - last["sunk"]), 0),
+            "latency_p50_ms": latency["p50"],
+            "latency_p90_ms": latency["p90"],
+            "latency_p99_ms": latency["p99"],
+            "latency_max_ms": latency["max"],
+        }
+        self._write_window(window)
+        self._windows += 1
+        if window["published_rps"] > 0:
+            self._add_to_summary(window)
+        log(
+            message=f"Window {window['window']} ({window['end_sec']}s): publish {window['published_rps']} records/s, "
+                    f"sink {window['sink_rps']} records/s, backlog {window['backlog']}, p99 {window['latency_p99_ms']} ms",
+            status="Measured",
+            is_success=True,
+            component="Soak",
+        )
+
+    def _write_window(self, window: Dict):
+        new_file = self._windows == 0
+        if new_file:
+            self.windows_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.windows_file, 'w' if new_file else 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=WINDOW_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(window)
+
+    def _add_to_summary(self, window: Dict):
+        sink_rps = window["sink_rps"]
+        self._active_windows += 1
+        self._sink_rps_sum += sink_rps
+        self._sink_rps_min = sink_rps if self._sink_rps_min is None else min(self._sink_rps_min, sink_rps)
+        self._sink_rps_max = sink_rps if self._sink_rps_max is None else max(self._sink_rps_max, sink_rps)
+        if window["latency_p99_ms"] is not None:
+            self._latency_p99_max = max(self._latency_p99_max or 0, window["latency_p99_ms"])
+        if len(self._first_sink_rps) < self._last_sink_rps.maxlen:
+            self._first_sink_rps.append(sink_rps)
+        self._last_sink_rps.append(sink_rps)
+
+    def summary(self) -> Dict:
+        """Aggregates over the windows during which events were published
+
+        The throughput decay compares the mean sink throughput of the first and the last
+        `trend_windows` windows, in percent of the first.
+        """
+        decay = None
+        if self._active_windows > self._last_sink_rps.maxlen:
+            first = sum(self._first_sink_rps) / len(self._first_sink_rps)
+            last = sum(self._last_sink_rps) / len(self._last_sink_rps)
+            decay = round((first - last) / first * 100, 2) if first > 0 else None
+        return {
+            "windows": self._windows,
+            "sink_rps_mean": round(self._sink_rps_sum / self._active_windows) if self._active_windows else None,
+            "sink_rps_min": self._sink_rps_min,
+            "sink_rps_max": self._sink_rps_max,
+            "latency_p99_max_ms": self._latency_p99_max,
+            "throughput_decay_pct": decay,
+        }
@@ -0,0 +1,157 @@
+import itertools
+import math
+import random
+from statistics import mean, median, stdev
+from typing import Dict, List, Optional
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentile `q` (0 to 1) of the values, linearly interpolated between ranks"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = q * (len(ordered) - 1)
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (rank - low) * (ordered[high] - ordered[low])
+
+
+def distribution(values: List[float]) -> Dict:
+    """Summary of a latency distribution"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "mean": round(mean(values), 3),
+        "p50": round(percentile(values, 0.5), 3),
+        "p90": round(percentile(values, 0.9), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def theil_sen_slope(values: List[float]) -> Optional[float]:
+    """Median of the slopes between all pairs of values, against their index
+
+    Unlike a least squares fit, a few outliers do not move the slope.
+    """
+    slopes = [
+        (values[j] - values[i]) / (j - i)
+        for i in range(len(values))
+        for j in range(i + 1, len(values))
+    ]
+    return median(slopes) if slopes else None
+
+
+def mann_kendall_z(values: List[float]) -> Optional[float]:
+    """Mann-Kendall trend statistic of the values in their order
+
+    Positive for an upward trend, above 1.96 the trend is significant at the 5% level
+    (two-sided). Ties are not corrected for.
+    """
+    n = len(values)
+    if n < 3:
+        return None
+    s = sum(
+        (values[j] > values[i]) - (values[j] < values[i])
+        for i in range(n)
+        for j in range(i + 1, n)
+    )
+    variance = n * (n - 1) * (2 * n + 5) / 18
+    if s == 0:
+        return 0.0
+    return (s - math.copysign(1, s)) / math.sqrt(variance)
+
+
+def wilson_lower_bound(successes: int, trials: int, z: float = 1.96) -> Optional[float]:
+    """Lower bound of the Wilson score interval of a success probability (95% for z=1.96)"""
+    if trials == 0:
+        return None
+    p = successes / trials
+    center = p + z * z / (2 * trials)
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials))
+    return (center - margin) / (1 + z * z / trials)
+
+
+# two-sided 95% critical values of Student's t distribution by degrees of freedom, the
+# normal value 1.96 is used above the table
+_T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def trial_summary(values: List[float]) -> Dict:
+    """Mean, standard deviation, range and 95% confidence interval of the mean of repeated trials
+
+    The interval uses Student's t distribution, it needs at least two values.
+    """
+    if not values:
+        return {"mean": None, "stddev": None, "min": None, "max": None, "ci95_low": None, "ci95_high": None}
+    center = mean(values)
+    deviation = stdev(values) if len(values) > 1 else None
+    margin = None
+    if deviation is not None:
+        degrees = len(values) - 1
+        t = _T_CRITICAL_95[degrees - 1] if degrees <= len(_T_CRITICAL_95) else 1.96
+        margin = t * deviation / math.sqrt(len(values))
+    return {
+        "mean": round(center, 3),
+        "stddev": round(deviation, 3) if deviation is not None else None,
+        "min": round(min(values), 3),
+        "max": round(max(values), 3),
+        "ci95_low": round(center - margin, 3) if margin is not None else None,
+        "ci95_high": round(center + margin, 3) if margin is not None else None,
+    }
+
+
+def permutation_p_value(baseline: List[float], candidate: List[float], max_permutations: int = 10000,
+                        seed: int = 0) -> Optional[float]:
+    """One-sided p-value of the candidate values being larger than the baseline values
+
+    Permutation test of the difference in means: the share of relabelings of the pooled
+    values with a difference at least as large as the observed one. All relabelings are
+    used when there are at most `max_permutations`, otherwise a seeded random sample of them.
+    None when either side has fewer than two values.
+    """
+    if len(baseline) < 2 or len(candidate) < 2:
+        return None
+    pooled = baseline + candidate
+    n = len(candidate)
+    observed = mean(candidate) - mean(baseline)
+    total = sum(pooled)
+
+    def difference(candidate_sum: float) -> float:
+        return candidate_sum / n - (total - candidate_sum) / len(baseline)
+
+    if math.comb(len(pooled), n) <= max_permutations:
+        sums = [sum(pooled[i] for i in chosen) for chosen in itertools.combinations(range(len(pooled)), n)]
+        return sum(difference(s) >= observed - 1e-12 for s in sums) / len(sums)
+    rng = random.Random(seed)
+    extreme = sum(difference(sum(rng.sample(pooled, n))) >= observed - 1e-12 for _ in range(max_permutations))
+    # the observed labeling counts as one of the sampled relabelings
+    return (extreme + 1) / (max_permutations + 1)
+
+
+def sign_flip_p_value(differences: List[float], max_permutations: int = 10000, seed: int = 0) -> Optional[float]:
+    """One-sided p-value of paired differences being positive on the whole
+
+    Sign-flip permutation test: the share of sign assignments with a mean at least as large
+    as the observed one, exact for up to log2(`max_permutations`) differences. None without
+    differences.
+    """
+    n = len(differences)
+    if n == 0:
+        return None
+    observed = mean(differences)
+    if 2 ** n <= max_permutations:
+        flips = itertools.product([1, -1], repeat=n)
+        means = [sum(s * d for s, d in zip(signs, differences)) / n for signs in flips]
+        return sum(m >= observed - 1e-12 for m in means) / len(means)
+    rng = random.Random(seed)
+    extreme = sum(
+        sum(d if rng.random() < 0.5 else -d for d in differences) / n >= observed - 1e-12
+        for _ in range(max_permutations)
+    )
+    return (extreme + 1) / (max_permutations + 1)
@@ -0,0 +1,291 @@
+import csv
+import json
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from src.utils.logger import log
+
+RESOURCE_FIELDS = [
+    "timestamp", "elapsed_sec", "target", "cpu_sec", "cpu_pct", "rss_mb",
+    "net_rx_mb", "net_tx_mb", "disk_read_mb", "disk_write_mb",
+]
+# compose services of the components of the stack in docker-compose.yaml
+COMPONENT_SERVICES = {
+    "kafka": ["kafka"],
+    "glassflow": ["app", "nats"],
+    "clickhouse": ["clickhouse"],
+}
+PUBLISHERS = "publishers"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1024 * 1024
+# docker bridges and the veth ends of containers, their traffic is the containers' own
+VIRTUAL_INTERFACE_PREFIXES = ("docker", "br-", "veth")
+
+
+def _read_key_values(path: str) -> Dict[str, int]:
+    """Lines of `key value` or `key: value` pairs, like cpu.stat and /proc/<pid>/io"""
+    values = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.replace(":", " ").split()
+            if len(parts) == 2 and parts[1].isdigit():
+                values[parts[0]] = int(parts[1])
+    return values
+
+
+def _read_net_dev(pid, skip_virtual: bool = False) -> Dict[str, int]:
+    """Bytes received and sent on all interfaces but loopback of the network namespace of a process
+
+    With `skip_virtual`, docker bridges and veth interfaces are left out as well.
+    """
+    rx = tx = 0
+    with open(f"/proc/{pid}/net/dev") as f:
+        for line in list(f)[2:]:
+            interface, counters = line.split(":", 1)
+            interface = interface.strip()
+            if interface == "lo" or (skip_virtual and interface.startswith(VIRTUAL_INTERFACE_PREFIXES)):
+                continue
+            counters = counters.split()
+            rx += int(counters[0])
+            tx += int(counters[8])
+    return {"net_rx": rx, "net_tx": tx}
+
+
+def _process_stats() -> Dict[int, Dict]:
+    """Parent, CPU time in seconds (children reaped included) and RSS of every process"""
+    stats = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat") as f:
+                # the command name can contain spaces, the fields follow its closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        stats[int(entry.name)] = {
+            "ppid": int(fields[1]),
+            "cpu": sum(int(value) for value in fields[11:15]) / CLOCK_TICKS,
+            "rss": int(fields[21]) * PAGE_SIZE,
+        }
+    return stats
+
+
+def read_process_tree(root_pid: int) -> Dict[str, float]:
+    """Resource counters of a process and all its descendants
+
+    The CPU time includes the children that already exited and were reaped, so it keeps
+    counting the publisher processes after they finished. The disk I/O only covers the
+    running processes, the network the whole network namespace of the process, bridges and
+    veth interfaces left out.
+    """
+    stats = _process_stats()
+    children: Dict[int, List[int]] = {}
+    for pid, stat in stats.items():
+        children.setdefault(stat["ppid"], []).append(pid)
+    tree, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        if pid in stats:
+            tree.append(pid)
+            pending.extend(children.get(pid, []))
+    counters = {
+        "cpu": sum(stats[pid]["cpu"] for pid in tree),
+        "rss": sum(stats[pid]["rss"] for pid in tree),
+        "disk_read": 0,
+        "disk_write": 0,
+    }
+    for pid in tree:
+        try:
+            io = _read_key_values(f"/proc/{pid}/io")
+        except OSError:
+            continue
+        counters["disk_read"] += io.get("read_bytes", 0)
+        counters["disk_write"] += io.get("write_bytes", 0)
+    # the publishers share the host namespace with the bridges of the local stack, whose
+    # traffic would count the containers' traffic a second time
+    counters.update(_read_net_dev(root_pid, skip_virtual=True))
+    return counters
+
+
+def read_container(cgroup_dir: str, pid: int) -> Dict[str, float]:
+    """Resource counters of a container from its cgroup (v2) and its network namespace"""
+    io = {"disk_read": 0, "disk_write": 0}
+    with open(os.path.join(cgroup_dir, "io.stat")) as f:
+        for line in f:
+            values = dict(pair.split("=") for pair in line.split()[1:] if "=" in pair)
+            io["disk_read"] += int(values.get("rbytes", 0))
+            io["disk_write"] += int(values.get("wbytes", 0))
+    memory = _read_key_values(os.path.join(cgroup_dir, "memory.stat"))
+    return {
+        "cpu": _read_key_values(os.path.join(cgroup_dir, "cpu.stat"))["usage_usec"] / 1e6,
+        # anonymous memory, the page cache of the container is left out like in the RSS of a process
+        "rss": memory.get("anon", 0),
+        **io,
+        **_read_net_dev(pid),
+    }
+
+
+def compose_containers(compose_file: str) -> Dict[str, Dict]:
+    """Cgroup directory and main PID of the running containers of a compose file, by service
+
+    Uses the docker CLI. Containers whose cgroup cannot be read (cgroup v1, or docker
+    running in a VM) are left out.
+    """
+    output = subprocess.run(
+        ["docker", "compose", "-f", compose_file, "ps", "--format", "json"],
+        capture_output=True, text=True, check=True, timeout=30,
+    ).stdout.strip()
+    # older compose versions print an array, newer ones a JSON object per line
+    entries = json.loads(output) if output.startswith("[") else [json.loads(line) for line in output.splitlines() if line]
+    containers = {}
+    for entry in entries:
+        pid = int(subprocess.run(
+            ["docker", "inspect", "--format", "{{.State.Pid}}", entry["ID"]],
+            capture_output=True, text=True, check=True, timeout=30,
+        ).stdout.strip() or 0)
+        if not pid:
+            continue
+        try:
+            with open(f"/proc/{pid}/cgroup") as f:
+                cgroup = next(line.split("::", 1)[1].strip() for line in f if line.startswith("0::"))
+        except (OSError, StopIteration):
+            continue
+        cgroup_dir = os.path.join("/sys/fs/cgroup", cgroup.lstrip("/"))
+        if os.path.exists(os.path.join(cgroup_dir, "cpu.stat")):
+            containers[entry["Service"]] = {"pid": pid, "cgroup_dir": cgroup_dir}
+    return containers
+
+
+class ResourceSampler:
+    """Background thread sampling CPU, memory, network and disk I/O during a variant
+
+    The publishers are this process and all its descendants, the containers are the
+    running services of `compose_file` (if given). Every `interval` seconds a row per
+    target is appended to `resources_file` with the counters since the sampler started and
+    the CPU usage since the previous sample (100% is one core). Only the first and last
+    counters and the peaks are kept in memory.
+    """
+
+    def __init__(self, start_time: float, resources_file: str = None, compose_file: str = None,
+                 interval: float = 1.0):
+        self.start_time = start_time
+        self.resources_file = Path(resources_file) if resources_file else None
+        self.compose_file = compose_file
+        self.interval = interval
+        self.containers: Dict[str, Dict] = {}
+        self.first: Dict[str, Dict] = {}
+        self.last: Dict[str, Dict] = {}
+        self.max_cpu_pct: Dict[str, float] = {}
+        self.max_rss: Dict[str, float] = {}
+        self._last_time: Optional[float] = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.compose_file:
+            try:
+                self.containers = compose_containers(self.compose_file)
+            except Exception as e:
+                log(
+                    message=f"Containers of {self.compose_file} are not sampled: {str(e).strip() or type(e).__name__}",
+                    status="Skipped",
+                    is_warning=True,
+                    component="Telemetry",
+                )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        if self.resources_file:
+            self.resources_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.resources_file, 'w', newline='') as f:
+                csv.DictWriter(f, fieldnames=RESOURCE_FIELDS).writeheader()
+        try:
+            while True:
+                self._take_sample()
+                if self._stop_event.wait(self.interval):
+                    break
+            self._take_sample()
+        except Exception as e:
+            log(
+                message="Resource sampler stopped",
+                status=str(e),
+                is_warning=True,
+                component="Telemetry",
+            )
+
+    def _read_targets(self) -> Dict[str, Dict]:
+        counters = {PUBLISHERS: read_process_tree(os.getpid())}
+        for service, container in list(self.containers.items()):
+            try:
+                counters[service] = read_container(container["cgroup_dir"], container["pid"])
+            except (OSError, KeyError):
+                # the container stopped, its counters are gone
+                del self.containers[service]
+        return counters
+
+    def _take_sample(self):
+        counters = self._read_targets()
+        now = time.time()
+        rows = []
+        for target, values in counters.items():
+            first = self.first.setdefault(target, values)
+            previous = self.last.get(target)
+            cpu_pct = None
+            if previous is not None and now > self._last_time:
+                cpu_pct = round(max(0.0, values["cpu"] - previous["cpu"]) / (now - self._last_time) * 100, 1)
+                self.max_cpu_pct[target] = max(self.max_cpu_pct.get(target, 0.0), cpu_pct)
+            self.max_rss[target] = max(self.max_rss.get(target, 0), values["rss"])
+            self.last[target] = values
+            rows.append({
+                "timestamp": now,
+                "elapsed_sec": round(now - self.start_time, 3),
+                "target": target,
+                "cpu_sec": round(values["cpu"] - first["cpu"], 3),
+                "cpu_pct": cpu_pct,
+                "rss_mb": round(values["rss"] / MB, 1),
+                **{
+                    f"{counter}_mb": round((values[counter] - first[counter]) / MB, 3)
+                    for counter in ("net_rx", "net_tx", "disk_read", "disk_write")
+                },
+            })
+        self._last_time = now
+        if self.resources_file:
+            with open(self.resources_file, 'a', newline='') as f:
+                csv.DictWriter(f, fieldnames=RESOURCE_FIELDS).writerows(rows)
+
+    def cpu_sec(self, target: str) -> Optional[float]:
+        if target not in self.first:
+            return None
+        return self.last[target]["cpu"] - self.first[target]["cpu"]
+
+    def summary(self, num_records: int) -> Dict[str, Dict]:
+        """CPU seconds per million records, peak CPU and peak memory of the publishers and components
+
+        A component sums its services; peaks of a component are the sum of the peaks of its
+        services, an upper bound of its peak.
+        """
+        groups = {PUBLISHERS: [PUBLISHERS], **COMPONENT_SERVICES}
+        summary = {}
+        for group, targets in groups.items():
+            targets = [target for target in targets if target in self.first]
+            if not targets:
+                continue
+            cpu_sec = sum(self.cpu_sec(target) for target in targets)
+            summary[group] = {
+                "cpu_sec": round(cpu_sec, 3),
+                "cpu_sec_per_million": round(cpu_sec / (num_records / 1e6), 3) if num_records else None,
+                "cpu_max_pct": round(sum(self.max_cpu_pct.get(target, 0.0) for target in targets), 1),
+                "rss_max_mb": round(sum(self.max_rss[target] for target in targets) / MB, 1),
+            }
+        return summary